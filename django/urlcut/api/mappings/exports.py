@@ -0,0 +1,65 @@
+"""
+Streaming encoders for the export of mappings.
+"""
+import csv
+import itertools
+import json
+import zlib
+
+from django.utils import timezone
+from rest_framework import serializers
+
+EXPORT_FIELDS = ['target', 'key', 'expiry_date', 'visits', 'is_active']
+
+_datetime_field = serializers.DateTimeField()
+
+
+def export_rows(queryset, chunk_size):
+    """
+    Yield chunks of export rows (lists of values of EXPORT_FIELDS) for the mappings of a queryset,
+    read through a server-side cursor fetching chunk_size rows at a time.
+    """
+    now = timezone.now()
+    values = queryset.values_list('target', 'key', 'expiry_date', 'visits').iterator(chunk_size=chunk_size)
+    while chunk := list(itertools.islice(values, chunk_size)):
+        yield [
+            [
+                target,
+                key,
+                _datetime_field.to_representation(expiry_date) if expiry_date else None,
+                visits,
+                expiry_date is None or now < expiry_date,
+            ]
+            for target, key, expiry_date, visits in chunk
+        ]
+
+
+def encode_ndjson(chunks):
+    """Encode chunks of export rows as NDJSON, one string per chunk."""
+    for chunk in chunks:
+        yield ''.join(json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in chunk)
+
+
+class _Echo:
+    """File-like object returning what is written to it, to get the lines of a csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def encode_csv(chunks):
+    """Encode chunks of export rows as CSV with a header, one string per chunk."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for chunk in chunks:
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def compress_gzip(content):
+    """Incrementally gzip-compress a stream of strings."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for data in content:
+        compressed = compressor.compress(data.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
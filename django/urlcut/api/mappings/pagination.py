@@ -0,0 +1,168 @@
+"""
+Pagination of the mappings API.
+"""
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    Cursor,
+    CursorPagination,
+)
+
+
+def estimate_count(queryset):
+    """Return the number of rows of a queryset as estimated by the query planner, without counting them."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def keyset_after(ordering, position):
+    """
+    Return the filter of the rows after the given position, in the given ordering: the rows whose ordering
+    fields compare greater (lower for descending fields) than the position, in lexicographic order. The first
+    field is bounded on its own as well, so that the index scan starts at the position.
+    """
+    def after(field, value, strict=True):
+        lookup = ('lt' if field.startswith('-') else 'gt') + ('' if strict else 'e')
+        return Q(**{f'{field.lstrip("-")}__{lookup}': value})
+
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+        condition |= equal & after(field, value)
+        equal &= Q(**{field.lstrip('-'): value})
+    return after(ordering[0], position[0], strict=False) & condition
+
+
+class MappingCursorPagination(CursorPagination):
+    """
+    Cursor pagination of mappings, ordered by id (default), created_at or visits through the ordering
+    query parameter. The total count is not computed, unless an estimate is requested with count=estimate.
+
+    DRF's cursor only holds the value of the first ordering field, and tells apart the rows with the same value
+    by an offset, which fails past offset_cutoff equal values (all the mappings of an import share their
+    created_at, most mappings have no visits). Here the cursor holds the values of all the ordering fields, the
+    position of the row within the (field, id) keyset, each page being read from the matching
+    (user, field, id) index. Mappings whose visits change between two pages may be skipped or repeated.
+    """
+    ordering = 'id'
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+        'created_at': ('created_at', 'id'),
+        '-created_at': ('-created_at', '-id'),
+        'visits': ('visits', 'id'),
+        '-visits': ('-visits', '-id'),
+    }
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        return self.orderings.get(request.query_params.get(self.ordering_query_param), (self.ordering,))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.estimated_count = None
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.estimated_count = estimate_count(queryset)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.decode_position(queryset.model, self.cursor)
+
+        # previous pages are read backwards from their cursor
+        ordering = [flip(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(keyset_after(ordering, position))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = bool(self.page), has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None and bool(self.page)
+        self.display_page_controls = self.has_next or self.has_previous
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0])))
+
+    def encode_position(self, instance):
+        """Return the position of a row, as the JSON list of the values of its ordering fields."""
+        fields = [instance._meta.get_field(field.lstrip('-')) for field in self.ordering]
+        return json.dumps([field.value_to_string(instance) for field in fields])
+
+    def decode_position(self, model, cursor):
+        """Return the values of the ordering fields held by a cursor, or None without cursor."""
+        if cursor is None or cursor.position is None:
+            return None
+        try:
+            values = json.loads(cursor.position)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError('Invalid position')
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.estimated_count is not None:
+            response.data = {'count': self.estimated_count, **response.data}
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties'] = {
+            'count': {
+                'type': 'integer',
+                'description': 'Estimated number of results, only with count=estimate',
+            },
+            **response_schema['properties'],
+        }
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.ordering_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Ordering of the results',
+                'schema': {'type': 'string', 'enum': list(self.orderings)},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Set to estimate to include an estimated count of the results',
+                'schema': {'type': 'string', 'enum': ['estimate']},
+            },
+        ]
@@ -1,8 +1,17 @@
+from django.db import models
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
-from apps.mappings.models import Mapping
+from apps.mappings.models import (
+    ClickRollup,
+    GuestMapping,
+    LifetimeVisitorSketch,
+    Mapping,
+    ShortenJob,
+    create_guest_mapping,
+)
 
 
 class BaseCreateMappingSerializer(serializers.ModelSerializer):
@@ -18,6 +27,16 @@ class BaseCreateMappingSerializer(serializers.ModelSerializer):
         return f"{self.context.get('request').build_absolute_uri('/')}{obj.key}"
 
 
+class GuestMappingSerializer(BaseCreateMappingSerializer):
+    """Serializer for the guest shortener view, when guest mappings are stored apart."""
+
+    class Meta(BaseCreateMappingSerializer.Meta):
+        model = GuestMapping
+
+    def create(self, validated_data):
+        return create_guest_mapping(**validated_data)
+
+
 class CreateMappingSerializer(BaseCreateMappingSerializer):
     """Serializer for the shortener (create mapping) view."""
 
@@ -34,13 +53,77 @@ class CreateMappingSerializer(BaseCreateMappingSerializer):
         return attrs
 
 
+class MappingListSerializer(serializers.ListSerializer):
+    """List serializer estimating the unique visitors of all the mappings with one query."""
+
+    def to_representation(self, data):
+        mappings = list(data.all() if isinstance(data, models.Manager) else data)
+        estimates = LifetimeVisitorSketch.objects.unique_visitors(mappings)
+        for mapping in mappings:
+            mapping.unique_visitors = estimates[mapping.key]
+        return super().to_representation(mappings)
+
+
 class MappingSerializer(serializers.ModelSerializer):
     """Serializer for mapping listing and retrieval."""
     is_active = serializers.SerializerMethodField()
+    unique_visitors = serializers.SerializerMethodField()
 
     class Meta:
         model = Mapping
-        fields = ['target', 'key', 'expiry_date', 'visits', 'is_active']
+        fields = ['target', 'key', 'expiry_date', 'visits', 'is_active', 'unique_visitors']
+        list_serializer_class = MappingListSerializer
 
     def get_is_active(self, obj) -> bool:
         return obj.is_active
+
+    def get_unique_visitors(self, obj) -> int:
+        """Approximate number of distinct visitors (client IPs), as of the last click rollup."""
+        if not hasattr(obj, 'unique_visitors'):
+            obj.unique_visitors = LifetimeVisitorSketch.objects.unique_visitors([obj])[obj.key]
+        return obj.unique_visitors
+
+
+class ClickRollupSerializer(serializers.ModelSerializer):
+    """Serializer for a bucket of click statistics."""
+
+    class Meta:
+        model = ClickRollup
+        fields = ['bucket', 'count']
+
+
+class ClickStatsSerializer(serializers.Serializer):
+    """Serializer for the click statistics of a mapping."""
+    key = serializers.CharField()
+    granularity = serializers.ChoiceField(choices=ClickRollup.Granularity.choices)
+    unique_visitors = serializers.IntegerField(help_text=_('Approximate number of distinct visitors, by whole days'))
+    buckets = ClickRollupSerializer(many=True)
+
+
+class TrendingKeySerializer(serializers.Serializer):
+    """Serializer for a trending key."""
+    key = serializers.CharField()
+    count = serializers.IntegerField(help_text=_('Upper bound of the number of redirects'))
+    error = serializers.IntegerField(help_text=_('Max overestimation of the count'))
+
+
+class TrendingSerializer(serializers.Serializer):
+    """Serializer for the trending keys."""
+    window = serializers.IntegerField(help_text=_('Seconds of redirects counted'))
+    keys = TrendingKeySerializer(many=True)
+
+
+class ShortenJobSerializer(serializers.ModelSerializer):
+    """Serializer for the status and progress of a bulk shortening job."""
+    output_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShortenJob
+        fields = ['id', 'status', 'total', 'processed', 'failed', 'error', 'created_at', 'finished_at', 'output_url']
+        read_only_fields = fields
+
+    def get_output_url(self, obj) -> str:
+        if not obj.output:
+            return None
+        url = reverse('api:mappings:job-output', kwargs={'pk': obj.pk})
+        return self.context.get('request').build_absolute_uri(url)
@@ -1,31 +1,91 @@
 """
 Tests for the mappings API.
 """
+import csv
+import gzip
+import io
+import json
 import logging
+import tempfile
 from datetime import timedelta
-
-from django.test import TestCase
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.signals import (
+    request_finished,
+    request_started,
+)
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import (
+    TestCase,
+    override_settings,
+)
 from django.contrib.auth import get_user_model
+from django.db import close_old_connections
 from django.urls import reverse
 from django.utils import timezone
 
 from rest_framework.test import APIClient
 from rest_framework import status
-
-from apps.mappings.models import Mapping
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.mappings.pagination import MappingCursorPagination
+from apps.mappings.models import (
+    ClickRollup,
+    GuestMapping,
+    LifetimeVisitorSketch,
+    Mapping,
+    ShortenJob,
+    TrendingSketch,
+    TrendingTop,
+    VisitorSketch,
+)
+from apps.mappings.hll import HyperLogLog
+from urlcut.handlers import ASGIHandler
 
 logging.disable(logging.CRITICAL)
 
 
 CREATE_MAPPING_URL = reverse('api:mappings:shorten')
+BULK_CREATE_MAPPING_URL = reverse('api:mappings:bulk-shorten')
 CREATE_GUEST_MAPPING_URL = reverse('api:mappings:guest-shorten')
 KEY_LIST_URL = reverse('api:mappings:key-list')
+METRICS_URL = reverse('api:mappings:metrics')
+TRENDING_URL = reverse('api:mappings:trending')
+CREATE_JOB_URL = reverse('api:mappings:job-create')
+EXPORT_URL = reverse('api:mappings:export')
+
+
+def create_sketch(visitors):
+    """Return the registers of a sketch of the given visitors."""
+    sketch = HyperLogLog()
+    for visitor in visitors:
+        sketch.add(visitor)
+    return sketch.to_bytes()
+
+
+def create_visitor_sketch(key, day, visitors):
+    """Create and return the visitor sketch of a key for a day."""
+    return VisitorSketch.objects.create(key=key, bucket=day, registers=create_sketch(visitors))
+
+
+def key_stats_url(key):
+    """Create and return a mapping stats URL."""
+    return reverse('api:mappings:key-stats', kwargs={'key': key})
 
 
 def key_detail_url(key):
     return reverse('api:mappings:key-detail', kwargs={'key': key})
 
 
+def job_detail_url(job_id):
+    return reverse('api:mappings:job-detail', kwargs={'pk': job_id})
+
+
+def job_output_url(job_id):
+    return reverse('api:mappings:job-output', kwargs={'pk': job_id})
+
+
 def create_user(**params):
     """Create and return a new user."""
     return get_user_model().objects.create_user(**params)
@@ -61,15 +121,31 @@ class PublicUserApiTests(TestCase):
         self.assertIn('key', res.data)
         self.assertIn('short_url', res.data)
         self.assertTrue(len(res.data['short_url'].strip()) > 0)
-        self.assertEqual(Mapping.objects.count(), 1)
-        mapping = Mapping.objects.first()
+        self.assertEqual(Mapping.objects.count(), 0)
+        self.assertEqual(GuestMapping.objects.count(), 1)
+        mapping = GuestMapping.objects.first()
         self.assertEqual(mapping.target, payload['target'])
-        self.assertIsNone(mapping.user)
         self.assertTrue(mapping.is_active)
         self.assertAlmostEqual(
             mapping.expiry_date, in_24_hrs, delta=timedelta(minutes=1)
         )
 
+    @override_settings(MAPPING_GUEST_STORE='mapping')
+    def test_create_guest_mapping_in_mapping_store(self):
+        """Test creation of a guest mapping stored with the user mappings."""
+        res = self.client.post(CREATE_GUEST_MAPPING_URL, {'target': 'https://www.google.com'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        mapping = Mapping.objects.get(key=res.data['key'])
+        self.assertIsNone(mapping.user)
+        self.assertFalse(GuestMapping.objects.exists())
+
+    def test_bulk_create_mappings_unauthorized(self):
+        """Test authentication is required to create mappings in bulk."""
+        res = self.client.post(BULK_CREATE_MAPPING_URL, [], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
     def test_create_mapping_unauthorized(self):
         """Test authentication is required to create a mapping with full functionalities."""
         res = self.client.post(CREATE_MAPPING_URL)
@@ -81,6 +157,16 @@ class PublicUserApiTests(TestCase):
         res = self.client.get(KEY_LIST_URL)
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_export_unauthorized(self):
+        """Test authentication is required to export mappings."""
+        res = self.client.get(EXPORT_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_get_metrics_unauthorized(self):
+        """Test authentication is required to get the metrics."""
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
 
 class PrivateUserApiTest(TestCase):
     """Test API requests that require authentication."""
@@ -111,6 +197,31 @@ class PrivateUserApiTest(TestCase):
         self.assertEqual(mapping.user, self.user)
         self.assertTrue(mapping.is_active)
 
+    def test_create_mapping_dedup(self):
+        """Test creating a mapping with dedup returns the existing mapping of the same target."""
+        m = create_mapping(self.user, target='https://www.google.com/')
+
+        res = self.client.post(CREATE_MAPPING_URL + '?dedup=true', {'target': 'https://WWW.google.com'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['key'], m.key)
+        self.assertEqual(Mapping.objects.count(), 1)
+
+        res = self.client.post(CREATE_MAPPING_URL, {'target': 'https://www.google.com/'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Mapping.objects.count(), 2)
+
+    def test_create_mapping_dedup_different_expiry_date(self):
+        """Test creating a mapping with dedup inserts a new mapping when the expiry date differs."""
+        create_mapping(self.user)
+        payload = {
+            'target': 'https://www.google.com',
+            'expiry_date': timezone.now() + timedelta(days=1),
+        }
+        res = self.client.post(CREATE_MAPPING_URL + '?dedup=true', payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Mapping.objects.count(), 2)
+
     def test_create_mapping_with_empty_expiry_date(self):
         """Test successful creation of mapping passing empty expiry date."""
         payload = {
@@ -146,6 +257,57 @@ class PrivateUserApiTest(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_bulk_create_mappings(self):
+        """Test creation of a list of mappings in one request."""
+        payload = [
+            {'target': 'https://www.google.com'},
+            {'target': 'https://www.example.com', 'expiry_date': timezone.now() + timedelta(days=1)},
+        ]
+        res = self.client.post(BULK_CREATE_MAPPING_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['target'] for item in res.data], [item['target'] for item in payload])
+        self.assertEqual(Mapping.objects.filter(user=self.user).count(), 2)
+        for item in res.data:
+            mapping = Mapping.objects.get(key=item['key'])
+            self.assertEqual(mapping.target, item['target'])
+            self.assertTrue(item['short_url'].endswith(mapping.key))
+
+    def test_bulk_create_mappings_partial_errors(self):
+        """Test invalid items are reported in input order, while valid items are created."""
+        payload = [
+            {'target': 'not an url'},
+            {'target': 'https://www.google.com'},
+            {'target': 'https://www.google.com', 'expiry_date': timezone.now() - timedelta(days=1)},
+        ]
+        res = self.client.post(BULK_CREATE_MAPPING_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertIn('target', res.data[0]['errors'])
+        self.assertIn('key', res.data[1])
+        self.assertIn('expiry_date', res.data[2]['errors'])
+        self.assertEqual(Mapping.objects.count(), 1)
+
+    def test_bulk_create_mappings_all_invalid(self):
+        """Test nothing is created when all items are invalid."""
+        res = self.client.post(BULK_CREATE_MAPPING_URL, [{'target': ''}], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Mapping.objects.count(), 0)
+
+    def test_bulk_create_mappings_invalid_payload(self):
+        """Test the payload must be a non-empty list, with a limited number of items."""
+        res = self.client.post(BULK_CREATE_MAPPING_URL, {'target': 'https://www.google.com'}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(BULK_CREATE_MAPPING_URL, [], format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.settings(MAPPING_BULK_MAX_ITEMS=1):
+            payload = [{'target': 'https://www.google.com'}] * 2
+            res = self.client.post(BULK_CREATE_MAPPING_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_list_of_mappings(self):
         """Test getting the list of mappings for the authenticated user."""
         create_mapping(self.user)
@@ -153,8 +315,8 @@ class PrivateUserApiTest(TestCase):
 
         res = self.client.get(KEY_LIST_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn('count', res.data)
-        self.assertEqual(res.data['count'], 2)
+        self.assertNotIn('count', res.data)
+        self.assertEqual(len(res.data['results']), 2)
 
     def test_get_list_of_mapping_limited_to_user(self):
         """Test that the list of mappings contains only mappings of the authenticated user."""
@@ -169,7 +331,133 @@ class PrivateUserApiTest(TestCase):
 
         res = self.client.get(KEY_LIST_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(len(res.data['results']), 2)
+
+    def test_get_list_of_mappings_unique_visitors(self):
+        """Test the list of mappings estimates the unique visitors of each mapping, with one query."""
+        m1 = create_mapping(self.user)
+        m2 = create_mapping(self.user)
+        LifetimeVisitorSketch.objects.create(key=m1.key, started_at=m1.created_at, registers=create_sketch(['a', 'b']))
+        # visitors of a former mapping with the same key
+        LifetimeVisitorSketch.objects.create(key=m2.key, started_at=m2.created_at - timedelta(days=10),
+                                             registers=create_sketch(['c']))
+
+        with self.assertNumQueries(2):
+            res = self.client.get(KEY_LIST_URL)
+        unique_visitors = {item['key']: item['unique_visitors'] for item in res.data['results']}
+        self.assertEqual(unique_visitors, {m1.key: 2, m2.key: 0})
+
+    def test_get_list_of_mappings_pages(self):
+        """Test walking the pages of the list of mappings through their cursors."""
+        mappings = [create_mapping(self.user) for _ in range(3)]
+
+        keys = []
+        url = KEY_LIST_URL
+        with mock.patch.object(MappingCursorPagination, 'page_size', 2):
+            while url:
+                res = self.client.get(url)
+                keys += [item['key'] for item in res.data['results']]
+                url = res.data['next']
+        self.assertEqual(keys, [m.key for m in mappings])
+
+    def test_get_list_of_mappings_pages_with_equal_values(self):
+        """Test walking the pages forwards and backwards, when the mappings share the value of the ordering."""
+        mappings = [create_mapping(self.user) for _ in range(5)]
+
+        keys = []
+        url = KEY_LIST_URL + '?ordering=visits'
+        with mock.patch.object(MappingCursorPagination, 'page_size', 2):
+            while url:
+                res = self.client.get(url)
+                keys += [item['key'] for item in res.data['results']]
+                last_page, url = res.data, res.data['next']
+            previous_keys = []
+            url = last_page['previous']
+            while url:
+                res = self.client.get(url)
+                previous_keys = [item['key'] for item in res.data['results']] + previous_keys
+                url = res.data['previous']
+        self.assertEqual(keys, [m.key for m in mappings])
+        self.assertEqual(previous_keys, [m.key for m in mappings[:4]])
+
+    def test_get_list_of_mappings_invalid_cursor(self):
+        """Test an invalid cursor is rejected."""
+        res = self.client.get(KEY_LIST_URL, {'ordering': 'created_at', 'cursor': 'cD0lNUIxJTVE'})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_list_of_mappings_ordering(self):
+        """Test ordering the list of mappings by visits."""
+        m1 = create_mapping(self.user, visits=5)
+        m2 = create_mapping(self.user, visits=10)
+
+        res = self.client.get(KEY_LIST_URL, {'ordering': '-visits'})
+        self.assertEqual([item['key'] for item in res.data['results']], [m2.key, m1.key])
+
+    def test_get_list_of_mappings_estimated_count(self):
+        """Test getting an estimated count with the list of mappings."""
+        create_mapping(self.user)
+
+        res = self.client.get(KEY_LIST_URL, {'count': 'estimate'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(res.data['count'], int)
+
+    def test_get_mapping_stats(self):
+        """Test getting the click statistics of a mapping of the authenticated user."""
+        m = create_mapping(self.user)
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        ClickRollup.objects.create(key=m.key, granularity='hour', bucket=hour - timedelta(hours=1), count=3)
+        ClickRollup.objects.create(key=m.key, granularity='hour', bucket=hour, count=2)
+        ClickRollup.objects.create(key=m.key, granularity='day', bucket=hour.replace(hour=0), count=5)
+        # clicks on a former mapping with the same key
+        ClickRollup.objects.create(key=m.key, granularity='hour', bucket=hour - timedelta(days=1), count=7)
+        Mapping.objects.filter(id=m.id).update(created_at=hour - timedelta(hours=1))
+
+        res = self.client.get(key_stats_url(m.key), {'granularity': 'hour'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['granularity'], 'hour')
+        self.assertEqual([b['count'] for b in res.data['buckets']], [3, 2])
+
+    def test_get_mapping_stats_by_day_include_creation_day(self):
+        """Test the daily statistics include the day the mapping was created."""
+        m = create_mapping(self.user)
+        day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        ClickRollup.objects.create(key=m.key, granularity='day', bucket=day - timedelta(days=1), count=4)
+        ClickRollup.objects.create(key=m.key, granularity='day', bucket=day, count=5)
+        Mapping.objects.filter(id=m.id).update(created_at=day - timedelta(hours=12))
+
+        res = self.client.get(key_stats_url(m.key), {'granularity': 'day'})
+        self.assertEqual([b['count'] for b in res.data['buckets']], [4, 5])
+
+    def test_get_mapping_stats_unique_visitors(self):
+        """Test the click statistics estimate the unique visitors over the whole range."""
+        m = create_mapping(self.user)
+        day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        create_visitor_sketch(m.key, day - timedelta(days=1), ['a', 'b'])
+        create_visitor_sketch(m.key, day, ['b', 'c'])
+        Mapping.objects.filter(id=m.id).update(created_at=day - timedelta(days=1))
+
+        res = self.client.get(key_stats_url(m.key))
+        self.assertEqual(res.data['unique_visitors'], 3)
+        res = self.client.get(key_stats_url(m.key), {'since': day.isoformat()})
+        self.assertEqual(res.data['unique_visitors'], 2)
+
+    def test_get_mapping_stats_of_other_user(self):
+        """Test the click statistics of a mapping of another user are not found."""
+        user2 = create_user(email='test2@example.com', password='testpass123')
+        m = create_mapping(user2)
+
+        res = self.client.get(key_stats_url(m.key))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_mapping_stats_invalid_params(self):
+        """Test the click statistics with invalid parameters return errors."""
+        m = create_mapping(self.user)
+
+        res = self.client.get(key_stats_url(m.key), {'granularity': 'minute'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(key_stats_url(m.key), {'since': 'yesterday'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_get_mapping_detail(self):
         """Test getting the detail of a mapping of the authenticated user."""
@@ -178,6 +466,7 @@ class PrivateUserApiTest(TestCase):
         res = self.client.get(key_detail_url(m.key))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(m.key, res.data['key'])
+        self.assertEqual(res.data['unique_visitors'], 0)
 
     def test_get_mapping_detail_non_existing(self):
         """Test getting the detail of a non-existing key returns error."""
@@ -195,3 +484,180 @@ class PrivateUserApiTest(TestCase):
 
         res = self.client.get(key_detail_url(m.key))
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_create_job_from_list(self):
+        """Test submitting a list of items creates a job and schedules its processing."""
+        payload = [{'target': 'https://www.google.com'}, {'target': 'https://www.example.com'}]
+        with mock.patch('api.mappings.views.process_shorten_job.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(CREATE_JOB_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        job = ShortenJob.objects.get(id=res.data['id'])
+        self.assertEqual(job.user, self.user)
+        self.assertEqual(job.status, ShortenJob.Status.PENDING)
+        self.assertEqual(job.input_format, 'ndjson')
+        delay.assert_called_once_with(str(job.id))
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_create_job_from_file(self):
+        """Test uploading a CSV file creates a job."""
+        upload = SimpleUploadedFile('items.csv', b'target\nhttps://www.google.com\n', content_type='text/csv')
+        with mock.patch('api.mappings.views.process_shorten_job.delay'):
+            res = self.client.post(CREATE_JOB_URL, {'file': upload}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(ShortenJob.objects.get(id=res.data['id']).input_format, 'csv')
+
+    def test_create_job_without_items(self):
+        """Test submitting a job without items returns error."""
+        res = self.client.post(CREATE_JOB_URL, {}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_job_of_other_user(self):
+        """Test getting a job belonging to another user returns error."""
+        user2 = create_user(email='test2@example.com', password='testpass123')
+        job = ShortenJob.objects.create(user=user2, input='jobs/input/items.ndjson')
+
+        res = self.client.get(job_detail_url(job.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_job_output_not_ready(self):
+        """Test downloading the output of an unfinished job returns error."""
+        job = ShortenJob.objects.create(user=self.user, input='jobs/input/items.ndjson')
+
+        res = self.client.get(job_detail_url(job.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.data['output_url'])
+        res = self.client.get(job_output_url(job.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_ndjson(self):
+        """Test exporting the mappings of the authenticated user as NDJSON."""
+        user2 = create_user(email='test2@example.com', password='testpass123')
+        m1 = create_mapping(self.user)
+        m2 = create_mapping(self.user, expiry_date=timezone.now())
+        create_mapping(user2)
+
+        with self.settings(MAPPING_EXPORT_CHUNK_SIZE=1):
+            res = self.client.get(EXPORT_URL)
+            lines = b''.join(res.streaming_content).decode().splitlines()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        items = [json.loads(line) for line in lines]
+        self.assertEqual([item['key'] for item in items], [m1.key, m2.key])
+        self.assertEqual([item['is_active'] for item in items], [True, False])
+        self.assertIsNone(items[0]['expiry_date'])
+
+    def test_export_csv_gzip(self):
+        """Test exporting the mappings of the authenticated user as gzip-compressed CSV."""
+        m = create_mapping(self.user)
+
+        res = self.client.get(EXPORT_URL, {'file_format': 'csv', 'gzip': 'true'})
+        content = gzip.decompress(b''.join(res.streaming_content)).decode()
+
+        self.assertEqual(res['Content-Type'], 'application/gzip')
+        self.assertIn('mappings.csv.gz', res['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['key'], m.key)
+        self.assertEqual(rows[0]['target'], m.target)
+
+    def test_export_invalid_format(self):
+        """Test exporting with an unsupported format returns error."""
+        res = self.client.get(EXPORT_URL, {'file_format': 'xml'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_metrics_forbidden_to_non_admin(self):
+        """Test the metrics are available only to admin users."""
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_get_trending_forbidden_to_non_admin(self):
+        """Test the trending keys are available only to admin users."""
+        res = self.client.get(TRENDING_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AdminApiTest(TestCase):
+    """Test API requests that require an admin user."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser(
+            email='admin@example.com',
+            password='testpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_get_metrics(self):
+        """Test getting the metrics of the redirect path."""
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('cache', res.data)
+        self.assertIn('local_size', res.data['cache'])
+        self.assertEqual(res.data['sweeper']['lag'], 0)
+
+    def test_get_trending(self):
+        """Test getting the trending keys, merged from the sketches of the window."""
+        TrendingSketch.objects.create(counters={'abcdefg': [5, 0], 'bcdefgh': [2, 1]})
+        TrendingSketch.objects.create(counters={'bcdefgh': [6, 0]})
+
+        res = self.client.get(TRENDING_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['keys'], [
+            {'key': 'bcdefgh', 'count': 8, 'error': 1},
+            {'key': 'abcdefg', 'count': 5, 'error': 0},
+        ])
+
+    def test_get_trending_saved(self):
+        """Test getting the trending keys saved by the last refresh, shared by all processes."""
+        TrendingSketch.objects.create(counters={'abcdefg': [5, 0]})
+        TrendingTop.objects.create(keys=[['bcdefgh', 3, 0]])
+
+        res = self.client.get(TRENDING_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['keys'], [{'key': 'bcdefgh', 'count': 3, 'error': 0}])
+
+
+class AsgiExportTest(TestCase):
+    """Test the export streamed by the project's ASGI handler."""
+
+    def setUp(self):
+        # like the test client, keep the connection of the test transaction open across requests
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    async def test_export_under_asgi(self):
+        """Test the rows of the export are fetched off the event loop."""
+        user = await sync_to_async(create_user)(email='test@example.com', password='testpass123')
+        m = await sync_to_async(create_mapping)(user)
+        token = str(AccessToken.for_user(user))
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': EXPORT_URL,
+            'query_string': b'file_format=csv',
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await ASGIHandler()(scope, receive, send)
+
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        content = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+        self.assertEqual([row['key'] for row in csv.DictReader(io.StringIO(content))], [m.key])
+        self.assertNotIn('more_body', messages[-1])
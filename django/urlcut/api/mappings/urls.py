@@ -10,7 +10,15 @@ app_name = 'mappings'
 
 urlpatterns = [
     path('shorten/', views.ShortenURLApiView.as_view(), name='shorten'),
+    path('shorten/bulk/', views.BulkShortenURLApiView.as_view(), name='bulk-shorten'),
     path('guest_shorten/', views.GuestShortenURLApiView.as_view(), name='guest-shorten'),
     path('keys/<str:key>/', views.RetrieveMappingApiView.as_view(), name='key-detail'),
+    path('keys/<str:key>/stats/', views.MappingStatsApiView.as_view(), name='key-stats'),
     path('keys/', views.ListMappingsApiView.as_view(), name='key-list'),
+    path('export/', views.ExportMappingsApiView.as_view(), name='export'),
+    path('jobs/', views.CreateShortenJobApiView.as_view(), name='job-create'),
+    path('jobs/<uuid:pk>/', views.RetrieveShortenJobApiView.as_view(), name='job-detail'),
+    path('jobs/<uuid:pk>/output/', views.DownloadShortenJobOutputApiView.as_view(), name='job-output'),
+    path('trending/', views.TrendingMappingsApiView.as_view(), name='trending'),
+    path('metrics/', views.MappingsMetricsApiView.as_view(), name='metrics'),
 ]
@@ -1,20 +1,81 @@
+import json
 import logging
 from datetime import timedelta
 
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.http import (
+    FileResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from rest_framework.permissions import IsAuthenticated
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import (
+    OpenApiParameter,
+    extend_schema,
+)
+from rest_framework import (
+    serializers,
+    status,
+)
+from rest_framework.exceptions import (
+    NotFound,
+    ValidationError,
+)
+from rest_framework.parsers import (
+    JSONParser,
+    MultiPartParser,
+)
+from rest_framework.permissions import (
+    IsAuthenticated,
+    IsAdminUser,
+)
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.generics import (
+    GenericAPIView,
     CreateAPIView,
     RetrieveAPIView,
     ListAPIView,
 )
 
+from api.mappings.exports import (
+    compress_gzip,
+    encode_csv,
+    encode_ndjson,
+    export_rows,
+)
+from api.mappings.pagination import MappingCursorPagination
 from api.mappings.serializers import (
     BaseCreateMappingSerializer,
+    ClickStatsSerializer,
     CreateMappingSerializer,
+    GuestMappingSerializer,
     MappingSerializer,
+    ShortenJobSerializer,
+    TrendingSerializer,
+)
+from apps.mappings.cache import mapping_cache
+from apps.mappings.clicks import click_buffer
+from apps.mappings.keys import key_length
+from apps.mappings.models import (
+    ClickRollup,
+    Mapping,
+    ShortenJob,
+    VisitorSketch,
+    guest_store_enabled,
+)
+from apps.mappings.tasks import process_shorten_job
+from apps.mappings.traffic import traffic_counters
+from apps.mappings.trending import (
+    saved_trending,
+    top_trending,
+    trending_tracker,
 )
-from apps.mappings.models import Mapping
+from apps.mappings.visits import visit_buffer
 
 app_log = logging.getLogger('urlcut.apps.api')
 
@@ -22,20 +83,139 @@ app_log = logging.getLogger('urlcut.apps.api')
 class ShortenURLApiView(CreateAPIView):
     """
     Shorten a given URL, and optionally set an expiration date on the link.
+    With dedup=true, an active mapping of the user with the same target and expiration date is returned
+    instead of creating a new one.
     """
     serializer_class = CreateMappingSerializer
     permission_classes = [IsAuthenticated]
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('dedup', OpenApiTypes.BOOL, description='Return an existing mapping of the same URL'),
+        ],
+        responses={200: CreateMappingSerializer, 201: CreateMappingSerializer},
+    )
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.query_params.get('dedup') in ('1', 'true'):
+            mapping = Mapping.objects.find_duplicate(request.user, serializer.validated_data['target'],
+                                                     serializer.validated_data.get('expiry_date'))
+            if mapping is not None:
+                return Response(self.get_serializer(mapping).data, status=status.HTTP_200_OK)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
+class BulkShortenURLApiView(GenericAPIView):
+    """
+    Shorten a list of URLs at once, each one optionally with an expiration date.
+    For each item, in input order, the result is either the created mapping or its validation errors.
+    """
+    serializer_class = CreateMappingSerializer
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(request=CreateMappingSerializer(many=True), responses=CreateMappingSerializer(many=True))
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'non_field_errors': [_('Expected a non-empty list of items.')]})
+        if len(items) > settings.MAPPING_BULK_MAX_ITEMS:
+            raise ValidationError({
+                'non_field_errors': [_('Too many items, the maximum is %d.') % settings.MAPPING_BULK_MAX_ITEMS]
+            })
+
+        item_serializers = [self.get_serializer(data=item) for item in items]
+        valid = [serializer for serializer in item_serializers if serializer.is_valid()]
+        for serializer in valid:
+            serializer.instance = Mapping(user=request.user, **serializer.validated_data)
+        with transaction.atomic():
+            Mapping.objects.bulk_create([serializer.instance for serializer in valid])
+
+        results = [
+            {'errors': serializer.errors} if serializer.errors else serializer.data
+            for serializer in item_serializers
+        ]
+        if len(valid) == len(item_serializers):
+            status_code = status.HTTP_201_CREATED
+        elif valid:
+            status_code = status.HTTP_207_MULTI_STATUS
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+        return Response(results, status=status_code)
+
+
+class CreateShortenJobApiView(GenericAPIView):
+    """
+    Submit a (possibly very large) batch of URLs to shorten in the background, either as a JSON list of
+    items or as an uploaded CSV (with a header) or NDJSON file, the items having `target` and optionally
+    `expiry_date`. Poll the returned job for its status and progress, then download its output.
+    """
+    serializer_class = ShortenJobSerializer
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        if 'file' in request.FILES:
+            input_file = request.FILES['file']
+        elif isinstance(request.data, list) and request.data:
+            input_file = ContentFile(''.join(f'{json.dumps(item)}\n' for item in request.data), name='items.ndjson')
+        else:
+            raise ValidationError({
+                'non_field_errors': [_('Expected a non-empty list of items, or a file.')]
+            })
+
+        job = ShortenJob.objects.create(
+            user=request.user,
+            input=input_file,
+            base_url=request.build_absolute_uri('/'),
+        )
+        transaction.on_commit(lambda: process_shorten_job.delay(str(job.pk)))
+        serializer = self.get_serializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class RetrieveShortenJobApiView(RetrieveAPIView):
+    """
+    Get the status and progress of a bulk shortening job of the authenticated user.
+    """
+    serializer_class = ShortenJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ShortenJob.objects.filter(user=self.request.user)
+
+
+class DownloadShortenJobOutputApiView(RetrieveShortenJobApiView):
+    """
+    Download the output of a finished bulk shortening job, a CSV file with columns key, target, short_url
+    and error, one row per input item in input order.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        job = self.get_object()
+        if not job.output:
+            raise NotFound(_('The job has no output yet.'))
+        return FileResponse(job.output.open('rb'), as_attachment=True, filename=f'{job.pk}.csv',
+                            content_type='text/csv')
+
+
 class GuestShortenURLApiView(CreateAPIView):
     """
     Shorten a given URL anonymously (login not required). The mapping automatically expires after 24 hours.
     """
     serializer_class = BaseCreateMappingSerializer
 
+    def get_serializer_class(self):
+        return GuestMappingSerializer if guest_store_enabled() else BaseCreateMappingSerializer
+
     def perform_create(self, serializer):
         serializer.save(expiry_date=timezone.now() + timedelta(days=1))
 
@@ -53,12 +233,153 @@ class RetrieveMappingApiView(RetrieveAPIView):
         return Mapping.objects.filter(user=self.request.user)
 
 
+class MappingStatsApiView(APIView):
+    """
+    Get the number of clicks per hour or per day (granularity) on a given mapping key belonging to the
+    authenticated user, between since and until (by default, the last 2 days by hour or 90 days by day), with the
+    approximate number of unique visitors over the days of the range.
+    """
+    permission_classes = [IsAuthenticated]
+    default_ranges = {
+        ClickRollup.Granularity.HOUR: timedelta(days=2),
+        ClickRollup.Granularity.DAY: timedelta(days=90),
+    }
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('granularity', enum=ClickRollup.Granularity.values, description='Size of the buckets'),
+            OpenApiParameter('since', OpenApiTypes.DATETIME, description='Start of the statistics'),
+            OpenApiParameter('until', OpenApiTypes.DATETIME, description='End of the statistics'),
+        ],
+        responses=ClickStatsSerializer,
+    )
+    def get(self, request, key):
+        mapping = get_object_or_404(Mapping.objects.filter(user=request.user), key=key)
+        granularity = request.query_params.get('granularity', ClickRollup.Granularity.DAY)
+        if granularity not in ClickRollup.Granularity.values:
+            raise ValidationError({'granularity': [_('Unsupported granularity, use hour or day.')]})
+        until = self.get_datetime_param('until') or timezone.now()
+        since = self.get_datetime_param('since') or until - self.default_ranges[granularity]
+
+        # the rollups are kept by key: leave out the clicks on a former mapping with the same key, but keep the
+        # (UTC) bucket of the creation, and the bucket of since
+        since = self.truncate(max(since, mapping.created_at), granularity)
+        buckets = ClickRollup.objects.filter(
+            key=key, granularity=granularity, bucket__gte=since, bucket__lte=until
+        ).order_by('bucket')
+        # visitor sketches are kept by day, and merge into the sketch of the whole range
+        sketches = VisitorSketch.objects.filter(key=key, bucket__gt=since - timedelta(days=1), bucket__lte=until)
+        serializer = ClickStatsSerializer({
+            'key': key,
+            'granularity': granularity,
+            'unique_visitors': sketches.merged().count(),
+            'buckets': buckets,
+        })
+        return Response(serializer.data)
+
+    @staticmethod
+    def truncate(value, granularity):
+        """Return the start of the (UTC) bucket of the given granularity containing value."""
+        value = value.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if granularity == ClickRollup.Granularity.DAY:
+            value = value.replace(hour=0)
+        return value
+
+    def get_datetime_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return serializers.DateTimeField().to_internal_value(value)
+        except ValidationError as e:
+            raise ValidationError({name: e.detail})
+
+
 class ListMappingsApiView(ListAPIView):
     """
     Get the list of mappings for the authenticated user.
     """
     serializer_class = MappingSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = MappingCursorPagination
 
     def get_queryset(self):
         return Mapping.objects.filter(user=self.request.user).order_by('id')
+
+
+class ExportMappingsApiView(APIView):
+    """
+    Export all the mappings of the authenticated user as NDJSON (default) or CSV, optionally gzip-compressed.
+    """
+    permission_classes = [IsAuthenticated]
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('file_format', enum=['ndjson', 'csv'], description='Format of the export'),
+            OpenApiParameter('gzip', OpenApiTypes.BOOL, description='Compress the export with gzip'),
+        ],
+        responses={(200, 'application/octet-stream'): OpenApiTypes.BINARY},
+    )
+    def get(self, request):
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in self.content_types:
+            raise ValidationError({'file_format': [_('Unsupported format, use ndjson or csv.')]})
+
+        # the rows are read through a server-side cursor while streaming, so memory usage stays constant
+        # (under ASGI, the stream is produced off the event loop by urlcut.handlers.ASGIHandler)
+        rows = export_rows(Mapping.objects.filter(user=request.user).order_by('id'),
+                           settings.MAPPING_EXPORT_CHUNK_SIZE)
+        content = encode_csv(rows) if file_format == 'csv' else encode_ndjson(rows)
+        filename = f'mappings.{file_format}'
+        content_type = self.content_types[file_format]
+        if request.query_params.get('gzip') in ('1', 'true'):
+            content = compress_gzip(content)
+            filename += '.gz'
+            content_type = 'application/gzip'
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class TrendingMappingsApiView(APIView):
+    """
+    Get the most redirected keys over the last settings.MAPPING_TRENDING_WINDOW seconds, as merged by the last
+    refresh of the trending keys, or merged on the fly if there is none. Admin only.
+    """
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(responses=TrendingSerializer)
+    def get(self, request):
+        top = saved_trending()
+        if top is None:
+            top = top_trending()
+        serializer = TrendingSerializer({
+            'window': settings.MAPPING_TRENDING_WINDOW,
+            'keys': [{'key': key, 'count': count, 'error': error} for key, count, error in top],
+        })
+        return Response(serializer.data)
+
+
+class MappingsMetricsApiView(APIView):
+    """
+    Get the in-process metrics of the redirect path (for the process serving the request),
+    and the lag of the expiry sweeps. Admin only.
+    """
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    def get(self, request):
+        return Response({
+            'cache': mapping_cache.stats(),
+            'visits': visit_buffer.stats(),
+            'traffic': traffic_counters.snapshot(),
+            'keys': key_length.stats(),
+            'clicks': click_buffer.stats(),
+            'trending': trending_tracker.stats(),
+            'sweeper': {'lag': Mapping.objects.expiry_lag()},
+        })
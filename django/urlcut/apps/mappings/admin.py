@@ -1,8 +1,16 @@
 from django.contrib import admin
 
-from .models import Mapping
+from .models import (
+    Mapping,
+    ShortenJob,
+)
 
 
 @admin.register(Mapping)
 class MappingAdmin(admin.ModelAdmin):
     list_display = ['key', 'target']
+
+
+@admin.register(ShortenJob)
+class ShortenJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'processed', 'total', 'created_at']
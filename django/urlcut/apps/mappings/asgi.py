@@ -0,0 +1,97 @@
+"""
+ASGI fast path for the redirect from short URL to target URL.
+
+Requests to ``/<key>`` resolving to an active mapping are answered directly, without going through
+Django's request handling and middleware stack. Any other request, including keys that do not resolve,
+falls through to the wrapped Django application unchanged.
+"""
+from asgiref.sync import (
+    ThreadSensitiveContext,
+    sync_to_async,
+)
+from django.core import signals
+from django.utils.encoding import iri_to_uri
+
+from apps.mappings.clicks import record_click
+from apps.mappings.models import (
+    aresolve_target,
+    is_valid_key,
+)
+from apps.mappings.traffic import (
+    PURPOSE_HEADERS,
+    is_visit,
+)
+from apps.mappings.trending import record_trending
+from apps.mappings.visits import record_visit_in_background
+
+# headers sent with every redirect, mirroring those added by Django's middleware
+REDIRECT_HEADERS = [
+    (b'content-type', b'text/html; charset=utf-8'),
+    (b'content-length', b'0'),
+    (b'x-frame-options', b'DENY'),
+    (b'x-content-type-options', b'nosniff'),
+    (b'referrer-policy', b'same-origin'),
+]
+REDIRECT_BODY = {'type': 'http.response.body', 'body': b''}
+
+
+class ForwardToTargetApplication:
+    """ASGI application serving redirects for keys, in front of another ASGI application."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        key = self.get_key(scope)
+        entry = await self.resolve(scope, key) if key else None
+        if entry is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get('headers', []))
+        user_agent = headers.get(b'user-agent', b'').decode('latin-1')
+        purposes = [headers.get(name.encode(), b'').decode('latin-1') for name in PURPOSE_HEADERS]
+        target, _, guest = entry
+        # guest mappings do not count visits
+        if is_visit(scope['method'], user_agent, purposes) and not guest:
+            # after the response, outside of the context of the lookup
+            record_visit_in_background(key)
+        record_click(
+            key,
+            headers.get(b'referer', b'').decode('latin-1'),
+            user_agent,
+            (scope.get('client') or [''])[0],
+        )
+        record_trending(key)
+        await send({
+            'type': 'http.response.start',
+            'status': 302,
+            'headers': [(b'location', iri_to_uri(target).encode('latin-1')), *REDIRECT_HEADERS],
+        })
+        await send(REDIRECT_BODY)
+
+    async def resolve(self, scope, key):
+        """
+        Resolve a key like Django's ASGIHandler would handle the request: in a context of its own, so that
+        the queries of concurrent requests do not queue on a single thread, and between the request signals,
+        so that stale database connections are closed.
+        """
+        async with ThreadSensitiveContext():
+            await sync_to_async(signals.request_started.send)(sender=self.__class__, scope=scope)
+            try:
+                return await aresolve_target(key)
+            finally:
+                await sync_to_async(signals.request_finished.send)(sender=self.__class__)
+
+    @staticmethod
+    def get_key(scope):
+        """Return the key requested by a GET or HEAD request to ``/<key>``, if any."""
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return None
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        key = path[1:]
+        if not path.startswith('/') or not is_valid_key(key):
+            return None
+        return key
@@ -0,0 +1,170 @@
+"""
+Caching for the redirect path.
+
+Lookups go through a bounded in-process LRU first, then through a shared Django cache backend,
+and only then to the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from apps.mappings.metrics import Counters
+
+_MISSING = object()
+
+# marker cached for keys that do not resolve to an active mapping, other entries are
+# (target, expiry_date, guest) triples
+NOT_FOUND = (None, None, False)
+
+
+class LRUCache:
+    """Thread-safe, bounded, in-process LRU cache with a per-entry time to live (in seconds)."""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        if timeout <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCache:
+    """
+    An in-process LRU in front of a shared Django cache backend.
+
+    The local tier is sized by settings.MAPPING_LOCAL_CACHE_SIZE and its entries live at most
+    settings.MAPPING_LOCAL_CACHE_TIMEOUT seconds, which bounds how long other processes may serve
+    an entry after it has been invalidated. The shared tier uses the settings.MAPPING_CACHE_ALIAS
+    backend for at most settings.MAPPING_CACHE_TIMEOUT seconds. Invalidations only reach the other
+    processes through a backend they share: when that backend is local to each process (LocMemCache),
+    its entries live no longer than the local ones, so that the bound holds.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.counters = Counters()
+        self._local = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = LRUCache(settings.MAPPING_LOCAL_CACHE_SIZE, settings.MAPPING_LOCAL_CACHE_TIMEOUT)
+        return self._local
+
+    @property
+    def shared(self):
+        return caches[settings.MAPPING_CACHE_ALIAS]
+
+    def get(self, key):
+        value = self._get_local(key)
+        if value is _MISSING:
+            value = self._got_shared(key, self.shared.get(self.prefix + key, _MISSING))
+        return None if value is _MISSING else value
+
+    async def aget(self, key):
+        value = self._get_local(key)
+        if value is _MISSING:
+            value = self._got_shared(key, await self.shared.aget(self.prefix + key, _MISSING))
+        return None if value is _MISSING else value
+
+    def set(self, key, value, timeout=None):
+        timeout = self._timeout(timeout)
+        if timeout > 0:
+            self.local.set(key, value, timeout)
+            self.shared.set(self.prefix + key, value, timeout)
+
+    async def aset(self, key, value, timeout=None):
+        timeout = self._timeout(timeout)
+        if timeout > 0:
+            self.local.set(key, value, timeout)
+            await self.shared.aset(self.prefix + key, value, timeout)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(self.prefix + key)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.local.delete(key)
+        self.shared.delete_many([self.prefix + key for key in keys])
+
+    def _get_local(self, key):
+        value = self.local.get(key, _MISSING)
+        self.counters.incr('local_misses' if value is _MISSING else 'local_hits')
+        return value
+
+    def _got_shared(self, key, value):
+        if value is _MISSING:
+            self.counters.incr('shared_misses')
+        else:
+            self.counters.incr('shared_hits')
+            # negative entries keep their shorter time to live in the local tier as well
+            negative = tuple(value) == NOT_FOUND
+            self.local.set(key, value, settings.MAPPING_NEGATIVE_CACHE_TIMEOUT if negative else None)
+        return value
+
+    @property
+    def shared_is_local(self):
+        """Whether the shared tier is in fact local to each process, and not shared at all."""
+        return isinstance(self.shared, LocMemCache)
+
+    def _timeout(self, timeout):
+        max_timeout = settings.MAPPING_CACHE_TIMEOUT
+        if self.shared_is_local:
+            max_timeout = min(max_timeout, settings.MAPPING_LOCAL_CACHE_TIMEOUT)
+        if timeout is None:
+            return max_timeout
+        return int(min(timeout, max_timeout))
+
+    def clear(self):
+        """Drop the local tier (it is rebuilt from the settings on next use) and reset the counters."""
+        self._local = None
+        self.counters.reset()
+
+    def stats(self):
+        return {
+            'local_size': len(self.local),
+            'local_maxsize': self.local.maxsize,
+            **self.counters.snapshot(),
+        }
+
+
+# cache of key -> (target, expiry_date) for active mappings
+# the version in the prefix changes with the shape of the entries
+mapping_cache = TwoTierCache(prefix='mapping:2:')
@@ -0,0 +1,155 @@
+"""
+Click event log for the redirect path.
+
+With settings.MAPPING_CLICKS_ENABLED, every redirect enqueues a click event (key, time, referrer, user agent
+and hashed client IP) into an in-process buffer, without any I/O. A background thread writes the buffered
+events to the ClickEvent table with COPY, in batches of settings.MAPPING_CLICKS_BATCH_SIZE, every
+settings.MAPPING_CLICKS_FLUSH_INTERVAL seconds or as soon as a batch is full.
+The buffer holds at most settings.MAPPING_CLICKS_MAX_PENDING events: when the database falls behind, new
+events are dropped and counted, rather than slowing down redirects or exhausting memory.
+"""
+import atexit
+import csv
+import hashlib
+import io
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    close_old_connections,
+    connection,
+)
+from django.utils import timezone
+
+from apps.mappings.metrics import Counters
+from apps.mappings.models import ClickEvent
+
+app_log = logging.getLogger('urlcut.apps.mappings')
+
+# longer referrers and user agents are truncated
+CLICK_TEXT_MAX_LEN = 1024
+COPY_COLUMNS = ['key', 'timestamp', 'referrer', 'user_agent', 'ip_hash']
+
+
+def hash_ip(ip):
+    """Return a keyed hash of a client IP address, so that raw addresses are never stored."""
+    if not ip:
+        return ''
+    return hashlib.blake2b(ip.encode(), key=settings.SECRET_KEY.encode()[:64], digest_size=16).hexdigest()
+
+
+def copy_clicks(events):
+    """Insert click events, given as tuples of COPY_COLUMNS values, with one COPY."""
+    buffer = io.StringIO()
+    # quoting everything keeps empty strings apart from NULLs
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(events)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {ClickEvent._meta.db_table} ({", ".join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+
+
+class ClickBuffer:
+    """In-memory, per-process, bounded buffer of click events, flushed to the database by a background thread."""
+
+    def __init__(self):
+        self.counters = Counters()
+        self._events = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread_pid = None
+
+    @property
+    def pending(self):
+        return len(self._events)
+
+    def add(self, key, referrer='', user_agent='', ip=''):
+        """Enqueue a click event, return False if it is dropped because the buffer is full."""
+        event = (key, timezone.now(), referrer[:CLICK_TEXT_MAX_LEN], user_agent[:CLICK_TEXT_MAX_LEN], hash_ip(ip))
+        with self._lock:
+            if len(self._events) >= settings.MAPPING_CLICKS_MAX_PENDING:
+                self.counters.incr('dropped')
+                return False
+            self._events.append(event)
+            batch_full = len(self._events) >= settings.MAPPING_CLICKS_BATCH_SIZE
+        self.counters.incr('enqueued')
+        self._ensure_thread()
+        if batch_full:
+            self._wakeup.set()
+        return True
+
+    def drain(self):
+        """Return the pending events, emptying the buffer."""
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def flush(self):
+        """Write the pending events in batches, return the number of events written."""
+        events = self.drain()
+        batch_size = settings.MAPPING_CLICKS_BATCH_SIZE
+        written = 0
+        for i in range(0, len(events), batch_size):
+            try:
+                copy_clicks(events[i:i + batch_size])
+            except (DatabaseError, OSError) as e:
+                self.counters.incr('flush_errors')
+                app_log.error(f'ClickBuffer - Error writing {len(events) - i} click events: {e}')
+                self._requeue(events[i:])
+                break
+            written += len(events[i:i + batch_size])
+        if written:
+            self.counters.incr('flushes')
+            self.counters.incr('flushed', written)
+        return written
+
+    def _requeue(self, events):
+        """Put back unwritten events ahead of the new ones, dropping what does not fit in the buffer."""
+        with self._lock:
+            room = max(0, settings.MAPPING_CLICKS_MAX_PENDING - len(self._events))
+            self._events[:0] = events[:room]
+        if len(events) > room:
+            self.counters.incr('dropped', len(events) - room)
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            **self.counters.snapshot(),
+        }
+
+    def _ensure_thread(self):
+        # the flush thread does not survive a fork, so it is started once per process
+        interval = settings.MAPPING_CLICKS_FLUSH_INTERVAL
+        if not interval or self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, args=(interval,), name='clicks-flush', daemon=True).start()
+
+    def _run(self, interval):
+        # the thread is never restarted in this process, so it must survive any error
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                app_log.exception('ClickBuffer - Error in the flush thread')
+
+
+click_buffer = ClickBuffer()
+atexit.register(click_buffer.flush)
+
+
+def record_click(key, referrer='', user_agent='', ip=''):
+    """Log a click on the given key, if settings.MAPPING_CLICKS_ENABLED."""
+    if settings.MAPPING_CLICKS_ENABLED:
+        click_buffer.add(key, referrer, user_agent, ip)
@@ -0,0 +1,174 @@
+"""
+Enrichment of the click log: user agent parsing, bot classification and referrer domain normalization.
+
+Parsing is CPU-bound, so it runs in the Celery worker, on a pool of settings.MAPPING_ENRICH_WORKERS processes
+(one per core by default), never in the redirect path. The click events are read from a watermark, in batches
+of settings.MAPPING_ENRICH_BATCH_SIZE split into jobs of settings.MAPPING_ENRICH_CHUNK_SIZE events, and the
+results are written back with one UPDATE per job. User agents repeat a lot, so each pool process memoizes
+the parsing of the last settings.MAPPING_UA_CACHE_SIZE distinct ones.
+
+The pool processes are started by the task, which cannot happen in a daemonic worker process: the enrichment
+queue is served by a worker with the solo (or threads) pool.
+"""
+import functools
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import (
+    connection,
+    transaction,
+)
+
+from apps.mappings.models import (
+    ClickEvent,
+    Watermark,
+)
+from apps.mappings.rollups import committed_click_id
+from apps.mappings.traffic import BOT_PATTERN
+
+WATERMARK_NAME = 'click_enrichment'
+
+# the first match wins: tokens are ordered as browsers pretend to be each other
+BROWSER_PATTERNS = [
+    ('Edge', re.compile(r'Edg(e|A|iOS)?/')),
+    ('Opera', re.compile(r'OPR/|Opera')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser/')),
+    ('Firefox', re.compile(r'Firefox/|FxiOS/')),
+    ('Chrome', re.compile(r'Chrome/|CriOS/')),
+    ('Safari', re.compile(r'Safari/')),
+    ('Internet Explorer', re.compile(r'MSIE |Trident/')),
+]
+OS_PATTERNS = [
+    ('iOS', re.compile(r'iPhone|iPad|iPod')),
+    ('Android', re.compile(r'Android')),
+    ('Windows', re.compile(r'Windows')),
+    ('macOS', re.compile(r'Mac OS X|Macintosh')),
+    ('ChromeOS', re.compile(r'CrOS')),
+    ('Linux', re.compile(r'Linux')),
+]
+TABLET_PATTERN = re.compile(r'iPad|Tablet|Android(?!.*Mobile)')
+MOBILE_PATTERN = re.compile(r'Mobi|iPhone|iPod')
+
+OTHER = 'Other'
+
+UPDATE_COLUMNS = ['browser', 'os', 'device', 'is_bot', 'referrer_domain']
+
+
+def _first_match(patterns, user_agent):
+    return next((name for name, pattern in patterns if pattern.search(user_agent)), OTHER)
+
+
+@functools.lru_cache(maxsize=settings.MAPPING_UA_CACHE_SIZE)
+def parse_user_agent(user_agent):
+    """
+    Return the ``(browser, os, device, is_bot)`` of a user agent string, device being bot, mobile, tablet or
+    desktop. Empty user agents are classified as bots.
+    """
+    if not user_agent or BOT_PATTERN.search(user_agent):
+        return OTHER, OTHER, 'bot', True
+    if TABLET_PATTERN.search(user_agent):
+        device = 'tablet'
+    elif MOBILE_PATTERN.search(user_agent):
+        device = 'mobile'
+    else:
+        device = 'desktop'
+    return _first_match(BROWSER_PATTERNS, user_agent), _first_match(OS_PATTERNS, user_agent), device, False
+
+
+def referrer_domain(referrer):
+    """Return the lowercase host name of a referrer URL, without www. prefix, or an empty string."""
+    try:
+        host = urlsplit(referrer).hostname or ''
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def enrich_events(events):
+    """
+    Enrich ``(id, referrer, user_agent)`` click events, in a pool process. Return the ``(id, *UPDATE_COLUMNS)``
+    rows and the CPU time spent.
+    """
+    started = time.process_time()
+    rows = [(id_, *parse_user_agent(user_agent), referrer_domain(referrer)) for id_, referrer, user_agent in events]
+    return rows, time.process_time() - started
+
+
+def update_events(rows):
+    """Write enriched rows back to the click log, with one ``UPDATE ... FROM (VALUES ...)``."""
+    table = ClickEvent._meta.db_table
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rows))
+    assignments = ', '.join(f'{column} = v.{column}' for column in UPDATE_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET {assignments} '
+            f'FROM (VALUES {values}) AS v(id, {", ".join(UPDATE_COLUMNS)}) '
+            f'WHERE {table}.id = v.id',
+            [param for row in rows for param in row]
+        )
+
+
+class EnrichmentPool:
+    """Process pool of the enrichment, started on first use in each process and kept for the memoized parsing."""
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+
+    @property
+    def workers(self):
+        return settings.MAPPING_ENRICH_WORKERS or os.cpu_count() or 1
+
+    def map(self, func, chunks):
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor.map(func, chunks)
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = None
+
+
+enrichment_pool = EnrichmentPool()
+
+
+def enrich_clicks(batch_size, chunk_size):
+    """
+    Enrich the click events logged since the watermark, batch_size events per transaction, and return the
+    throughput statistics: events processed, wall and CPU seconds, and events per CPU second of a pool
+    process (per core, as pool processes run one per core).
+    """
+    upper = committed_click_id()
+    processed = 0
+    cpu_seconds = 0.0
+    started = time.monotonic()
+    while True:
+        with transaction.atomic():
+            watermark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+            if watermark.value >= upper:
+                break
+            end = min(watermark.value + batch_size, upper)
+            events = list(
+                ClickEvent.objects.filter(id__gt=watermark.value, id__lte=end)
+                .order_by('id').values_list('id', 'referrer', 'user_agent')
+            )
+            chunks = [events[i:i + chunk_size] for i in range(0, len(events), chunk_size)]
+            for rows, cpu_time in enrichment_pool.map(enrich_events, chunks):
+                update_events(rows)
+                processed += len(rows)
+                cpu_seconds += cpu_time
+            watermark.value = end
+            watermark.save(update_fields=['value'])
+    return {
+        'events': processed,
+        'workers': enrichment_pool.workers,
+        'seconds': round(time.monotonic() - started, 3),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'events_per_core_second': round(processed / cpu_seconds) if cpu_seconds else None,
+    }
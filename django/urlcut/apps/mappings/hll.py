@@ -0,0 +1,53 @@
+"""
+HyperLogLog sketches, estimating the number of distinct values added to them in a fixed amount of memory.
+"""
+import hashlib
+import math
+
+# 2 ** 11 one-byte registers: 2 KB per sketch, for a standard error of about 2.3%
+DEFAULT_PRECISION = 11
+
+
+class HyperLogLog:
+    """
+    A HyperLogLog sketch over 64-bit hashes. Sketches of the same precision merge losslessly, so the sketch
+    of a union of sets is the merge of their sketches.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls(precision=(len(data) - 1).bit_length())
+        sketch.registers[:] = data
+        return sketch
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = x >> (64 - self.precision)
+        # rank of the first 1 bit in the remaining bits
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precisions')
+        self.registers[:] = bytes(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
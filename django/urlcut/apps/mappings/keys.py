@@ -0,0 +1,190 @@
+"""
+Building blocks for the generation of mapping keys.
+"""
+import functools
+import hashlib
+import logging
+import os
+import string
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from apps.mappings.metrics import Counters
+
+app_log = logging.getLogger('urlcut.apps.mappings')
+
+KEY_CHARS = string.ascii_letters + string.digits
+KEY_MAX_LEN = 10
+
+# database sequence backing the 'sequence' key strategy, see migration 0003
+KEY_SEQUENCE_NAME = 'mapping_key_seq'
+# increment of the sequence: each nextval() reserves a block of indexes for the calling process
+KEY_SEQUENCE_BLOCK = 100
+
+
+def encode_key(n, length):
+    """Encode a non-negative integer lower than len(KEY_CHARS) ** length as a key of the given length."""
+    chars = []
+    for _ in range(length):
+        n, r = divmod(n, len(KEY_CHARS))
+        chars.append(KEY_CHARS[r])
+    if n:
+        raise ValueError(f'Value too large for a key of length {length}')
+    return ''.join(reversed(chars))
+
+
+class FeistelPermutation:
+    """
+    A keyed bijection over range(size): a balanced Feistel network over the smallest even number of bits
+    covering the range, applied repeatedly until the result falls within it (cycle walking).
+    """
+    rounds = 4
+
+    def __init__(self, size, secret):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.secret = hashlib.blake2b(f'{secret}:{size}'.encode(), digest_size=32).digest()
+
+    def __call__(self, n):
+        if not 0 <= n < self.size:
+            raise ValueError(f'{n} is out of range({self.size})')
+        n = self._encrypt(n)
+        while n >= self.size:
+            n = self._encrypt(n)
+        return n
+
+    def inverse(self, n):
+        if not 0 <= n < self.size:
+            raise ValueError(f'{n} is out of range({self.size})')
+        n = self._decrypt(n)
+        while n >= self.size:
+            n = self._decrypt(n)
+        return n
+
+    def _round(self, i, value):
+        digest = hashlib.blake2b(bytes([i]) + value.to_bytes(8, 'big'), key=self.secret, digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def _encrypt(self, n):
+        left, right = n >> self.half_bits, n & self.mask
+        for i in range(self.rounds):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, n):
+        left, right = n >> self.half_bits, n & self.mask
+        for i in reversed(range(self.rounds)):
+            left, right = right ^ self._round(i, left), left
+        return (left << self.half_bits) | right
+
+
+@functools.lru_cache(maxsize=None)
+def get_permutation(length, secret):
+    return FeistelPermutation(len(KEY_CHARS) ** length, secret)
+
+
+class KeySequence:
+    """
+    Indexes allocated from a database sequence, KEY_SEQUENCE_BLOCK at a time, so that a process
+    runs one query every KEY_SEQUENCE_BLOCK keys.
+    """
+
+    def __init__(self, name, block):
+        self.name = name
+        self.block = block
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop the indexes left in the current block."""
+        self._pid = os.getpid()
+        self._next = self._end = 0
+
+    def next_indexes(self, count):
+        indexes = []
+        with self._lock:
+            # a forked process must not reuse the block of its parent
+            if self._pid != os.getpid():
+                self.reset()
+            while len(indexes) < count:
+                if self._next >= self._end:
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT nextval(%s)', [self.name])
+                        self._next = cursor.fetchone()[0]
+                    self._end = self._next + self.block
+                take = min(count - len(indexes), self._end - self._next)
+                indexes.extend(range(self._next, self._next + take))
+                self._next += take
+        return indexes
+
+
+key_sequence = KeySequence(KEY_SEQUENCE_NAME, KEY_SEQUENCE_BLOCK)
+
+
+def create_sequence_keys(count=1, length=settings.DEFAULT_KEY_LEN):
+    """
+    Generate keys that are unique by construction: indexes from the key sequence are mapped through a
+    keyed permutation (see settings.MAPPING_KEY_SECRET), and then encoded. An index that does not fit
+    in the given length is encoded with the shortest length it fits in.
+    """
+    keys = []
+    for n in key_sequence.next_indexes(count):
+        key_len = length
+        while n >= len(KEY_CHARS) ** key_len:
+            key_len += 1
+        permutation = get_permutation(key_len, settings.MAPPING_KEY_SECRET)
+        keys.append(encode_key(permutation(n), key_len))
+    return keys
+
+
+class KeyLength:
+    """
+    Per-process length of the keys generated by the 'optimistic' strategy. It starts from
+    settings.DEFAULT_KEY_LEN and grows by one, up to KEY_MAX_LEN, whenever the share of insert
+    attempts failing on a key collision exceeds settings.MAPPING_KEY_GROWTH_THRESHOLD over a window
+    of settings.MAPPING_KEY_GROWTH_WINDOW attempts.
+    """
+
+    def __init__(self):
+        self.counters = Counters()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._length = None
+        self._attempts = self._collisions = 0
+        self.counters.reset()
+
+    @property
+    def current(self):
+        return self._length or settings.DEFAULT_KEY_LEN
+
+    def record(self, collision):
+        """Record the outcome of an insert attempt."""
+        self.counters.incr('attempts')
+        if collision:
+            self.counters.incr('collisions')
+        with self._lock:
+            self._attempts += 1
+            self._collisions += collision
+            if self._attempts < settings.MAPPING_KEY_GROWTH_WINDOW:
+                return
+            rate = self._collisions / self._attempts
+            self._attempts = self._collisions = 0
+            if rate > settings.MAPPING_KEY_GROWTH_THRESHOLD and self.current < KEY_MAX_LEN:
+                self._length = self.current + 1
+                self.counters.incr('growths')
+                app_log.warning(f'KeyLength - Collision rate {rate:.2%}, key length grown to {self._length}')
+
+    def stats(self):
+        return {
+            'length': self.current,
+            **self.counters.snapshot(),
+        }
+
+
+key_length = KeyLength()
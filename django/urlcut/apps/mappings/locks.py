@@ -0,0 +1,29 @@
+"""
+Database advisory locks, to keep periodic tasks from overlapping across workers.
+"""
+import contextlib
+import hashlib
+
+from django.db import connection
+
+
+def lock_id(name):
+    """Return the signed 64-bit advisory lock id for a lock name."""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+@contextlib.contextmanager
+def advisory_lock(name):
+    """
+    Try to take the session-level advisory lock with the given name, without waiting for it.
+    Yield whether the lock was taken; it is released on exit.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id(name)])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id(name)])
@@ -0,0 +1,230 @@
+import csv
+import io
+import json
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.core.validators import URLValidator
+from django.db import (
+    connection,
+    transaction,
+)
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.mappings.models import (
+    KEY_MAX_LEN,
+    Mapping,
+    existing_guest_keys,
+    hash_target,
+    is_valid_key,
+)
+
+STAGING_TABLE = 'mapping_import'
+TARGET_MAX_LEN = Mapping._meta.get_field('target').max_length
+
+
+class Command(BaseCommand):
+    help = (
+        "Import existing key/target mappings from a CSV (with header) or NDJSON file, with fields key, target "
+        "and optionally expiry_date and visits. Records are loaded in batches through COPY into a staging table, "
+        "then merged into the mappings: invalid records and conflicting keys are skipped and listed in "
+        "<path>.report.csv. Progress is saved to <path>.checkpoint after each batch, and an interrupted "
+        "import resumes from there."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the file to import")
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="Format of the file, by default detected from its extension")
+        parser.add_argument('--batch-size', type=int, default=100000, help="Number of records per batch")
+        parser.add_argument('--user', help="E-mail of the user owning the imported mappings")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of a previous import")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f"File '{path}' not found.")
+        input_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        user_id = None
+        if options['user']:
+            user = get_user_model().objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f"User '{options['user']}' not found.")
+            user_id = user.id
+
+        checkpoint_path = f'{path}.checkpoint'
+        report_path = f'{path}.report.csv'
+        progress = {'record': 0, 'inserted': 0, 'conflicts': 0, 'rejected': 0, 'report_size': 0}
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as f:
+                progress = json.load(f)
+            self.stdout.write(f"Resuming after record {progress['record']}.")
+        # drop what was reported after the checkpoint, it is going to be reported again
+        with open(report_path, 'a') as report_file:
+            report_file.truncate(progress['report_size'])
+
+        self.create_staging_table()
+        resume_after = last_record = progress['record']
+        started = time.monotonic()
+        done = 0
+        with open(report_path, 'a', newline='') as report_file:
+            report = csv.writer(report_file)
+            if report_file.tell() == 0:
+                report.writerow(['record', 'key', 'reason'])
+
+            rows = []
+            for record, item in read_records(path, input_format):
+                if record <= resume_after:
+                    continue
+                last_record = record
+                try:
+                    rows.append(validate_record(record, item))
+                except ValueError as e:
+                    report.writerow([record, item.get('key', '') if isinstance(item, dict) else '', str(e)])
+                    progress['rejected'] += 1
+                if len(rows) >= options['batch_size']:
+                    done += self.import_batch(rows, user_id, progress, report)
+                    self.save_checkpoint(checkpoint_path, progress, last_record, report_file)
+                    self.write_progress(progress, done, started)
+                    rows = []
+            done += self.import_batch(rows, user_id, progress, report)
+            self.save_checkpoint(checkpoint_path, progress, last_record, report_file)
+            self.write_progress(progress, done, started)
+
+        os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Import completed: {progress['inserted']} mappings inserted, {progress['conflicts']} conflicts, "
+            f"{progress['rejected']} invalid records. See {report_path} for details."
+        ))
+
+    def create_staging_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} ('
+                f'record bigint, key varchar({KEY_MAX_LEN}), target varchar({TARGET_MAX_LEN}), '
+                f'target_hash bigint, expiry_date timestamp with time zone, visits integer)'
+            )
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {STAGING_TABLE}_key ON {STAGING_TABLE} (key, record)')
+
+    def import_batch(self, rows, user_id, progress, report):
+        """
+        COPY a batch of rows into the staging table and merge it into the mappings, in one transaction.
+        Records whose key already exists, among the mappings or the guest mappings, or appears earlier in the
+        batch, are reported as conflicts.
+        """
+        if not rows:
+            return 0
+        count = len(rows)
+        # guest mappings stored apart are out of reach of the unique constraint on the keys
+        guest_keys = existing_guest_keys([row[1] for row in rows])
+        guest_conflicts = [(row[0], row[1], 'existing key') for row in rows if row[1] in guest_keys]
+        rows = [row for row in rows if row[1] not in guest_keys]
+        table = Mapping._meta.db_table
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {STAGING_TABLE}')
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} (record, key, target, target_hash, expiry_date, visits) '
+                f'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            cursor.execute(
+                f'SELECT s.record, s.key, '
+                f"CASE WHEN EXISTS (SELECT 1 FROM {table} m WHERE m.key = s.key) "
+                f"THEN 'existing key' ELSE 'duplicate key' END "
+                f'FROM {STAGING_TABLE} s '
+                f'WHERE EXISTS (SELECT 1 FROM {table} m WHERE m.key = s.key) '
+                f'OR EXISTS (SELECT 1 FROM {STAGING_TABLE} d WHERE d.key = s.key AND d.record < s.record) '
+                f'ORDER BY s.record'
+            )
+            conflicts = cursor.fetchall()
+            cursor.execute(
+                f'INSERT INTO {table} (key, target, target_hash, expiry_date, visits, created_at, user_id) '
+                f'SELECT DISTINCT ON (key) key, target, target_hash, expiry_date, visits, %s, %s '
+                f'FROM {STAGING_TABLE} ORDER BY key, record '
+                f'ON CONFLICT (key) DO NOTHING',
+                [timezone.now(), user_id]
+            )
+            inserted = cursor.rowcount
+        report.writerows(sorted(conflicts + guest_conflicts))
+        progress['inserted'] += inserted
+        progress['conflicts'] += count - inserted
+        return count
+
+    @staticmethod
+    def save_checkpoint(checkpoint_path, progress, last_record, report_file):
+        """Save the progress once the batch up to last_record is committed, replacing the checkpoint atomically."""
+        report_file.flush()
+        progress['record'] = last_record
+        progress['report_size'] = report_file.tell()
+        with open(f'{checkpoint_path}.tmp', 'w') as f:
+            json.dump(progress, f)
+        os.replace(f'{checkpoint_path}.tmp', checkpoint_path)
+
+    def write_progress(self, progress, done, started):
+        rate = done / max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            f"Record {progress['record']}: {progress['inserted']} inserted, {progress['conflicts']} conflicts, "
+            f"{progress['rejected']} invalid ({rate:.0f} records/s)"
+        )
+
+
+def read_records(path, input_format):
+    """Yield (record number, item) for each record of the file, the item being a dict or an error message."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if input_format == 'csv':
+            yield from enumerate(csv.DictReader(f), start=1)
+            return
+        record = 0
+        for line in f:
+            if not line.strip():
+                continue
+            record += 1
+            try:
+                yield record, json.loads(line)
+            except ValueError as e:
+                yield record, f'Invalid JSON: {e}'
+
+
+_validate_url = URLValidator()
+
+
+def validate_record(record, item):
+    """Return the staging row of a record, or raise ValueError with the reason why it is invalid."""
+    if not isinstance(item, dict):
+        raise ValueError(item if isinstance(item, str) else 'Invalid record')
+    key = item.get('key') or ''
+    if not is_valid_key(key):
+        raise ValueError('Invalid key')
+    target = item.get('target') or ''
+    try:
+        _validate_url(target)
+    except ValidationError:
+        raise ValueError('Invalid target URL')
+    if len(target) > TARGET_MAX_LEN:
+        raise ValueError('Target URL too long')
+
+    expiry_date = item.get('expiry_date') or None
+    if expiry_date is not None:
+        expiry_date = parse_datetime(expiry_date)
+        if expiry_date is None:
+            raise ValueError('Invalid expiry date')
+        if timezone.is_naive(expiry_date):
+            expiry_date = timezone.make_aware(expiry_date)
+        expiry_date = expiry_date.isoformat()
+    try:
+        visits = int(item.get('visits') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid visits')
+    if visits < 0:
+        raise ValueError('Invalid visits')
+    return record, key, target, hash_target(target), expiry_date or '', visits
@@ -0,0 +1,28 @@
+"""
+In-process metrics for the mappings app.
+"""
+import threading
+from collections import Counter
+
+
+class Counters:
+    """Thread-safe in-process counters, used for sizing and reporting."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counts[name] += value
+
+    def get(self, name):
+        return self._counts[name]
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0002_initial'),
+    ]
+
+    operations = [
+        # sequence for the 'sequence' key strategy, its increment must match keys.KEY_SEQUENCE_BLOCK
+        migrations.RunSQL(
+            sql='CREATE SEQUENCE mapping_key_seq MINVALUE 0 START WITH 0 INCREMENT BY 100',
+            reverse_sql='DROP SEQUENCE mapping_key_seq',
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mappings', '0003_mapping_key_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortenJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('input', models.FileField(upload_to='jobs/input/', verbose_name='Input file')),
+                ('output', models.FileField(blank=True, upload_to='jobs/output/', verbose_name='Output file')),
+                ('base_url', models.CharField(max_length=255, verbose_name='Base URL of the short URLs')),
+                ('total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Number of items')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Number of processed items')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Number of invalid items')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shorten_jobs', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'db_table': 'shorten_job',
+            },
+        ),
+    ]
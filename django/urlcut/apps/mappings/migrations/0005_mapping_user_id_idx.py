@@ -0,0 +1,20 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:01
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the index is built without blocking the writes to the mappings
+    atomic = False
+
+    dependencies = [
+        ('mappings', '0004_shortenjob'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='mapping',
+            index=models.Index(fields=['user', 'id'], name='mapping_user_id_idx'),
+        ),
+    ]
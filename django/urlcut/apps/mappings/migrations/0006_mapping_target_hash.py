@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0005_mapping_user_id_idx'),
+    ]
+
+    operations = [
+        # the hashes of the existing mappings are filled by 0020_fill_mapping_target_hash, in batches
+        migrations.AddField(
+            model_name='mapping',
+            name='target_hash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
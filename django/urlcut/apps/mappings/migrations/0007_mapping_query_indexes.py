@@ -0,0 +1,48 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:04
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+# the unique index is built without blocking the writes to the mappings, then attached as the constraint
+CREATE_KEY_INDEX_SQL = 'CREATE UNIQUE INDEX CONCURRENTLY mapping_key_uniq ON mapping (key) INCLUDE (target, expiry_date)'
+ADD_KEY_CONSTRAINT_SQL = 'ALTER TABLE mapping ADD CONSTRAINT mapping_key_uniq UNIQUE USING INDEX mapping_key_uniq'
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without blocking the writes to the mappings
+    atomic = False
+
+    dependencies = [
+        ('mappings', '0006_mapping_target_hash'),
+    ]
+
+    operations = [
+        # the covering unique constraint replaces the unique index on key, it is created first to keep keys unique
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql=CREATE_KEY_INDEX_SQL,
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS mapping_key_uniq',
+                ),
+                migrations.RunSQL(
+                    sql=ADD_KEY_CONSTRAINT_SQL,
+                    reverse_sql='ALTER TABLE mapping DROP CONSTRAINT mapping_key_uniq',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='mapping',
+                    constraint=models.UniqueConstraint(fields=('key',), include=('target', 'expiry_date'), name='mapping_key_uniq'),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='mapping',
+            name='key',
+            field=models.CharField(max_length=10, verbose_name='Key'),
+        ),
+        AddIndexConcurrently(
+            model_name='mapping',
+            index=models.Index(condition=models.Q(('expiry_date__isnull', False)), fields=['expiry_date'], name='mapping_expiry_date_idx'),
+        ),
+    ]
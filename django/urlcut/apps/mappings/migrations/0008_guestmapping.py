@@ -0,0 +1,57 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:10
+
+import datetime
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from apps.mappings.partitions import create_partitions
+
+# the primary key includes the partition key, as required by Postgres for partitioned tables
+CREATE_TABLE_SQL = '''
+CREATE TABLE guest_mapping (
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    target varchar(200) NOT NULL,
+    key varchar(10) NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    expiry_date timestamp with time zone NOT NULL,
+    PRIMARY KEY (id, expiry_date)
+) PARTITION BY RANGE (expiry_date);
+CREATE INDEX guest_mapping_key_idx ON guest_mapping (key) INCLUDE (target, expiry_date);
+CREATE TABLE guest_mapping_default PARTITION OF guest_mapping DEFAULT;
+'''
+
+
+def create_initial_partitions(apps, schema_editor):
+    create_partitions('guest_mapping', datetime.datetime.now(datetime.timezone.utc).date(), 4)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0007_mapping_query_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(sql=CREATE_TABLE_SQL, reverse_sql='DROP TABLE guest_mapping'),
+                migrations.RunPython(create_initial_partitions, migrations.RunPython.noop),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='GuestMapping',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('target', models.URLField(verbose_name='Target URL')),
+                        ('key', models.CharField(max_length=10, verbose_name='Key')),
+                        ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                        ('expiry_date', models.DateTimeField(verbose_name='Expiry date')),
+                    ],
+                    options={
+                        'db_table': 'guest_mapping',
+                    },
+                ),
+            ],
+        ),
+    ]
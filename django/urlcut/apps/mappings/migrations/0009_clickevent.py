@@ -0,0 +1,31 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0008_guestmapping'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=10, verbose_name='Key')),
+                ('timestamp', models.DateTimeField(verbose_name='Timestamp')),
+                ('referrer', models.TextField(blank=True, verbose_name='Referrer')),
+                ('user_agent', models.TextField(blank=True, verbose_name='User agent')),
+                ('ip_hash', models.CharField(blank=True, max_length=32, verbose_name='Hashed IP address')),
+            ],
+            options={
+                'db_table': 'click_event',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='clickevent',
+            index=models.Index(fields=['key', 'timestamp'], name='click_event_key_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0009_clickevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=10, verbose_name='Key')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4, verbose_name='Granularity')),
+                ('bucket', models.DateTimeField(verbose_name='Start of the bucket')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Number of clicks')),
+            ],
+            options={
+                'db_table': 'click_rollup',
+            },
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'watermark',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='clickrollup',
+            constraint=models.UniqueConstraint(fields=('key', 'granularity', 'bucket'), name='click_rollup_uniq'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0010_clickrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=10, verbose_name='Key')),
+                ('bucket', models.DateTimeField(verbose_name='Start of the day')),
+                ('registers', models.BinaryField(verbose_name='HyperLogLog registers')),
+            ],
+            options={
+                'db_table': 'visitor_sketch',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='visitorsketch',
+            constraint=models.UniqueConstraint(fields=('key', 'bucket'), name='visitor_sketch_uniq'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:23
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0011_visitorsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('counters', models.JSONField()),
+            ],
+            options={
+                'db_table': 'trending_sketch',
+            },
+        ),
+    ]
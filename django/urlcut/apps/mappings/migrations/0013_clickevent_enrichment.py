@@ -0,0 +1,38 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0012_trendingsketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickevent',
+            name='browser',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Browser'),
+        ),
+        migrations.AddField(
+            model_name='clickevent',
+            name='device',
+            field=models.CharField(blank=True, max_length=10, null=True, verbose_name='Device type'),
+        ),
+        migrations.AddField(
+            model_name='clickevent',
+            name='is_bot',
+            field=models.BooleanField(null=True, verbose_name='Bot'),
+        ),
+        migrations.AddField(
+            model_name='clickevent',
+            name='os',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Operating system'),
+        ),
+        migrations.AddField(
+            model_name='clickevent',
+            name='referrer_domain',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Referrer domain'),
+        ),
+    ]
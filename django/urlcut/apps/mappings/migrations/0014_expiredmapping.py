@@ -0,0 +1,31 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mappings', '0013_clickevent_enrichment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpiredMapping',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=10, verbose_name='Key')),
+                ('target', models.URLField(verbose_name='Target URL')),
+                ('visits', models.PositiveIntegerField(default=0, verbose_name='Number of visits')),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expired_mappings', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'db_table': 'expired_mapping',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0014_expiredmapping'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shortenjob',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
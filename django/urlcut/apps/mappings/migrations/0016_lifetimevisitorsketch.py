@@ -0,0 +1,49 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:55
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+from apps.mappings.hll import HyperLogLog
+
+
+def merge_daily_sketches(apps, schema_editor):
+    """Start the lifetime sketches from the daily sketches of the days of the mappings."""
+    Mapping = apps.get_model('mappings', 'Mapping')
+    VisitorSketch = apps.get_model('mappings', 'VisitorSketch')
+    LifetimeVisitorSketch = apps.get_model('mappings', 'LifetimeVisitorSketch')
+    created_at = dict(Mapping.objects.values_list('key', 'created_at').iterator())
+    sketches = {}
+    for key, bucket, registers in VisitorSketch.objects.values_list('key', 'bucket', 'registers').iterator():
+        if key in created_at and bucket + timedelta(days=1) > created_at[key]:
+            sketches.setdefault(key, HyperLogLog()).merge(HyperLogLog.from_bytes(registers))
+    LifetimeVisitorSketch.objects.bulk_create(
+        (
+            LifetimeVisitorSketch(key=key, started_at=created_at[key], registers=sketch.to_bytes())
+            for key, sketch in sketches.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0015_shortenjob_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LifetimeVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=10, unique=True, verbose_name='Key')),
+                ('started_at', models.DateTimeField(verbose_name='Creation of the mapping')),
+                ('registers', models.BinaryField(verbose_name='HyperLogLog registers')),
+            ],
+            options={
+                'db_table': 'lifetime_visitor_sketch',
+            },
+        ),
+        migrations.RunPython(merge_daily_sketches, migrations.RunPython.noop),
+    ]
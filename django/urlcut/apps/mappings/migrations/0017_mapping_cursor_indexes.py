@@ -0,0 +1,24 @@
+# Generated by Django 4.1.13 on 2026-10-18 20:12
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without blocking the writes to the mappings
+    atomic = False
+
+    dependencies = [
+        ('mappings', '0016_lifetimevisitorsketch'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='mapping',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='mapping_user_created_at_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='mapping',
+            index=models.Index(fields=['user', 'visits', 'id'], name='mapping_user_visits_id_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.13 on 2026-10-18 20:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mappings', '0018_trendingtop'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortenJobResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('key', models.CharField(blank=True, max_length=10)),
+                ('target', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='mappings.shortenjob')),
+            ],
+            options={
+                'db_table': 'shorten_job_result',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shortenjobresult',
+            constraint=models.UniqueConstraint(fields=('job', 'index'), name='shorten_job_result_job_index_uniq'),
+        ),
+    ]
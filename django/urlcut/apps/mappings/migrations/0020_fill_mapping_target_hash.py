@@ -0,0 +1,33 @@
+from django.db import migrations
+
+from apps.mappings.models import hash_target
+
+BATCH_SIZE = 1000
+
+
+def fill_target_hash(apps, schema_editor):
+    """Fill the hashes of the mappings in batches, each one in a transaction of its own."""
+    Mapping = apps.get_model('mappings', 'Mapping')
+    mappings = Mapping.objects.filter(target_hash__isnull=True).only('id', 'target').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(mappings.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            return
+        for mapping in batch:
+            mapping.target_hash = hash_target(mapping.target)
+        Mapping.objects.bulk_update(batch, ['target_hash'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+    # the rows are updated in short transactions, and an interrupted run resumes where it stopped
+    atomic = False
+
+    dependencies = [
+        ('mappings', '0019_shortenjobresult'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_target_hash, migrations.RunPython.noop),
+    ]
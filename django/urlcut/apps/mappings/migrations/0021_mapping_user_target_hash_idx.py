@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the index is built without blocking the writes to the mappings
+    atomic = False
+
+    dependencies = [
+        ('mappings', '0020_fill_mapping_target_hash'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='mapping',
+            index=models.Index(fields=['user', 'target_hash'], name='mapping_user_target_hash_idx'),
+        ),
+    ]
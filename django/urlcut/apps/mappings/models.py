@@ -1,22 +1,68 @@
+import contextlib
+import hashlib
 import secrets
-import string
+import uuid
+from datetime import timedelta
+from urllib.parse import (
+    urlsplit,
+    urlunsplit,
+)
 
-from django.db import models
+from django.core.cache import caches
+from django.db import (
+    IntegrityError,
+    connection,
+    models,
+    transaction,
+)
 from django.db.models import (
     F,
+    Min,
     Q,
 )
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from django.utils import timezone
 
+from apps.mappings.cache import (
+    NOT_FOUND,
+    mapping_cache,
+)
+from apps.mappings.hll import HyperLogLog
+from apps.mappings.keys import (
+    KEY_CHARS,
+    KEY_MAX_LEN,
+    create_sequence_keys,
+    key_length,
+)
+
+# max number of insert attempts with the 'optimistic' key strategy
+OPTIMISTIC_KEY_ATTEMPTS = 10
+
+
+# prefix of the guest mappings in the guest cache, with the 'cache' guest store
+GUEST_CACHE_PREFIX = 'guest:'
+
+DEFAULT_PORTS = {'http': '80', 'https': '443', 'ftp': '21'}
+
 
 def create_random_key(length=settings.DEFAULT_KEY_LEN):
     """
     Generate a random alphanumeric string of specified length, default to settings.DEFAULT_KEY_LEN.
     """
-    chars = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(chars) for _ in range(length))
+    return ''.join(secrets.choice(KEY_CHARS) for _ in range(length))
+
+
+def is_valid_key(key):
+    """
+    Cheaply check whether a string can be a key at all: its length must be between
+    settings.MAPPING_KEY_MIN_LEN and KEY_MAX_LEN, and its characters must come from KEY_CHARS.
+    """
+    return (
+        settings.MAPPING_KEY_MIN_LEN <= len(key) <= KEY_MAX_LEN
+        and key.isascii()
+        and key.isalnum()
+    )
 
 
 def create_unique_random_key(length=settings.DEFAULT_KEY_LEN):
@@ -24,11 +70,198 @@ def create_unique_random_key(length=settings.DEFAULT_KEY_LEN):
     Generate a random string of specified length, making sure it does not already exist among Mappings' keys.
     """
     new_key = create_random_key(length)
-    while Mapping.objects.filter(key=new_key).exists():
+    while key_exists(new_key):
         new_key = create_random_key(length)
     return new_key
 
 
+def guest_store_enabled():
+    """Whether guest mappings are stored apart from the user mappings (see settings.MAPPING_GUEST_STORE)."""
+    return settings.MAPPING_GUEST_STORE in ('partitioned', 'cache')
+
+
+def get_guest_cache():
+    return caches[settings.MAPPING_GUEST_CACHE_ALIAS]
+
+
+def get_guest_entry(key):
+    """Return the ``(target, expiry_date)`` pair of the active guest mapping with the given key, or None."""
+    if settings.MAPPING_GUEST_STORE == 'cache':
+        return get_guest_cache().get(f'{GUEST_CACHE_PREFIX}{key}')
+    if settings.MAPPING_GUEST_STORE == 'partitioned':
+        return GuestMapping.objects.active().filter(key=key).values_list('target', 'expiry_date').first()
+    return None
+
+
+async def aget_guest_entry(key):
+    """Asynchronous version of get_guest_entry()."""
+    if settings.MAPPING_GUEST_STORE == 'cache':
+        return await get_guest_cache().aget(f'{GUEST_CACHE_PREFIX}{key}')
+    if settings.MAPPING_GUEST_STORE == 'partitioned':
+        return await GuestMapping.objects.active().filter(key=key).values_list('target', 'expiry_date').afirst()
+    return None
+
+
+def existing_keys(keys):
+    """Return the given keys that are taken, by mappings or by guest mappings, with one database query."""
+    taken = Mapping.objects.filter(key__in=keys).values_list('key', flat=True)
+    if settings.MAPPING_GUEST_STORE == 'partitioned':
+        taken = taken.union(GuestMapping.objects.filter(key__in=keys).values_list('key', flat=True))
+    taken = set(taken)
+    if settings.MAPPING_GUEST_STORE == 'cache':
+        taken |= existing_guest_keys(keys)
+    return taken
+
+
+def existing_guest_keys(keys):
+    """
+    Return the given keys that are taken by guest mappings stored apart, out of reach of the unique constraint
+    on Mapping.key.
+    """
+    if settings.MAPPING_GUEST_STORE == 'cache':
+        found = get_guest_cache().get_many([f'{GUEST_CACHE_PREFIX}{key}' for key in keys])
+        return {cache_key[len(GUEST_CACHE_PREFIX):] for cache_key in found}
+    if settings.MAPPING_GUEST_STORE == 'partitioned':
+        return set(GuestMapping.objects.filter(key__in=keys).values_list('key', flat=True))
+    return set()
+
+
+def key_exists(key):
+    """Check whether a key is taken, by a mapping or by a guest mapping."""
+    return bool(existing_keys([key]))
+
+
+def create_guest_key():
+    """
+    Generate a key for a guest mapping. Guest mappings have no unique constraint on their key, which is
+    checked against the existing ones unless it comes from the key sequence.
+    """
+    if settings.MAPPING_KEY_STRATEGY == 'sequence':
+        return create_sequence_keys(1)[0]
+    return create_unique_random_key(key_length.current)
+
+
+def create_key():
+    """
+    Generate a new key according to settings.MAPPING_KEY_STRATEGY:
+    'random' for a random key checked against the existing ones, 'sequence' for a key unique by construction,
+    'optimistic' for a random key of the current key_length, checked against the guest mappings only
+    (see Mapping.save()).
+    """
+    if settings.MAPPING_KEY_STRATEGY == 'sequence':
+        return create_sequence_keys(1)[0]
+    if settings.MAPPING_KEY_STRATEGY == 'optimistic':
+        return create_random_key(key_length.current)
+    return create_unique_random_key()
+
+
+def create_keys(count):
+    """
+    Generate the given number of new keys in one pass, according to settings.MAPPING_KEY_STRATEGY.
+    Random keys are checked against the existing ones with one query per round.
+    """
+    if settings.MAPPING_KEY_STRATEGY == 'sequence':
+        return create_sequence_keys(count)
+
+    length = key_length.current if settings.MAPPING_KEY_STRATEGY == 'optimistic' else settings.DEFAULT_KEY_LEN
+    keys = set()
+    while len(keys) < count:
+        candidates = {create_random_key(length) for _ in range(count - len(keys))} - keys
+        keys |= candidates - existing_keys(candidates)
+    return list(keys)
+
+
+def is_key_collision(error):
+    """Check whether an IntegrityError comes from the unique constraint on Mapping.key."""
+    diag = getattr(error.__cause__, 'diag', None)
+    constraint_name = getattr(diag, 'constraint_name', None) or ''
+    return constraint_name.startswith(f'{Mapping._meta.db_table}_key_')
+
+
+def resolve_target(key):
+    """
+    Return the ``(target, expiry_date, guest)`` triple of the active mapping with the given key, or None,
+    ``guest`` telling whether the key is a guest mapping's, which does not count visits.
+    Strings that cannot be keys are rejected upfront; the lookup then goes through the mapping cache,
+    which also remembers unknown and expired keys for settings.MAPPING_NEGATIVE_CACHE_TIMEOUT seconds,
+    before hitting the database.
+    """
+    if not is_valid_key(key):
+        mapping_cache.counters.incr('rejected_keys')
+        return None
+
+    entry = mapping_cache.get(key)
+    if entry is None:
+        entry = Mapping.objects.active().filter(key=key).values_list('target', 'expiry_date').first()
+        guest = entry is None
+        if guest:
+            entry = get_guest_entry(key)
+        if entry is not None:
+            entry = (*entry, guest)
+        mapping_cache.set(key, *_cache_args(entry))
+    return _active_entry(entry)
+
+
+async def aresolve_target(key):
+    """Asynchronous version of resolve_target()."""
+    if not is_valid_key(key):
+        mapping_cache.counters.incr('rejected_keys')
+        return None
+
+    entry = await mapping_cache.aget(key)
+    if entry is None:
+        entry = await Mapping.objects.active().filter(key=key).values_list('target', 'expiry_date').afirst()
+        guest = entry is None
+        if guest:
+            entry = await aget_guest_entry(key)
+        if entry is not None:
+            entry = (*entry, guest)
+        await mapping_cache.aset(key, *_cache_args(entry))
+    return _active_entry(entry)
+
+
+def _cache_args(entry):
+    """Return the value and timeout to cache for a database lookup result."""
+    if entry is None:
+        return NOT_FOUND, settings.MAPPING_NEGATIVE_CACHE_TIMEOUT
+    expiry_date = entry[1]
+    if expiry_date is None:
+        return entry, None
+    return entry, (expiry_date - timezone.now()).total_seconds()
+
+
+def _active_entry(entry):
+    if entry is None:
+        return None
+    if entry[0] is None:
+        mapping_cache.counters.incr('negative_hits')
+        return None
+    if entry[1] is not None and entry[1] <= timezone.now():
+        return None
+    return tuple(entry)
+
+
+def normalize_target(target):
+    """
+    Normalize a target URL for comparison: lowercase scheme and host, no default port and '/' for an empty path.
+    """
+    parts = urlsplit(target)
+    scheme = parts.scheme.lower()
+    userinfo, at, host = parts.netloc.rpartition('@')
+    host = host.lower()
+    if host.endswith(f':{DEFAULT_PORTS.get(scheme)}'):
+        host = host.rpartition(':')[0]
+    return urlunsplit((scheme, f'{userinfo}{at}{host}', parts.path or '/', parts.query, parts.fragment))
+
+
+def hash_target(target):
+    """Return a fixed-size (signed 64-bit) hash of the normalized target URL, indexed for deduplication."""
+    if not target:
+        return None
+    digest = hashlib.blake2b(normalize_target(target).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
 class MappingQuerySet(models.QuerySet):
     """Mappings custom queryset."""
 
@@ -42,6 +275,39 @@ class MappingQuerySet(models.QuerySet):
             expiry_date__lte=timezone.now()
         )
 
+    def expiry_lag(self):
+        """Return the age in seconds of the oldest expired mapping, 0 if there is none."""
+        oldest = self.expired().aggregate(oldest=Min('expiry_date'))['oldest']
+        return (timezone.now() - oldest).total_seconds() if oldest else 0.0
+
+    def increment_visits(self):
+        return self.update(visits=F('visits') + 1)
+
+    def find_duplicate(self, user, target, expiry_date=None):
+        """
+        Return an active mapping of the user with the same target, once normalized, and the same expiry date,
+        if any.
+        """
+        normalized = normalize_target(target)
+        candidates = self.active().filter(user=user, target_hash=hash_target(target), expiry_date=expiry_date)
+        # the hash may collide, compare the targets as well
+        return next((m for m in candidates.order_by('id') if normalize_target(m.target) == normalized), None)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Generate the missing keys in one pass before inserting, then invalidate the inserted keys."""
+        objs = list(objs)
+        missing = [obj for obj in objs if not obj.key]
+        for obj, key in zip(missing, create_keys(len(missing))):
+            obj.key = key
+        for obj in objs:
+            obj.target_hash = hash_target(obj.target)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        mapping_cache.delete_many([obj.key for obj in objs])
+        return objs
+
+    async def aincrement_visits(self):
+        return await self.aupdate(visits=F('visits') + 1)
+
 
 class Mapping(models.Model):
     """
@@ -57,8 +323,10 @@ class Mapping(models.Model):
     )
 
     target = models.URLField(verbose_name=_('Target URL'))
-    key = models.CharField(max_length=10, unique=True,
-                           db_index=True, verbose_name=_('Key'))
+    # hash of the normalized target, see hash_target()
+    target_hash = models.BigIntegerField(blank=True, null=True, editable=False)
+    # unique through Meta.constraints
+    key = models.CharField(max_length=KEY_MAX_LEN, verbose_name=_('Key'))
     visits = models.PositiveIntegerField(
         default=0, verbose_name=_('Number of visits'))
     created_at = models.DateTimeField(default=timezone.now)
@@ -69,6 +337,21 @@ class Mapping(models.Model):
 
     class Meta:
         db_table = 'mapping'
+        constraints = [
+            # covers the redirect lookup (see resolve_target), which is answered from the index alone
+            models.UniqueConstraint(fields=['key'], include=['target', 'expiry_date'], name='mapping_key_uniq'),
+        ]
+        indexes = [
+            # back the cursor pagination of the mappings of a user, in each of its orderings
+            models.Index(fields=['user', 'id'], name='mapping_user_id_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='mapping_user_created_at_id_idx'),
+            models.Index(fields=['user', 'visits', 'id'], name='mapping_user_visits_id_idx'),
+            # backs the deduplication of the targets of a user
+            models.Index(fields=['user', 'target_hash'], name='mapping_user_target_hash_idx'),
+            # backs the expiry sweeps, leaving out the mappings that never expire
+            models.Index(fields=['expiry_date'], name='mapping_expiry_date_idx',
+                         condition=Q(expiry_date__isnull=False)),
+        ]
 
     @property
     def is_active(self):
@@ -77,12 +360,379 @@ class Mapping(models.Model):
     def __str__(self):
         return self.key
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored key, so that a changed key gets invalidated as well
+        instance._stored_key = instance.__dict__.get('key')
+        return instance
+
     def save(self, *args, **kwargs):
-        if not self.key:
-            self.key = create_unique_random_key()
-        super().save(*args, **kwargs)
+        self.target_hash = hash_target(self.target)
+        if not self.key and settings.MAPPING_KEY_STRATEGY == 'optimistic':
+            self._save_with_optimistic_key(*args, **kwargs)
+        else:
+            if not self.key:
+                self.key = create_key()
+            super().save(*args, **kwargs)
+
+    def _save_with_optimistic_key(self, *args, **kwargs):
+        """Insert with a fresh random key, retrying with another key when it collides with an existing one."""
+        for _attempt in range(OPTIMISTIC_KEY_ATTEMPTS):
+            self.key = create_key()
+            if existing_guest_keys([self.key]):
+                key_length.record(collision=True)
+                continue
+            # within a transaction, a failed insert must be rolled back to a savepoint to go on
+            savepoint = transaction.atomic() if connection.in_atomic_block else contextlib.nullcontext()
+            try:
+                with savepoint:
+                    super().save(*args, **kwargs)
+            except IntegrityError as e:
+                if not is_key_collision(e):
+                    raise
+                key_length.record(collision=True)
+                continue
+            key_length.record(collision=False)
+            return
+        self.key = ''
+        raise IntegrityError(f'No unique key found in {OPTIMISTIC_KEY_ATTEMPTS} attempts')
+
+    def _invalidate_cache(self):
+        """Drop the cached entries of the mapping, called on post_save and post_delete (see signals.py)."""
+        stored_key = getattr(self, '_stored_key', None)
+        if stored_key and stored_key != self.key:
+            mapping_cache.delete(stored_key)
+        mapping_cache.delete(self.key)
+        self._stored_key = self.key
 
     def increment_visits(self):
         # increment visits field using F() to avoid race conditions - the update is done at DB
         self.visits = F('visits') + 1
         self.save()
+
+
+def create_guest_mapping(target, expiry_date):
+    """
+    Create a guest mapping in the guest store. With the 'cache' store, the returned GuestMapping is not saved
+    to the database: the mapping is added to the guest cache, and expires with its cache entry.
+    """
+    mapping = GuestMapping(target=target, expiry_date=expiry_date)
+    if settings.MAPPING_GUEST_STORE != 'cache':
+        mapping.save()
+        return mapping
+
+    timeout = (expiry_date - timezone.now()).total_seconds()
+    for _attempt in range(OPTIMISTIC_KEY_ATTEMPTS):
+        mapping.key = create_guest_key()
+        # add() leaves an existing entry untouched, so that concurrent requests cannot take the same key
+        if get_guest_cache().add(f'{GUEST_CACHE_PREFIX}{mapping.key}', (target, expiry_date), timeout):
+            mapping_cache.delete(mapping.key)
+            return mapping
+    raise IntegrityError(f'No unique key found in {OPTIMISTIC_KEY_ATTEMPTS} attempts')
+
+
+class GuestMappingQuerySet(models.QuerySet):
+    """Guest mappings custom queryset."""
+
+    def active(self):
+        return self.filter(expiry_date__gt=timezone.now())
+
+
+class GuestMapping(models.Model):
+    """
+    An anonymous mapping, always expiring, stored apart from the user mappings when
+    settings.MAPPING_GUEST_STORE is 'partitioned' (see also create_guest_mapping()). Its table is
+    range-partitioned by expiry date (see apps.mappings.partitions), so that expired guest mappings are
+    removed by dropping whole partitions.
+    Keys are unique across mappings and guest mappings, but only by construction: the partitioned table cannot
+    have a unique constraint on key alone. Visits of guest mappings are not counted.
+    """
+    target = models.URLField(verbose_name=_('Target URL'))
+    key = models.CharField(max_length=KEY_MAX_LEN, verbose_name=_('Key'))
+    created_at = models.DateTimeField(default=timezone.now)
+    expiry_date = models.DateTimeField(verbose_name=_('Expiry date'))
+
+    objects = GuestMappingQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'guest_mapping'
+
+    @property
+    def is_active(self):
+        return timezone.now() < self.expiry_date
+
+    def __str__(self):
+        return self.key
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = create_guest_key()
+        super().save(*args, **kwargs)
+        # drop a cached negative lookup
+        mapping_cache.delete(self.key)
+
+
+class ExpiredMapping(models.Model):
+    """
+    A mapping of a user deleted by the expiry sweeps, kept until the user is notified by the next digest
+    (see apps.mappings.tasks.notify_expired_mappings).
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='expired_mappings',
+        verbose_name=_('User'),
+    )
+    key = models.CharField(max_length=KEY_MAX_LEN, verbose_name=_('Key'))
+    target = models.URLField(verbose_name=_('Target URL'))
+    visits = models.PositiveIntegerField(default=0, verbose_name=_('Number of visits'))
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'expired_mapping'
+
+    def __str__(self):
+        return self.key
+
+
+class ClickEvent(models.Model):
+    """
+    A visit to a short URL, appended to the click log in batches (see apps.mappings.clicks).
+    Events reference mappings by key, so that they outlive deleted and guest mappings.
+    """
+    key = models.CharField(max_length=KEY_MAX_LEN, verbose_name=_('Key'))
+    timestamp = models.DateTimeField(verbose_name=_('Timestamp'))
+    referrer = models.TextField(blank=True, verbose_name=_('Referrer'))
+    user_agent = models.TextField(blank=True, verbose_name=_('User agent'))
+    ip_hash = models.CharField(max_length=32, blank=True, verbose_name=_('Hashed IP address'))
+    # filled in by the enrichment in the background (see apps.mappings.enrichment), null until then
+    browser = models.CharField(max_length=20, null=True, blank=True, verbose_name=_('Browser'))
+    os = models.CharField(max_length=20, null=True, blank=True, verbose_name=_('Operating system'))
+    device = models.CharField(max_length=10, null=True, blank=True, verbose_name=_('Device type'))
+    is_bot = models.BooleanField(null=True, verbose_name=_('Bot'))
+    referrer_domain = models.CharField(max_length=255, null=True, blank=True, verbose_name=_('Referrer domain'))
+
+    class Meta:
+        db_table = 'click_event'
+        indexes = [
+            models.Index(fields=['key', 'timestamp'], name='click_event_key_timestamp_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} {self.timestamp}'
+
+
+class ClickRollup(models.Model):
+    """
+    Number of clicks on a key within an hour or a day, maintained from the click log (see apps.mappings.rollups).
+    """
+
+    class Granularity(models.TextChoices):
+        HOUR = 'hour', _('Hour')
+        DAY = 'day', _('Day')
+
+    key = models.CharField(max_length=KEY_MAX_LEN, verbose_name=_('Key'))
+    granularity = models.CharField(max_length=4, choices=Granularity.choices, verbose_name=_('Granularity'))
+    bucket = models.DateTimeField(verbose_name=_('Start of the bucket'))
+    count = models.PositiveIntegerField(default=0, verbose_name=_('Number of clicks'))
+
+    class Meta:
+        db_table = 'click_rollup'
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'granularity', 'bucket'], name='click_rollup_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} {self.granularity} {self.bucket}'
+
+
+class VisitorSketchQuerySet(models.QuerySet):
+    """Visitor sketches custom queryset."""
+
+    def merged(self):
+        """Return the union of the sketches, as a HyperLogLog, with one query."""
+        sketch = HyperLogLog()
+        for registers in self.values_list('registers', flat=True):
+            sketch.merge(HyperLogLog.from_bytes(registers))
+        return sketch
+
+
+class VisitorSketch(models.Model):
+    """
+    HyperLogLog sketch of the visitors (hashed client IPs) of a key within a day, maintained from the click log
+    along with the rollups (see apps.mappings.rollups). Its size is fixed, however many clicks the key gets, and
+    the sketches of several days merge into the sketch of the whole range.
+    """
+    key = models.CharField(max_length=KEY_MAX_LEN, verbose_name=_('Key'))
+    bucket = models.DateTimeField(verbose_name=_('Start of the day'))
+    registers = models.BinaryField(verbose_name=_('HyperLogLog registers'))
+
+    objects = VisitorSketchQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'visitor_sketch'
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'bucket'], name='visitor_sketch_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} {self.bucket}'
+
+
+class LifetimeVisitorSketchQuerySet(models.QuerySet):
+    """Lifetime visitor sketches custom queryset."""
+
+    def unique_visitors(self, mappings):
+        """
+        Return the estimated number of unique visitors of each of the given mappings since its creation,
+        as a {key: count} dict, with one query reading one sketch per mapping.
+        """
+        created_at = {mapping.key: mapping.created_at for mapping in mappings}
+        counts = dict.fromkeys(created_at, 0)
+        rows = self.filter(key__in=created_at).values_list('key', 'started_at', 'registers')
+        for key, started_at, registers in rows:
+            # the sketch of a former mapping with the same key counts for nothing, until it is started anew
+            if started_at >= created_at[key]:
+                counts[key] = HyperLogLog.from_bytes(registers).count()
+        return counts
+
+
+class LifetimeVisitorSketch(models.Model):
+    """
+    HyperLogLog sketch of the visitors of the mapping of a key since its creation, maintained along with the
+    daily sketches (see apps.mappings.rollups), so that reading the unique visitors of a mapping does not depend
+    on its age. The sketch is started anew when the key is given to a new mapping.
+    """
+    key = models.CharField(max_length=KEY_MAX_LEN, unique=True, verbose_name=_('Key'))
+    started_at = models.DateTimeField(verbose_name=_('Creation of the mapping'))
+    registers = models.BinaryField(verbose_name=_('HyperLogLog registers'))
+
+    objects = LifetimeVisitorSketchQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'lifetime_visitor_sketch'
+
+    def __str__(self):
+        return self.key
+
+
+class TrendingSketch(models.Model):
+    """
+    Counters of the space-saving sketch of the keys redirected by a process over a flush interval, as a
+    ``{key: [count, error]}`` object (see apps.mappings.trending).
+    """
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    counters = models.JSONField()
+
+    class Meta:
+        db_table = 'trending_sketch'
+
+    def __str__(self):
+        return f'{self.created_at}: {len(self.counters)} keys'
+
+
+class TrendingTop(models.Model):
+    """
+    Top keys of the last refresh of the trending keys, as ``[key, count, error]`` lists, read by the web
+    processes (see apps.mappings.trending).
+    """
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    keys = models.JSONField()
+
+    class Meta:
+        db_table = 'trending_top'
+
+    def __str__(self):
+        return f'{self.created_at}: {len(self.keys)} keys'
+
+
+class Watermark(models.Model):
+    """Position up to which an incremental job has processed its input."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'watermark'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class ShortenJobQuerySet(models.QuerySet):
+    """Bulk shortening jobs custom queryset."""
+
+    def stale(self):
+        """Return the running jobs without progress for settings.MAPPING_JOB_STALE_TIMEOUT seconds."""
+        return self.filter(
+            status=ShortenJob.Status.RUNNING,
+            updated_at__lt=timezone.now() - timedelta(seconds=settings.MAPPING_JOB_STALE_TIMEOUT),
+        )
+
+    def claimable(self):
+        """Return the jobs that may be (re)started: pending ones, and stale running ones."""
+        return self.filter(status=ShortenJob.Status.PENDING) | self.stale()
+
+
+class ShortenJob(models.Model):
+    """
+    A batch of URLs to shorten in the background, read from an input file (CSV or NDJSON).
+    Results are written to an output CSV file, in input order.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='shorten_jobs',
+        verbose_name=_('User'),
+    )
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING,
+                              verbose_name=_('Status'))
+    input = models.FileField(upload_to='jobs/input/', verbose_name=_('Input file'))
+    output = models.FileField(upload_to='jobs/output/', blank=True, verbose_name=_('Output file'))
+    base_url = models.CharField(max_length=255, verbose_name=_('Base URL of the short URLs'))
+    total = models.PositiveIntegerField(blank=True, null=True, verbose_name=_('Number of items'))
+    processed = models.PositiveIntegerField(default=0, verbose_name=_('Number of processed items'))
+    failed = models.PositiveIntegerField(default=0, verbose_name=_('Number of invalid items'))
+    error = models.TextField(blank=True, verbose_name=_('Error'))
+    created_at = models.DateTimeField(default=timezone.now)
+    # last progress of a running job, to tell the jobs left running by a crashed worker
+    updated_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    objects = ShortenJobQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'shorten_job'
+
+    def __str__(self):
+        return str(self.id)
+
+    @property
+    def input_format(self):
+        return 'csv' if self.input.name.lower().endswith('.csv') else 'ndjson'
+
+
+class ShortenJobResult(models.Model):
+    """
+    Result of an item of a ShortenJob, recorded with the item's batch and kept until the output file is written,
+    so that a resumed job reports the results of the batches of an interrupted run.
+    """
+    job = models.ForeignKey(ShortenJob, on_delete=models.CASCADE, related_name='results')
+    index = models.PositiveIntegerField()
+    key = models.CharField(max_length=KEY_MAX_LEN, blank=True)
+    target = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        db_table = 'shorten_job_result'
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'index'], name='shorten_job_result_job_index_uniq'),
+        ]
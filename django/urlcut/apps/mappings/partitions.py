@@ -0,0 +1,104 @@
+"""
+Daily partitions of tables range-partitioned by expiry date (see GuestMapping).
+
+A partition holds the rows expiring within one UTC day, and is named ``<table>_p<YYYYMMDD>``. Once that day
+is over, all of its rows are expired and the whole partition is dropped, instead of deleting rows one by one.
+"""
+import datetime
+
+from django.db import (
+    connection,
+    transaction,
+)
+
+
+def partition_name(table, day):
+    return f'{table}_p{day:%Y%m%d}'
+
+
+def day_start(day):
+    return datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+
+def list_partitions(table):
+    """Return the daily partitions of a table, as {day: partition name}."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass',
+            [table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f'{table}_p'
+    partitions = {}
+    for name in names:
+        if not name.startswith(prefix):
+            continue    # e.g. the default partition
+        try:
+            partitions[datetime.datetime.strptime(name[len(prefix):], '%Y%m%d').date()] = name
+        except ValueError:
+            continue
+    return partitions
+
+
+def create_partitions(table, first_day, days, unlogged=False):
+    """
+    Create the missing partitions for the given number of days from first_day, return their names.
+    Unlogged partitions are faster to write, but are emptied after a crash of the database.
+
+    Rows of a missing day may already be in the default partition, where Postgres refuses to leave them: the
+    partition is then created apart, filled with these rows, and attached.
+    """
+    existing = list_partitions(table)
+    created = []
+    with connection.cursor() as cursor:
+        columns = ', '.join(column.name for column in connection.introspection.get_table_description(cursor, table))
+        for i in range(days):
+            day = first_day + datetime.timedelta(days=i)
+            if day in existing:
+                continue
+            name = partition_name(table, day)
+            bounds = [day_start(day), day_start(day + datetime.timedelta(days=1))]
+            persistence = 'UNLOGGED ' if unlogged else ''
+            with transaction.atomic():
+                cursor.execute(
+                    f'SELECT EXISTS (SELECT 1 FROM {table}_default WHERE expiry_date >= %s AND expiry_date < %s)',
+                    bounds
+                )
+                if not cursor.fetchone()[0]:
+                    cursor.execute(
+                        f'CREATE {persistence}TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                        bounds
+                    )
+                else:
+                    cursor.execute(f'CREATE {persistence}TABLE {name} (LIKE {table} INCLUDING DEFAULTS)')
+                    cursor.execute(
+                        f'WITH moved AS ('
+                        f'DELETE FROM {table}_default WHERE expiry_date >= %s AND expiry_date < %s '
+                        f'RETURNING {columns}'
+                        f') INSERT INTO {name} ({columns}) SELECT {columns} FROM moved',
+                        bounds
+                    )
+                    cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', bounds)
+            created.append(name)
+    return created
+
+
+def drop_expired_partitions(table, now):
+    """Detach and drop the partitions whose rows all expired before now, return their names."""
+    dropped = []
+    for day, name in sorted(list_partitions(table).items()):
+        if day_start(day + datetime.timedelta(days=1)) > now:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            cursor.execute(f'DROP TABLE {name}')
+        dropped.append(name)
+    return dropped
+
+
+def purge_default_partition(table, now):
+    """Delete the expired rows that fell into the default partition, return their number."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}_default WHERE expiry_date <= %s', [now])
+        return cursor.rowcount
@@ -0,0 +1,136 @@
+"""
+Hourly and daily click counts, and daily visitor sketches, maintained incrementally from the click log.
+
+The click events are processed in id order, from a watermark saved in the same transaction as the counts it
+accounts for, so that every event is counted exactly once however runs are interrupted.
+"""
+from datetime import timezone
+
+from django.db import (
+    connection,
+    transaction,
+)
+from django.db.models.functions import Trunc
+
+from apps.mappings.hll import HyperLogLog
+from apps.mappings.models import (
+    ClickEvent,
+    ClickRollup,
+    LifetimeVisitorSketch,
+    Mapping,
+    VisitorSketch,
+    Watermark,
+)
+
+WATERMARK_NAME = 'click_rollup'
+
+
+def committed_click_id():
+    """
+    Return the highest id of the click log below which all events are committed. Ids are allocated before
+    commit, so a writer may still commit ids lower than the highest visible one: taking a SHARE lock waits
+    for the writers in progress, and briefly holds back new ones.
+    """
+    table = ClickEvent._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {table} IN SHARE MODE')
+        cursor.execute(f'SELECT max(id) FROM {table}')
+        return cursor.fetchone()[0] or 0
+
+
+def update_visitor_sketches(start, end):
+    """
+    Add the visitors (hashed client IPs) of the click events with ids in (start, end] to the daily sketches
+    of their keys, and to the lifetime sketches of their mappings. Only the sketches of the keys and days seen
+    in the events are read and written.
+    """
+    visitors = {}
+    # last visit of each visitor of a key, to leave out the visitors of a former mapping with the same key
+    last_visits = {}
+    # days in UTC, like the rollups
+    utc_day = Trunc('timestamp', 'day', tzinfo=timezone.utc)
+    events = ClickEvent.objects.filter(id__gt=start, id__lte=end).exclude(ip_hash='')
+    for key, day, ip_hash, timestamp in events.values_list('key', utc_day, 'ip_hash', 'timestamp').iterator():
+        visitors.setdefault((key, day), set()).add(ip_hash)
+        visits = last_visits.setdefault(key, {})
+        visits[ip_hash] = max(visits.get(ip_hash, timestamp), timestamp)
+    if not visitors:
+        return
+
+    keys = {key for key, _ in visitors}
+    days = {day for _, day in visitors}
+    existing = {
+        (sketch.key, sketch.bucket): sketch
+        for sketch in VisitorSketch.objects.filter(key__in=keys, bucket__in=days)
+    }
+    sketches = []
+    for (key, day), ip_hashes in visitors.items():
+        sketch = existing.get((key, day)) or VisitorSketch(key=key, bucket=day)
+        hll = HyperLogLog.from_bytes(sketch.registers) if sketch.registers else HyperLogLog()
+        for ip_hash in ip_hashes:
+            hll.add(ip_hash)
+        sketch.registers = hll.to_bytes()
+        sketches.append(sketch)
+    VisitorSketch.objects.bulk_create(
+        sketches, update_conflicts=True, unique_fields=['key', 'bucket'], update_fields=['registers']
+    )
+    update_lifetime_sketches(last_visits)
+
+
+def update_lifetime_sketches(last_visits):
+    """
+    Add visitors, given as {key: {ip_hash: last visit}}, to the lifetime sketches of the mappings of their keys,
+    starting the sketch anew for a mapping created since the sketch was started.
+    """
+    created_at = dict(Mapping.objects.filter(key__in=last_visits).values_list('key', 'created_at'))
+    existing = {
+        sketch.key: sketch
+        for sketch in LifetimeVisitorSketch.objects.filter(key__in=created_at)
+    }
+    sketches = []
+    for key, started_at in created_at.items():
+        sketch = existing.get(key)
+        if sketch is None or sketch.started_at < started_at:
+            sketch = LifetimeVisitorSketch(key=key, started_at=started_at)
+        hll = HyperLogLog.from_bytes(sketch.registers) if sketch.registers else HyperLogLog()
+        for ip_hash, last_visit in last_visits[key].items():
+            if last_visit >= started_at:
+                hll.add(ip_hash)
+        sketch.registers = hll.to_bytes()
+        sketches.append(sketch)
+    LifetimeVisitorSketch.objects.bulk_create(
+        sketches, update_conflicts=True, unique_fields=['key'], update_fields=['started_at', 'registers']
+    )
+
+
+def rollup_clicks(batch_size):
+    """
+    Add the click events logged since the watermark to the rollups and to the visitor sketches, batch_size
+    events per transaction. Return the number of events processed.
+    """
+    events = ClickEvent._meta.db_table
+    rollups = ClickRollup._meta.db_table
+    upper = committed_click_id()
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+            if watermark.value >= upper:
+                break
+            end = min(watermark.value + batch_size, upper)
+            with connection.cursor() as cursor:
+                for granularity in ClickRollup.Granularity.values:
+                    cursor.execute(
+                        f'INSERT INTO {rollups} (key, granularity, bucket, count) '
+                        f'SELECT key, %s, date_trunc(%s, timestamp), count(*) FROM {events} '
+                        f'WHERE id > %s AND id <= %s GROUP BY 1, 3 '
+                        f'ON CONFLICT (key, granularity, bucket) '
+                        f'DO UPDATE SET count = {rollups}.count + EXCLUDED.count',
+                        [granularity, granularity, watermark.value, end]
+                    )
+                cursor.execute(f'SELECT count(*) FROM {events} WHERE id > %s AND id <= %s', [watermark.value, end])
+                processed += cursor.fetchone()[0]
+            update_visitor_sketches(watermark.value, end)
+            watermark.value = end
+            watermark.save(update_fields=['value'])
+    return processed
@@ -0,0 +1,21 @@
+"""
+Signal receivers of the mappings app, connected in MappingsConfig.ready().
+"""
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
+from django.dispatch import receiver
+
+from apps.mappings.models import Mapping
+
+
+@receiver(post_save, sender=Mapping, dispatch_uid='mapping_saved')
+def mapping_saved(sender, instance, **kwargs):
+    instance._invalidate_cache()
+
+
+# also sent for cascade deletes (of the user) and queryset deletes (in the admin)
+@receiver(post_delete, sender=Mapping, dispatch_uid='mapping_deleted')
+def mapping_deleted(sender, instance, **kwargs):
+    instance._invalidate_cache()
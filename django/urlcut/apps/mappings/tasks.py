@@ -1,10 +1,53 @@
-from django.core.mail import send_mail
+import csv
+import io
+import json
+import tempfile
+import time
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.mail import (
+    EmailMessage,
+    get_connection,
+)
+from django.db import (
+    connection,
+    transaction,
+)
 from django.template.loader import render_to_string
+from django.utils import timezone
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
 
-from apps.mappings.models import Mapping
+from api.mappings.serializers import CreateMappingSerializer
+from apps.mappings.cache import mapping_cache
+from apps.mappings.enrichment import enrich_clicks
+from apps.mappings.locks import advisory_lock
+from apps.mappings.models import (
+    ExpiredMapping,
+    GuestMapping,
+    Mapping,
+    ShortenJob,
+    ShortenJobResult,
+    TrendingSketch,
+)
+from apps.mappings.partitions import (
+    create_partitions,
+    drop_expired_partitions,
+    purge_default_partition,
+)
+from apps.mappings.rollups import rollup_clicks
+from apps.mappings.trending import (
+    save_trending,
+    top_trending,
+    warm_mapping_cache,
+)
+from apps.mappings.visits import apply_visits
 
 logger = get_task_logger(__name__)
 
@@ -13,37 +56,322 @@ logger = get_task_logger(__name__)
 def cleanup_mappings():
     """
     Look for expired mappings and delete them.
-    For mappings related to users, notify the owners via e-mail.
-    """
-    all_expired = Mapping.objects.select_related('user').expired()
-    # get distinct users for the expired mappings
-    users = all_expired.values('user_id', 'user__email', 'user__name').distinct()
-    for user in users:
-        # save user's mapping data into the users dict before deleting the queryset
-        user['mappings'] = all_expired.filter(user_id=user['user_id']).values('key', 'target', 'visits')
-
-    count, _ = all_expired.delete()
-    logger.info(f"Deleted {count} expired mappings.")
-
-    # send e-mail notifications
-    for user in users:
-        msg_plain = render_to_string(
-            'email/expired_mappings.txt',
-            {
-                'name': user['user__name'],
-                'mappings': user['mappings']
-            }
-        )
-        try:
-            send_mail(
-                '[urlcut] Expired URLs',
-                msg_plain,
-                'noreply@urlcut.com',
-                [user['user__email']],
-                fail_silently=False
-            )
-        except IOError as e:
-            logger.error(f'cleanup_mappings - Error sending e-mail: {e}')
+    The deleted mappings related to users are recorded, for the owners to be notified by the next digest.
 
+    The task runs every settings.MAPPING_SWEEP_INTERVAL seconds and deletes at most
+    settings.MAPPING_SWEEP_MAX_ROWS mappings per run, paced at settings.MAPPING_SWEEP_RATE mappings per second,
+    so expired mappings are removed continuously rather than in one nightly spike.
+    Mappings are deleted in batches of settings.MAPPING_CLEANUP_BATCH_SIZE in id order, each batch in its own
+    short transaction, along with the recording of its rows. The run stops after
+    settings.MAPPING_CLEANUP_TIME_BUDGET seconds, the next one picks up what is left; overlapping runs are
+    prevented by an advisory lock.
+    """
+    with advisory_lock('cleanup_mappings') as acquired:
+        if not acquired:
+            logger.info('cleanup_mappings - Another cleanup is running, skipped.')
+            return 0
+        count = delete_expired_mappings()
+    # the age of the oldest expired mapping left tells whether the sweeps keep up with the expiries
+    logger.info(f"Deleted {count} expired mappings, lag {Mapping.objects.expiry_lag():.0f}s.")
     return count
 
+
+def delete_expired_mappings():
+    """
+    Delete up to MAPPING_SWEEP_MAX_ROWS mappings expired at the time of the call, in id-ordered batches paced
+    at the target rate, within the time budget, recording the deleted mappings of users as ExpiredMapping rows.
+    Return the number of deleted mappings.
+    """
+    now = timezone.now()
+    started = time.monotonic()
+    deadline = started + settings.MAPPING_CLEANUP_TIME_BUDGET
+    table = Mapping._meta.db_table
+    count = last_id = 0
+    while count < settings.MAPPING_SWEEP_MAX_ROWS:
+        if time.monotonic() >= deadline:
+            logger.warning(f'cleanup_mappings - Time budget exhausted after {count} mappings, resuming on next run.')
+            break
+        limit = min(settings.MAPPING_CLEANUP_BATCH_SIZE, settings.MAPPING_SWEEP_MAX_ROWS - count)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # rows locked by a concurrent update are skipped, the next run deletes them
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE id IN ('
+                    f'SELECT id FROM {table} WHERE expiry_date <= %s AND id > %s '
+                    f'ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED'
+                    f') RETURNING id, user_id, key, target, visits',
+                    [now, last_id, limit]
+                )
+                rows = cursor.fetchall()
+            ExpiredMapping.objects.bulk_create(
+                ExpiredMapping(user_id=user_id, key=key, target=target, visits=visits, deleted_at=now)
+                for _, user_id, key, target, visits in rows
+                if user_id is not None
+            )
+        count += len(rows)
+        if rows:
+            last_id = max(row[0] for row in rows)
+            mapping_cache.delete_many([row[2] for row in rows])
+        if len(rows) < limit:
+            break
+        # pace the batches so that deletions run at the target rate on average
+        pause = count / settings.MAPPING_SWEEP_RATE - (time.monotonic() - started)
+        time.sleep(max(0, min(pause, deadline - time.monotonic())))
+    return count
+
+
+@shared_task(time_limit=600)
+def notify_expired_mappings():
+    """
+    Send the digest of the mappings deleted since the last one, every settings.MAPPING_NOTIFY_INTERVAL
+    seconds: one e-mail per user, from one task per chunk of settings.MAPPING_NOTIFY_CHUNK_SIZE users.
+    The recorded mappings of a chunk are deleted once its task is queued.
+    """
+    with advisory_lock('notify_expired_mappings') as acquired:
+        if not acquired:
+            logger.info('notify_expired_mappings - Another digest is running, skipped.')
+            return 0
+        # mappings deleted meanwhile wait for the next digest
+        last_id = ExpiredMapping.objects.order_by('-id').values_list('id', flat=True).first()
+        if last_id is None:
+            return 0
+        pending = ExpiredMapping.objects.filter(id__lte=last_id)
+        user_ids = list(pending.order_by('user_id').values_list('user_id', flat=True).distinct())
+        chunk_size = settings.MAPPING_NOTIFY_CHUNK_SIZE
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = pending.filter(user_id__in=user_ids[i:i + chunk_size])
+            expired_by_user = defaultdict(list)
+            for user_id, key, target, visits in chunk.order_by('id').values_list('user_id', 'key', 'target', 'visits'):
+                expired_by_user[user_id].append({'key': key, 'target': target, 'visits': visits})
+            send_expired_notifications.delay(list(expired_by_user.items()))
+            chunk.delete()
+    logger.info(f'notify_expired_mappings - Notified {len(user_ids)} users.')
+    return len(user_ids)
+
+
+@shared_task(time_limit=120)
+def maintain_partitions():
+    """
+    Drop the partitions of the guest mappings whose mappings have all expired, purge the expired mappings of
+    the default partition, then create the daily partitions for today and the next
+    settings.MAPPING_PARTITION_PREMAKE_DAYS days.
+    """
+    with advisory_lock('maintain_partitions') as acquired:
+        if not acquired:
+            logger.info('maintain_partitions - Another maintenance is running, skipped.')
+            return None
+        table = GuestMapping._meta.db_table
+        now = timezone.now()
+        dropped = drop_expired_partitions(table, now)
+        # expired rows of the default partition are deleted rather than moved to the new partitions
+        purged = purge_default_partition(table, now)
+        created = create_partitions(table, now.date(), settings.MAPPING_PARTITION_PREMAKE_DAYS + 1,
+                                    unlogged=settings.MAPPING_GUEST_UNLOGGED)
+    logger.info(f'maintain_partitions - Created {created}, dropped {dropped}, purged {purged} default rows.')
+    return {'created': created, 'dropped': dropped, 'purged': purged}
+
+
+@shared_task(time_limit=120)
+def rollup_click_events():
+    """
+    Add the click events logged since the last run to the hourly and daily rollups.
+    """
+    with advisory_lock('rollup_click_events') as acquired:
+        if not acquired:
+            logger.info('rollup_click_events - Another rollup is running, skipped.')
+            return 0
+        processed = rollup_clicks(settings.MAPPING_ROLLUP_BATCH_SIZE)
+    logger.info(f'rollup_click_events - Processed {processed} click events.')
+    return processed
+
+
+@shared_task(time_limit=600)
+def enrich_click_events():
+    """
+    Enrich the click events logged since the last run on the process pool, and report the throughput per core.
+    """
+    with advisory_lock('enrich_click_events') as acquired:
+        if not acquired:
+            logger.info('enrich_click_events - Another enrichment is running, skipped.')
+            return None
+        result = enrich_clicks(settings.MAPPING_ENRICH_BATCH_SIZE, settings.MAPPING_ENRICH_CHUNK_SIZE)
+    logger.info(
+        f'enrich_click_events - Enriched {result["events"]} click events in {result["seconds"]}s '
+        f'on {result["workers"]} processes, {result["events_per_core_second"]} events per core second.'
+    )
+    return result
+
+
+@shared_task(time_limit=120)
+def refresh_trending():
+    """
+    Merge the trending sketches of the sliding window into the top keys, save them and pre-warm the mapping
+    cache with their targets, then delete the sketches that left the window.
+    """
+    with advisory_lock('refresh_trending') as acquired:
+        if not acquired:
+            logger.info('refresh_trending - Another refresh is running, skipped.')
+            return None
+        top = top_trending()
+        save_trending(top)
+        warmed = warm_mapping_cache(key for key, _, _ in top)
+        since = timezone.now() - timedelta(seconds=settings.MAPPING_TRENDING_WINDOW)
+        deleted, _ = TrendingSketch.objects.filter(created_at__lt=since).delete()
+    logger.info(f'refresh_trending - {len(top)} top keys, {warmed} warmed, {deleted} old sketches deleted.')
+    return top
+
+
+@shared_task(
+    autoretry_for=(OSError,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_kwargs={'max_retries': 5},
+)
+def send_expired_notifications(expired_by_user):
+    """
+    Notify users of their deleted mappings, given as [(user_id, [mapping dicts])], sending all the e-mails
+    through one connection to the e-mail backend. On a connection or delivery error the whole chunk is
+    retried with exponential backoff, so users notified before the error may get the e-mail twice.
+    """
+    mappings_by_user = dict(expired_by_user)
+    users = get_user_model().objects.filter(id__in=mappings_by_user).values('id', 'email', 'name')
+    messages = [
+        EmailMessage(
+            '[urlcut] Expired URLs',
+            render_to_string(
+                'email/expired_mappings.txt',
+                {
+                    'name': user['name'],
+                    'mappings': mappings_by_user[user['id']]
+                }
+            ),
+            'noreply@urlcut.com',
+            [user['email']],
+        )
+        for user in users
+    ]
+    with get_connection(fail_silently=False) as mail_connection:
+        sent = mail_connection.send_messages(messages)
+    logger.info(f'send_expired_notifications - Sent {sent} e-mails.')
+    return sent
+
+
+@shared_task
+def apply_visit_deltas(deltas):
+    """
+    Apply the visit counts buffered by a web process, given as {key: count}.
+    """
+    apply_visits(deltas)
+    return sum(deltas.values())
+
+
+def _process_job_batch(job, batch):
+    """
+    Insert the mappings of a batch of ``(index, mapping or (target, error))`` entries, record their results and
+    count them as processed, in one transaction.
+    """
+    mappings = [entry for _, entry in batch if isinstance(entry, Mapping)]
+    processed = job.processed + len(batch)
+    failed = job.failed + len(batch) - len(mappings)
+    with transaction.atomic():
+        # the keys of the mappings are generated on insert
+        Mapping.objects.bulk_create(mappings)
+        ShortenJobResult.objects.bulk_create([
+            ShortenJobResult(job=job, index=index, key=entry.key, target=entry.target)
+            if isinstance(entry, Mapping) else ShortenJobResult(job=job, index=index, target=entry[0], error=entry[1])
+            for index, entry in batch
+        ])
+        ShortenJob.objects.filter(pk=job.pk).update(processed=processed, failed=failed, updated_at=timezone.now())
+    job.processed, job.failed = processed, failed
+
+
+def _save_job_output(job):
+    """Write the recorded results of a job to its output file, in input order, then drop them."""
+    results = job.results.order_by('index').values_list('key', 'target', 'error')
+    with tempfile.TemporaryFile('w+', newline='', encoding='utf-8') as output:
+        writer = csv.writer(output)
+        writer.writerow(['key', 'target', 'short_url', 'error'])
+        for key, target, error in results.iterator():
+            writer.writerow([key, target, f'{job.base_url}{key}' if key else '', error])
+        output.seek(0)
+        job.output.save(f'{job.pk}.csv', File(output), save=False)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'output', 'error', 'finished_at'])
+    job.results.all().delete()
+
+
+def read_job_items(job):
+    """Yield the items of a job's input file, one dict (or a decoding error message) per line."""
+    with job.input.open('rb') as f:
+        lines = io.TextIOWrapper(f, encoding='utf-8', newline='')
+        if job.input_format == 'csv':
+            for row in csv.DictReader(lines):
+                # empty cells stand for missing values
+                yield {column: value for column, value in row.items() if value}
+            return
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                item = f'Invalid JSON: {e}'
+            yield item
+
+
+@shared_task
+def process_shorten_job(job_id):
+    """
+    Shorten the URLs of a ShortenJob, inserting the mappings in batches of settings.MAPPING_JOB_BATCH_SIZE,
+    so that memory usage does not depend on the size of the job. The results of each batch are recorded with it,
+    and written to the output file at the end, which is saved as well when the job fails, with the results of the
+    batches inserted until then.
+
+    A job left running by a crashed worker is resumed after the items of its inserted batches, whose results
+    were recorded by the interrupted run.
+    """
+    # claim the job, so that a job requeued twice is processed once
+    claimed = ShortenJob.objects.claimable().filter(pk=job_id).update(
+        status=ShortenJob.Status.RUNNING,
+        updated_at=timezone.now(),
+    )
+    if not claimed:
+        return ShortenJob.objects.get(pk=job_id).processed
+    job = ShortenJob.objects.select_related('user').get(pk=job_id)
+    job.total = sum(1 for _ in read_job_items(job))
+    job.save(update_fields=['total'])
+
+    try:
+        batch = []
+        for index, item in islice(enumerate(read_job_items(job)), job.processed, None):
+            target = item.get('target', '') if isinstance(item, dict) else ''
+            serializer = CreateMappingSerializer(data=item)
+            if serializer.is_valid():
+                batch.append((index, Mapping(user=job.user, **serializer.validated_data)))
+            else:
+                batch.append((index, (target, json.dumps(serializer.errors))))
+            if len(batch) >= settings.MAPPING_JOB_BATCH_SIZE:
+                _process_job_batch(job, batch)
+                batch = []
+        _process_job_batch(job, batch)
+    except Exception as e:
+        logger.exception(f'process_shorten_job - Job {job.pk} failed after {job.processed} items')
+        job.status = ShortenJob.Status.FAILED
+        job.error = str(e)
+    else:
+        job.status = ShortenJob.Status.DONE
+    _save_job_output(job)
+    return job.processed
+
+
+@shared_task
+def resume_stale_jobs():
+    """
+    Requeue the jobs left running by a crashed worker, without progress for settings.MAPPING_JOB_STALE_TIMEOUT
+    seconds.
+    """
+    job_ids = list(ShortenJob.objects.stale().values_list('pk', flat=True))
+    for job_id in job_ids:
+        logger.warning(f'resume_stale_jobs - Resuming job {job_id}.')
+        process_shorten_job.delay(str(job_id))
+    return len(job_ids)
@@ -0,0 +1,164 @@
+"""
+Test the ASGI fast path for redirects.
+"""
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+from django.core.cache import cache
+from django.core.signals import (
+    request_finished,
+    request_started,
+)
+from django.db import close_old_connections
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from apps.mappings.asgi import ForwardToTargetApplication
+from apps.mappings.cache import mapping_cache
+from apps.mappings.clicks import (
+    click_buffer,
+    hash_ip,
+)
+from apps.mappings.models import (
+    Mapping,
+    create_guest_mapping,
+)
+from apps.mappings.visits import background_visits
+
+
+def http_scope(path, method='GET'):
+    return {'type': 'http', 'method': method, 'path': path, 'root_path': ''}
+
+
+class FallbackApplication:
+    """ASGI application recording the requests falling through the fast path."""
+
+    def __init__(self):
+        self.scopes = []
+
+    async def __call__(self, scope, receive, send):
+        self.scopes.append(scope)
+
+
+class ForwardToTargetApplicationTests(TestCase):
+    """Test the ASGI fast path for redirects."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+        # like the test client, keep the connection of the test transaction open across requests
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        self.fallback = FallbackApplication()
+        self.app = ForwardToTargetApplication(self.fallback)
+
+    async def request(self, scope):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.app(scope, receive, send)
+        return messages
+
+    async def test_redirect(self):
+        """Test a key of an active mapping is redirected without falling through."""
+        mapping = await Mapping.objects.acreate(target='https://www.google.com/search?q=ü')
+
+        messages = await self.request(http_scope(f'/{mapping.key}'))
+        self.assertEqual(self.fallback.scopes, [])
+        self.assertEqual(messages[0]['status'], 302)
+        self.assertIn((b'location', b'https://www.google.com/search?q=%C3%BC'), messages[0]['headers'])
+        self.assertEqual(messages[1]['body'], b'')
+
+    async def test_redirect_increments_visits(self):
+        """Test a redirect increments the visits count, in the background."""
+        mapping = await Mapping.objects.acreate(target='https://www.google.com')
+
+        await self.request(http_scope(f'/{mapping.key}'))
+        await asyncio.gather(*background_visits)
+        visits = await Mapping.objects.values_list('visits', flat=True).aget(id=mapping.id)
+        self.assertEqual(visits, 1)
+
+    async def test_redirect_bots_and_prefetches_not_counted(self):
+        """Test HEAD requests, prefetches and bots are redirected without counting visits."""
+        mapping = await Mapping.objects.acreate(target='https://www.google.com')
+
+        for scope in [
+            http_scope(f'/{mapping.key}', method='HEAD'),
+            {**http_scope(f'/{mapping.key}'), 'headers': [(b'sec-purpose', b'prefetch')]},
+            {**http_scope(f'/{mapping.key}'), 'headers': [(b'user-agent', b'Twitterbot/1.0')]},
+        ]:
+            messages = await self.request(scope)
+            self.assertEqual(messages[0]['status'], 302)
+        self.assertEqual(background_visits, set())
+        visits = await Mapping.objects.values_list('visits', flat=True).aget(id=mapping.id)
+        self.assertEqual(visits, 0)
+
+    @override_settings(MAPPING_GUEST_STORE='cache')
+    async def test_redirect_guest_mapping_not_counted(self):
+        """Test the redirect of a guest mapping does not update any visits."""
+        expiry_date = timezone.now() + timedelta(days=1)
+        mapping = await sync_to_async(create_guest_mapping)('https://www.google.com', expiry_date)
+
+        messages = await self.request(http_scope(f'/{mapping.key}'))
+        self.assertEqual(messages[0]['status'], 302)
+        self.assertEqual(background_visits, set())
+
+    @override_settings(MAPPING_CLICKS_ENABLED=True, MAPPING_CLICKS_FLUSH_INTERVAL=0)
+    async def test_redirect_records_click(self):
+        """Test a redirect enqueues a click event."""
+        mapping = await Mapping.objects.acreate(target='https://www.google.com')
+        click_buffer.drain()
+
+        scope = {
+            **http_scope(f'/{mapping.key}'),
+            'headers': [(b'referer', b'https://example.com/'), (b'user-agent', b'test-agent')],
+            'client': ('10.0.0.1', 12345),
+        }
+        await self.request(scope)
+        self.assertEqual(
+            [event[:1] + event[2:] for event in click_buffer.drain()],
+            [(mapping.key, 'https://example.com/', 'test-agent', hash_ip('10.0.0.1'))]
+        )
+
+    async def test_redirect_sends_request_signals(self):
+        """Test the lookup is surrounded by the request signals, which close stale connections."""
+        mapping = await Mapping.objects.acreate(target='https://www.google.com')
+        started, finished = mock.Mock(), mock.Mock()
+        request_started.connect(started)
+        self.addCleanup(request_started.disconnect, started)
+        request_finished.connect(finished)
+        self.addCleanup(request_finished.disconnect, finished)
+
+        await self.request(http_scope(f'/{mapping.key}'))
+
+        started.assert_called_once()
+        finished.assert_called_once()
+
+    async def test_fall_through(self):
+        """Test requests other than redirects of active mappings fall through to Django."""
+        expired = await Mapping.objects.acreate(target='https://www.google.com', expiry_date=timezone.now())
+        active = await Mapping.objects.acreate(target='https://www.google.com')
+        scopes = [
+            http_scope('/admin/'),
+            http_scope('/api/v1/mappings/keys/'),
+            http_scope('/unknown1'),
+            http_scope(f'/{expired.key}'),
+            http_scope(f'/{active.key}', method='POST'),
+            {'type': 'lifespan'},
+        ]
+        for scope in scopes:
+            await self.request(scope)
+
+        self.assertEqual(self.fallback.scopes, scopes)
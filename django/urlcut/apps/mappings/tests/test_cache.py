@@ -0,0 +1,205 @@
+"""
+Test the cache of key -> target lookups.
+"""
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+)
+from django.utils import timezone
+
+from apps.mappings.cache import (
+    LRUCache,
+    mapping_cache,
+)
+from apps.mappings.models import (
+    KEY_MAX_LEN,
+    Mapping,
+    resolve_target,
+)
+
+
+def create_mapping(**params):
+    """Create and return a test mapping."""
+    defaults = {
+        'target': 'https://www.google.com',
+        'expiry_date': None,
+    }
+    defaults.update(params)
+
+    return Mapping.objects.create(**defaults)
+
+
+class LRUCacheTests(SimpleTestCase):
+    """Test the in-process LRU cache."""
+
+    def test_get_set(self):
+        """Test a stored value is returned."""
+        lru = LRUCache(maxsize=2, timeout=10)
+        lru.set('a', 1)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+
+    def test_evicts_least_recently_used(self):
+        """Test the least recently used entry is evicted when the cache is full."""
+        lru = LRUCache(maxsize=2, timeout=10)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+
+    def test_entries_expire(self):
+        """Test an entry is not returned after its timeout."""
+        lru = LRUCache(maxsize=2, timeout=10)
+        with mock.patch('apps.mappings.cache.time.monotonic', return_value=100):
+            lru.set('a', 1, timeout=5)
+        with mock.patch('apps.mappings.cache.time.monotonic', return_value=106):
+            self.assertIsNone(lru.get('a'))
+
+
+class ResolveTargetTests(TestCase):
+    """Test resolving keys through the mapping cache."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+
+    def test_resolve_is_cached(self):
+        """Test a second lookup of the same key does not hit the database."""
+        mapping = create_mapping()
+
+        self.assertEqual(resolve_target(mapping.key), (mapping.target, None, False))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_target(mapping.key), (mapping.target, None, False))
+        self.assertEqual(mapping_cache.stats()['local_hits'], 1)
+
+    def test_shared_tier_used_after_local_miss(self):
+        """Test the shared tier serves lookups missing from the local tier."""
+        mapping = create_mapping()
+        resolve_target(mapping.key)
+        mapping_cache.local.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_target(mapping.key), (mapping.target, None, False))
+        self.assertEqual(mapping_cache.stats()['shared_hits'], 1)
+
+    def test_process_local_shared_tier_capped(self):
+        """Test entries of a shared tier local to each process live no longer than the local ones."""
+        self.assertTrue(mapping_cache.shared_is_local)
+        mapping_cache.set('abcdefg', ('https://www.google.com', None))
+
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 31):
+            self.assertIsNone(mapping_cache.shared.get('mapping:2:abcdefg'))
+
+    def test_save_invalidates(self):
+        """Test updating a mapping invalidates its cached entry."""
+        mapping = create_mapping()
+        resolve_target(mapping.key)
+
+        mapping.target = 'https://www.example.com'
+        mapping.save()
+        self.assertEqual(resolve_target(mapping.key)[0], 'https://www.example.com')
+
+    def test_key_change_invalidates_old_key(self):
+        """Test changing the key of a mapping invalidates the old key."""
+        mapping = create_mapping()
+        old_key = mapping.key
+        resolve_target(old_key)
+
+        mapping = Mapping.objects.get(id=mapping.id)
+        mapping.key = 'newkey1'
+        mapping.save()
+        self.assertIsNone(resolve_target(old_key))
+
+    def test_delete_invalidates(self):
+        """Test deleting a mapping invalidates its cached entry."""
+        mapping = create_mapping()
+        resolve_target(mapping.key)
+
+        mapping.delete()
+        self.assertIsNone(resolve_target(mapping.key))
+
+    def test_queryset_delete_invalidates(self):
+        """Test deleting mappings through a queryset invalidates their cached entries."""
+        mapping = create_mapping()
+        resolve_target(mapping.key)
+
+        Mapping.objects.filter(id=mapping.id).delete()
+        self.assertIsNone(resolve_target(mapping.key))
+
+    def test_user_delete_invalidates(self):
+        """Test deleting a user invalidates the cached entries of their mappings."""
+        user = get_user_model().objects.create_user(email='test@example.com', password='testpass123')
+        mapping = create_mapping(user=user)
+        resolve_target(mapping.key)
+
+        user.delete()
+        self.assertIsNone(resolve_target(mapping.key))
+
+    def test_cached_entry_not_returned_after_expiry(self):
+        """Test a cached entry stops resolving once the mapping expires."""
+        expiry_date = timezone.now() + timedelta(hours=1)
+        mapping = create_mapping(expiry_date=expiry_date)
+        resolve_target(mapping.key)
+
+        with mock.patch('apps.mappings.models.timezone.now', return_value=expiry_date):
+            self.assertIsNone(resolve_target(mapping.key))
+
+
+class NegativeCacheTests(TestCase):
+    """Test the rejection and negative caching of unknown keys."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+
+    def test_invalid_keys_rejected_without_queries(self):
+        """Test strings that cannot be keys are rejected without touching the database."""
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolve_target('abc'))
+            self.assertIsNone(resolve_target('a' * (KEY_MAX_LEN + 1)))
+            self.assertIsNone(resolve_target('abc-def!'))
+            self.assertIsNone(resolve_target('abcdéfg'))
+        self.assertEqual(mapping_cache.stats()['rejected_keys'], 4)
+
+    def test_unknown_key_is_cached(self):
+        """Test a second lookup of an unknown key does not hit the database."""
+        self.assertIsNone(resolve_target('unknown1'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolve_target('unknown1'))
+        self.assertEqual(mapping_cache.stats()['negative_hits'], 1)
+
+    def test_expired_key_is_cached(self):
+        """Test a second lookup of an expired key does not hit the database."""
+        mapping = create_mapping(expiry_date=timezone.now())
+
+        self.assertIsNone(resolve_target(mapping.key))
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolve_target(mapping.key))
+
+    def test_local_tier_keeps_negative_timeout(self):
+        """Test a negative entry from the shared tier expires with the negative timeout in the local tier."""
+        resolve_target('unknown1')
+        mapping_cache.local.clear()
+
+        with mock.patch('apps.mappings.cache.time.monotonic', return_value=100):
+            resolve_target('unknown1')
+        with mock.patch('apps.mappings.cache.time.monotonic', return_value=111):
+            self.assertIsNone(mapping_cache.local.get('unknown1'))
+
+    def test_create_invalidates_unknown_key(self):
+        """Test creating a mapping with a previously unknown key makes it resolve."""
+        self.assertIsNone(resolve_target('unknown1'))
+
+        mapping = create_mapping(key='unknown1')
+        self.assertEqual(resolve_target('unknown1'), (mapping.target, None, False))
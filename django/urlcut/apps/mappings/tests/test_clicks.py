@@ -0,0 +1,111 @@
+"""
+Test the click event log.
+"""
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.test.client import Client
+from django.urls import reverse
+
+from apps.mappings.cache import mapping_cache
+from apps.mappings.clicks import (
+    ClickBuffer,
+    click_buffer,
+    hash_ip,
+)
+from apps.mappings.models import (
+    ClickEvent,
+    Mapping,
+)
+
+
+@override_settings(MAPPING_CLICKS_FLUSH_INTERVAL=0)
+class ClickBufferTests(TestCase):
+    """Test the buffering and batched writing of click events."""
+
+    def test_hash_ip(self):
+        """Test IP addresses are hashed consistently."""
+        self.assertEqual(hash_ip('10.0.0.1'), hash_ip('10.0.0.1'))
+        self.assertNotEqual(hash_ip('10.0.0.1'), hash_ip('10.0.0.2'))
+        self.assertNotIn('10.0.0.1', hash_ip('10.0.0.1'))
+        self.assertEqual(hash_ip(''), '')
+
+    def test_flush(self):
+        """Test buffered events are written in batches on flush."""
+        buffer = ClickBuffer()
+        buffer.add('abcdefg', 'https://example.com/', 'test-agent', '10.0.0.1')
+        buffer.add('abcdefg')
+        buffer.add('bcdefgh', 'https://example.com/"quoted",', 'x' * 2000)
+        self.assertEqual(ClickEvent.objects.count(), 0)
+
+        with self.settings(MAPPING_CLICKS_BATCH_SIZE=2):
+            self.assertEqual(buffer.flush(), 3)
+
+        self.assertEqual(buffer.pending, 0)
+        self.assertEqual(buffer.stats()['flushed'], 3)
+        events = list(ClickEvent.objects.order_by('id'))
+        self.assertEqual([e.key for e in events], ['abcdefg', 'abcdefg', 'bcdefgh'])
+        self.assertEqual(events[0].ip_hash, hash_ip('10.0.0.1'))
+        self.assertEqual((events[1].referrer, events[1].user_agent, events[1].ip_hash), ('', '', ''))
+        self.assertEqual(events[2].referrer, 'https://example.com/"quoted",')
+        self.assertEqual(len(events[2].user_agent), 1024)
+
+    def test_full_buffer_drops_events(self):
+        """Test events are dropped and counted when the buffer is full."""
+        buffer = ClickBuffer()
+        with self.settings(MAPPING_CLICKS_MAX_PENDING=2):
+            self.assertTrue(buffer.add('abcdefg'))
+            self.assertTrue(buffer.add('abcdefg'))
+            self.assertFalse(buffer.add('abcdefg'))
+        self.assertEqual(buffer.pending, 2)
+        self.assertEqual(buffer.stats()['dropped'], 1)
+
+    def test_failed_flush_keeps_events(self):
+        """Test events are put back in the buffer, as far as they fit, when the flush fails."""
+        buffer = ClickBuffer()
+        for _ in range(3):
+            buffer.add('abcdefg')
+
+        with self.settings(MAPPING_CLICKS_MAX_PENDING=2), \
+                mock.patch('apps.mappings.clicks.copy_clicks', side_effect=OperationalError('down')):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending, 2)
+        self.assertEqual(buffer.stats()['flush_errors'], 1)
+        self.assertEqual(buffer.stats()['dropped'], 1)
+
+
+@override_settings(MAPPING_CLICKS_ENABLED=True, MAPPING_CLICKS_FLUSH_INTERVAL=0)
+class ClickViewTests(TestCase):
+    """Test click events are logged on redirects."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+        click_buffer.drain()
+
+    def test_forward_records_click(self):
+        """Test a redirect logs a click event with the request details."""
+        mapping = Mapping.objects.create(target='https://www.google.com')
+
+        Client().get(reverse('mappings:forward', kwargs={'key': mapping.key}),
+                     HTTP_REFERER='https://example.com/', HTTP_USER_AGENT='test-agent')
+        click_buffer.flush()
+
+        event = ClickEvent.objects.get()
+        self.assertEqual(event.key, mapping.key)
+        self.assertEqual(event.referrer, 'https://example.com/')
+        self.assertEqual(event.user_agent, 'test-agent')
+        self.assertEqual(event.ip_hash, hash_ip('127.0.0.1'))
+
+    def test_forward_without_click_log(self):
+        """Test no click event is logged when the click log is disabled."""
+        mapping = Mapping.objects.create(target='https://www.google.com')
+
+        with self.settings(MAPPING_CLICKS_ENABLED=False):
+            Client().get(reverse('mappings:forward', kwargs={'key': mapping.key}))
+        self.assertEqual(click_buffer.pending, 0)
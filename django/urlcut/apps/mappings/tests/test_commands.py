@@ -0,0 +1,124 @@
+"""
+Test custom Django management commands.
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from apps.mappings.models import (
+    GuestMapping,
+    Mapping,
+)
+
+
+class ImportMappingsCommandTests(TestCase):
+    """Test the import_mappings command."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def read_report(self, path):
+        with open(f'{path}.report.csv', newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_import_csv(self):
+        """Test mappings are imported from a CSV file."""
+        path = self.write_file('mappings.csv', (
+            'key,target,expiry_date,visits\n'
+            'abcdefg,https://www.google.com,,3\n'
+            'hijklmn,https://www.example.com,2100-01-01T00:00:00Z,\n'
+        ))
+        call_command('import_mappings', path, stdout=StringIO())
+
+        mapping = Mapping.objects.get(key='abcdefg')
+        self.assertEqual(mapping.target, 'https://www.google.com')
+        self.assertEqual(mapping.visits, 3)
+        self.assertIsNone(mapping.expiry_date)
+        self.assertEqual(Mapping.objects.get(key='hijklmn').expiry_date.year, 2100)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_import_ndjson_with_conflicts_and_invalid_records(self):
+        """Test invalid records and conflicting keys are skipped and reported."""
+        Mapping.objects.create(key='existing', target='https://www.google.com')
+        records = [
+            {'key': 'existing', 'target': 'https://www.example.com'},
+            {'key': 'abc-efg', 'target': 'https://www.example.com'},
+            {'key': 'abcdefg', 'target': 'not an url'},
+            {'key': 'abcdefg', 'target': 'https://www.example.com'},
+            {'key': 'abcdefg', 'target': 'https://www.example.com/2'},
+        ]
+        path = self.write_file('mappings.ndjson', '\n'.join(json.dumps(r) for r in records))
+        call_command('import_mappings', path, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Mapping.objects.get(key='existing').target, 'https://www.google.com')
+        self.assertEqual(Mapping.objects.get(key='abcdefg').target, 'https://www.example.com')
+        report = self.read_report(path)
+        self.assertEqual(
+            [(row['record'], row['reason']) for row in report],
+            [('2', 'Invalid key'), ('3', 'Invalid target URL'), ('1', 'existing key'), ('5', 'existing key')]
+        )
+
+    @override_settings(MAPPING_GUEST_STORE='partitioned')
+    def test_import_guest_key_conflicts(self):
+        """Test records whose key is taken by a guest mapping are skipped and reported."""
+        GuestMapping.objects.create(key='guestky', target='https://www.google.com', expiry_date=timezone.now())
+        path = self.write_file('mappings.csv', (
+            'key,target\n'
+            'guestky,https://www.example.com\n'
+            'abcdefg,https://www.example.com\n'
+        ))
+        call_command('import_mappings', path, stdout=StringIO())
+
+        self.assertEqual(list(Mapping.objects.values_list('key', flat=True)), ['abcdefg'])
+        report = self.read_report(path)
+        self.assertEqual([(row['record'], row['key'], row['reason']) for row in report],
+                         [('1', 'guestky', 'existing key')])
+
+    def test_import_resumes_from_checkpoint(self):
+        """Test an import resumes after the record saved in the checkpoint."""
+        path = self.write_file('mappings.csv', (
+            'key,target\n'
+            'abcdefg,https://www.google.com\n'
+            'hijklmn,https://www.example.com\n'
+        ))
+        with open(f'{path}.checkpoint', 'w') as f:
+            json.dump({'record': 1, 'inserted': 1, 'conflicts': 0, 'rejected': 0, 'report_size': 0}, f)
+        out = StringIO()
+        call_command('import_mappings', path, stdout=out)
+
+        self.assertIn('Resuming after record 1', out.getvalue())
+        self.assertEqual(list(Mapping.objects.values_list('key', flat=True)), ['hijklmn'])
+
+    def test_import_for_user(self):
+        """Test imported mappings can be assigned to a user."""
+        user = get_user_model().objects.create_user(email='test@example.com', password='testpass123')
+        path = self.write_file('mappings.csv', 'key,target\nabcdefg,https://www.google.com\n')
+        call_command('import_mappings', path, user='test@example.com', stdout=StringIO())
+
+        self.assertEqual(Mapping.objects.get(key='abcdefg').user, user)
+
+    def test_import_missing_file(self):
+        """Test importing a missing file raises an error."""
+        with self.assertRaises(CommandError):
+            call_command('import_mappings', os.path.join(self.dir, 'missing.csv'))
@@ -0,0 +1,90 @@
+"""
+Test the enrichment of the click log.
+"""
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from apps.mappings.enrichment import (
+    WATERMARK_NAME,
+    enrichment_pool,
+    parse_user_agent,
+    referrer_domain,
+)
+from apps.mappings.models import (
+    ClickEvent,
+    Watermark,
+)
+from apps.mappings.tasks import enrich_click_events
+
+CHROME_DESKTOP = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/120.0.0.0 Safari/537.36')
+SAFARI_IPHONE = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+                 'Version/17.1 Mobile/15E148 Safari/604.1')
+EDGE_ANDROID_TABLET = ('Mozilla/5.0 (Linux; Android 13; SM-X700) AppleWebKit/537.36 (KHTML, like Gecko) '
+                       'Chrome/120.0.0.0 Safari/537.36 EdgA/120.0.0.0')
+SLACKBOT = 'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)'
+
+
+class ParseTests(SimpleTestCase):
+    """Test the parsing of user agents and referrers."""
+
+    def test_parse_user_agent(self):
+        """Test browsers, operating systems, devices and bots are recognized."""
+        self.assertEqual(parse_user_agent(CHROME_DESKTOP), ('Chrome', 'Windows', 'desktop', False))
+        self.assertEqual(parse_user_agent(SAFARI_IPHONE), ('Safari', 'iOS', 'mobile', False))
+        self.assertEqual(parse_user_agent(EDGE_ANDROID_TABLET), ('Edge', 'Android', 'tablet', False))
+        self.assertEqual(parse_user_agent(SLACKBOT), ('Other', 'Other', 'bot', True))
+        self.assertEqual(parse_user_agent('curl/8.4.0'), ('Other', 'Other', 'bot', True))
+        self.assertEqual(parse_user_agent(''), ('Other', 'Other', 'bot', True))
+
+    def test_parse_user_agent_memoized(self):
+        """Test the parsing of a user agent is memoized."""
+        parse_user_agent.cache_clear()
+        for _ in range(3):
+            parse_user_agent(CHROME_DESKTOP)
+        self.assertEqual(parse_user_agent.cache_info().hits, 2)
+
+    def test_referrer_domain(self):
+        """Test referrers are reduced to their lowercase domain."""
+        self.assertEqual(referrer_domain('https://WWW.Example.com:8443/path?q=1'), 'example.com')
+        self.assertEqual(referrer_domain('android-app://com.slack/'), 'com.slack')
+        self.assertEqual(referrer_domain('http://[invalid'), '')
+        self.assertEqual(referrer_domain(''), '')
+
+
+@override_settings(MAPPING_ENRICH_WORKERS=2)
+class EnrichClickEventsTests(TestCase):
+    """Test the enrichment of click events on a process pool."""
+
+    def tearDown(self):
+        enrichment_pool.shutdown()
+
+    def test_enrich_click_events(self):
+        """Test the click events since the watermark are enriched in chunks, with the throughput reported."""
+        user_agents = [CHROME_DESKTOP, SAFARI_IPHONE, SLACKBOT]
+        events = [
+            ClickEvent.objects.create(key='abcdefg', timestamp=timezone.now(), user_agent=user_agents[i % 3],
+                                      referrer='https://www.example.com/' if i % 2 else '')
+            for i in range(5)
+        ]
+
+        with self.settings(MAPPING_ENRICH_BATCH_SIZE=4, MAPPING_ENRICH_CHUNK_SIZE=2):
+            result = enrich_click_events()
+
+        self.assertEqual(result['events'], 5)
+        self.assertEqual(result['workers'], 2)
+        self.assertIn('events_per_core_second', result)
+        enriched = list(ClickEvent.objects.order_by('id').values_list('browser', 'device', 'is_bot', 'referrer_domain'))
+        self.assertEqual(enriched, [
+            ('Chrome', 'desktop', False, ''),
+            ('Safari', 'mobile', False, 'example.com'),
+            ('Other', 'bot', True, ''),
+            ('Chrome', 'desktop', False, 'example.com'),
+            ('Safari', 'mobile', False, ''),
+        ])
+        self.assertEqual(Watermark.objects.get(name=WATERMARK_NAME).value, events[-1].id)
+        self.assertEqual(enrich_click_events()['events'], 0)
@@ -0,0 +1,73 @@
+"""
+Test the cache store of guest mappings.
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from apps.mappings.cache import mapping_cache
+from apps.mappings.models import (
+    GUEST_CACHE_PREFIX,
+    GuestMapping,
+    Mapping,
+    create_guest_mapping,
+    create_keys,
+    key_exists,
+    resolve_target,
+)
+
+CREATE_GUEST_MAPPING_URL = reverse('api:mappings:guest-shorten')
+
+
+@override_settings(MAPPING_GUEST_STORE='cache')
+class GuestCacheStoreTests(TestCase):
+    """Test guest mappings stored in a cache, expiring with their entries."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+
+    def test_create_guest_mapping(self):
+        """Test a guest mapping is stored in the cache only, and resolves."""
+        res = APIClient().post(CREATE_GUEST_MAPPING_URL, {'target': 'https://www.google.com'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        key = res.data['key']
+        self.assertFalse(Mapping.objects.exists())
+        self.assertFalse(GuestMapping.objects.exists())
+        self.assertEqual(resolve_target(key)[::2], ('https://www.google.com', True))
+        self.assertTrue(key_exists(key))
+
+    def test_forward_to_guest_mapping(self):
+        """Test the redirect from the key of a guest mapping, which does not count visits."""
+        mapping = create_guest_mapping('https://www.google.com', timezone.now() + timedelta(days=1))
+
+        with mock.patch('apps.mappings.views.arecord_visit') as record_visit:
+            res = self.client.get(reverse('mappings:forward', kwargs={'key': mapping.key}))
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(res['Location'], mapping.target)
+        record_visit.assert_not_called()
+
+    def test_guest_mapping_expires_with_cache_entry(self):
+        """Test the cache entry of a guest mapping expires with the mapping."""
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            mapping = create_guest_mapping('https://www.google.com', timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(add.call_args.args[0], f'{GUEST_CACHE_PREFIX}{mapping.key}')
+        self.assertAlmostEqual(add.call_args.args[2], 60 * 60, delta=5)
+
+    def test_keys_taken_by_guest_mappings_not_reused(self):
+        """Test new keys are not generated among the keys of guest mappings."""
+        taken = create_guest_mapping('https://www.google.com', timezone.now() + timedelta(days=1)).key
+
+        with mock.patch('apps.mappings.models.create_random_key', side_effect=[taken, 'freshkey']):
+            self.assertEqual(create_keys(1), ['freshkey'])
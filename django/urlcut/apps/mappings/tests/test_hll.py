@@ -0,0 +1,43 @@
+"""
+Test the HyperLogLog sketches.
+"""
+from django.test import SimpleTestCase
+
+from apps.mappings.hll import HyperLogLog
+
+
+def sketch_of(values):
+    sketch = HyperLogLog()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+class HyperLogLogTests(SimpleTestCase):
+    """Test the estimates of HyperLogLog sketches."""
+
+    def test_count(self):
+        """Test the distinct values are estimated within a few percents, whatever the duplicates."""
+        self.assertEqual(HyperLogLog().count(), 0)
+        self.assertEqual(sketch_of(['a', 'b', 'a', 'c']).count(), 3)
+        for n in (1000, 50000):
+            values = [f'visitor-{i}' for i in range(n)]
+            self.assertAlmostEqual(sketch_of(values + values).count(), n, delta=n * 0.05)
+
+    def test_merge(self):
+        """Test merging sketches estimates the union of their values."""
+        merged = sketch_of(f'v{i}' for i in range(3000)).merge(sketch_of(f'v{i}' for i in range(2000, 6000)))
+
+        self.assertAlmostEqual(merged.count(), 6000, delta=300)
+        with self.assertRaises(ValueError):
+            merged.merge(HyperLogLog(precision=10))
+
+    def test_bytes(self):
+        """Test a sketch is stored in a fixed size and restored as is."""
+        sketch = sketch_of(f'v{i}' for i in range(10000))
+        data = sketch.to_bytes()
+
+        self.assertEqual(len(data), len(HyperLogLog().to_bytes()))
+        restored = HyperLogLog.from_bytes(data)
+        self.assertEqual(restored.precision, sketch.precision)
+        self.assertEqual(restored.count(), sketch.count())
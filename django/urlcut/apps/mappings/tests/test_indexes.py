@@ -0,0 +1,67 @@
+"""
+Test that the queries on mappings use the intended indexes.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.mappings.models import (
+    Mapping,
+    hash_target,
+)
+
+
+def plan_nodes(plan):
+    """Yield the nodes of an EXPLAIN (FORMAT JSON) plan."""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+class QueryPlanTests(TestCase):
+    """
+    The test tables are tiny, so sequential scans are disabled to get the plans of large tables:
+    the planner then picks the index it deems best for the query, or falls back to a sequential scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='test@example.com', password='testpass123')
+        Mapping.objects.create(user=cls.user, target='https://www.google.com')
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        indexes = [node['Index Name'] for node in plan_nodes(plan) if 'Index Name' in node]
+        self.assertIn(index_name, indexes, msg=json.dumps(plan, indent=2))
+
+    def test_resolve_target(self):
+        """Test the redirect lookup is answered from the covering index on key."""
+        queryset = Mapping.objects.active().filter(key='abcdefg').values_list('target', 'expiry_date')
+        self.assertUsesIndex(queryset, 'mapping_key_uniq')
+
+    def test_expired(self):
+        """Test the expired mappings are found through the partial index on expiry_date."""
+        self.assertUsesIndex(Mapping.objects.expired().values('id'), 'mapping_expiry_date_idx')
+
+    def test_expiring(self):
+        """Test the mappings expiring before a date are found through the partial index on expiry_date."""
+        queryset = Mapping.objects.filter(expiry_date__lt=timezone.now()).order_by('expiry_date')
+        self.assertUsesIndex(queryset, 'mapping_expiry_date_idx')
+
+    def test_list_page(self):
+        """Test a page of the mappings of a user is read through the (user_id, id) index."""
+        queryset = Mapping.objects.filter(user=self.user, id__gt=0).order_by('id')[:11]
+        self.assertUsesIndex(queryset, 'mapping_user_id_idx')
+
+    def test_find_duplicate(self):
+        """Test the deduplication lookup uses the (user_id, target_hash) index."""
+        queryset = Mapping.objects.active().filter(user=self.user, target_hash=hash_target('https://www.google.com'),
+                                                   expiry_date=None)
+        self.assertUsesIndex(queryset, 'mapping_user_target_hash_idx')
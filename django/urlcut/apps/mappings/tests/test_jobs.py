@@ -0,0 +1,140 @@
+"""
+Test bulk shortening jobs.
+"""
+import csv
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from apps.mappings.models import (
+    Mapping,
+    ShortenJob,
+    ShortenJobResult,
+)
+from apps.mappings.tasks import (
+    process_shorten_job,
+    resume_stale_jobs,
+)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def create_job(user, name, content):
+    """Create and return a test job with the given input file."""
+    return ShortenJob.objects.create(
+        user=user,
+        input=ContentFile(content, name=name),
+        base_url='http://testserver/',
+    )
+
+
+def read_output(job):
+    """Return the rows of the output of a job."""
+    with job.output.open('rb') as f:
+        return list(csv.DictReader(io.TextIOWrapper(f, encoding='utf-8')))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MAPPING_JOB_BATCH_SIZE=2)
+class ProcessShortenJobTests(TestCase):
+    """Test the task processing bulk shortening jobs."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='testpass123')
+
+    def test_process_ndjson_job(self):
+        """Test the items of an NDJSON input are shortened and reported in input order."""
+        items = [
+            {'target': 'https://www.google.com'},
+            {'target': 'not an url'},
+            {'target': 'https://www.example.com'},
+        ]
+        lines = [json.dumps(item) for item in items] + ['{broken']
+        job = create_job(self.user, 'items.ndjson', '\n'.join(lines))
+
+        self.assertEqual(process_shorten_job(str(job.pk)), 4)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ShortenJob.Status.DONE)
+        self.assertEqual((job.total, job.processed, job.failed), (4, 4, 2))
+        self.assertIsNotNone(job.finished_at)
+
+        rows = read_output(job)
+        self.assertEqual([row['target'] for row in rows], [item['target'] for item in items] + [''])
+        self.assertEqual([bool(row['error']) for row in rows], [False, True, False, True])
+        self.assertEqual(Mapping.objects.filter(user=self.user).count(), 2)
+        mapping = Mapping.objects.get(key=rows[0]['key'])
+        self.assertEqual(rows[0]['short_url'], f'http://testserver/{mapping.key}')
+
+    def test_process_csv_job(self):
+        """Test the items of a CSV input are shortened."""
+        job = create_job(self.user, 'items.csv', 'target,expiry_date\nhttps://www.google.com,\n')
+
+        process_shorten_job(str(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ShortenJob.Status.DONE)
+        self.assertEqual(Mapping.objects.get(user=self.user).target, 'https://www.google.com')
+
+    def test_job_processed_once(self):
+        """Test a job that is not pending is not processed again."""
+        job = create_job(self.user, 'items.ndjson', '{"target": "https://www.google.com"}')
+
+        process_shorten_job(str(job.pk))
+        process_shorten_job(str(job.pk))
+        self.assertEqual(Mapping.objects.count(), 1)
+
+    def test_failed_job_keeps_partial_output(self):
+        """Test the output of a failed job lists the results of the batches inserted before the failure."""
+        lines = [json.dumps({'target': f'https://www.example.com/{i}'}) for i in range(3)]
+        job = create_job(self.user, 'items.ndjson', '\n'.join(lines))
+
+        with mock.patch('apps.mappings.tasks.Mapping.objects.bulk_create',
+                        side_effect=[None, RuntimeError('down')]):
+            process_shorten_job(str(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ShortenJob.Status.FAILED)
+        self.assertEqual(job.processed, 2)
+        rows = read_output(job)
+        self.assertEqual([row['target'] for row in rows], ['https://www.example.com/0', 'https://www.example.com/1'])
+
+    def test_stale_running_job_resumed(self):
+        """Test a job left running by a crashed worker is resumed after its inserted batches."""
+        lines = [json.dumps({'target': f'https://www.example.com/{i}'}) for i in range(3)]
+        job = create_job(self.user, 'items.ndjson', '\n'.join(lines))
+        ShortenJob.objects.filter(pk=job.pk).update(status=ShortenJob.Status.RUNNING, processed=2,
+                                                    updated_at=timezone.now())
+        ShortenJobResult.objects.bulk_create([
+            ShortenJobResult(job=job, index=0, key='abcdefg', target='https://www.example.com/0'),
+            ShortenJobResult(job=job, index=1, target='', error='{"target": ["This field is required."]}'),
+        ])
+
+        with mock.patch.object(process_shorten_job, 'delay', side_effect=process_shorten_job) as delay:
+            self.assertEqual(resume_stale_jobs(), 0)
+            ShortenJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+            self.assertEqual(resume_stale_jobs(), 1)
+        delay.assert_called_once_with(str(job.pk))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ShortenJob.Status.DONE)
+        self.assertEqual(job.processed, 3)
+        self.assertEqual(Mapping.objects.get(user=self.user).target, 'https://www.example.com/2')
+        rows = read_output(job)
+        self.assertEqual([row['short_url'] for row in rows][:2], ['http://testserver/abcdefg', ''])
+        self.assertEqual(rows[1]['error'], '{"target": ["This field is required."]}')
+        self.assertEqual(rows[2]['target'], 'https://www.example.com/2')
+        self.assertTrue(rows[2]['key'])
+        self.assertFalse(ShortenJobResult.objects.exists())
@@ -0,0 +1,178 @@
+"""
+Test key generation.
+"""
+from unittest import mock
+
+from django.conf import settings
+from django.db import (
+    IntegrityError,
+    connection,
+)
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.mappings.keys import (
+    KEY_CHARS,
+    KEY_SEQUENCE_BLOCK,
+    FeistelPermutation,
+    create_sequence_keys,
+    encode_key,
+    key_length,
+    key_sequence,
+)
+from apps.mappings.models import (
+    GuestMapping,
+    Mapping,
+    create_keys,
+    is_valid_key,
+)
+
+
+class KeyEncodingTests(SimpleTestCase):
+    """Test encoding and permutation of key indexes."""
+
+    def test_encode_key(self):
+        """Test integers are encoded as fixed-length keys."""
+        self.assertEqual(encode_key(0, 3), 'aaa')
+        self.assertEqual(encode_key(len(KEY_CHARS) ** 3 - 1, 3), '999')
+
+    def test_encode_key_too_large(self):
+        """Test an integer not fitting in the key length is rejected."""
+        with self.assertRaises(ValueError):
+            encode_key(len(KEY_CHARS) ** 3, 3)
+
+    def test_permutation_is_bijective(self):
+        """Test the permutation maps the whole range onto itself."""
+        size = len(KEY_CHARS) ** 2
+        permutation = FeistelPermutation(size, 'secret')
+        values = [permutation(n) for n in range(size)]
+
+        self.assertEqual(sorted(values), list(range(size)))
+        self.assertNotEqual(values[:10], list(range(10)))
+        self.assertEqual([permutation.inverse(v) for v in values], list(range(size)))
+
+    def test_permutation_depends_on_secret(self):
+        """Test different secrets give different permutations."""
+        size = len(KEY_CHARS) ** 7
+        p1 = FeistelPermutation(size, 'secret1')
+        p2 = FeistelPermutation(size, 'secret2')
+
+        self.assertNotEqual([p1(n) for n in range(10)], [p2(n) for n in range(10)])
+
+
+class SequenceKeysTests(TestCase):
+    """Test keys generated from the key sequence."""
+
+    def setUp(self):
+        key_sequence.reset()
+
+    def test_create_sequence_keys(self):
+        """Test sequence keys are valid, unique and allocated one query per block."""
+        with self.assertNumQueries(2):
+            keys = create_sequence_keys(KEY_SEQUENCE_BLOCK + 1)
+
+        self.assertEqual(len(set(keys)), KEY_SEQUENCE_BLOCK + 1)
+        for key in keys:
+            self.assertTrue(is_valid_key(key))
+            self.assertEqual(len(key), settings.DEFAULT_KEY_LEN)
+
+    def test_short_length_grows(self):
+        """Test indexes not fitting in the requested length get longer keys."""
+        keys = create_sequence_keys(len(KEY_CHARS) + 1, length=1)
+
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertTrue(all(len(key) in (1, 2) for key in keys))
+
+    @override_settings(MAPPING_KEY_STRATEGY='sequence')
+    def test_create_mapping_with_sequence_key(self):
+        """Test mappings get keys from the sequence without checking existing keys."""
+        with self.assertNumQueries(2):
+            mapping = Mapping.objects.create(target='https://www.google.com')
+
+        self.assertEqual(len(mapping.key), settings.DEFAULT_KEY_LEN)
+
+
+@override_settings(MAPPING_KEY_STRATEGY='optimistic', MAPPING_KEY_GROWTH_WINDOW=4, MAPPING_KEY_GROWTH_THRESHOLD=0.25)
+class OptimisticKeysTests(TestCase):
+    """Test keys inserted optimistically and retried on collisions."""
+
+    def setUp(self):
+        key_length.reset()
+
+    @override_settings(MAPPING_GUEST_STORE='mapping')
+    def test_create_mapping_without_check(self):
+        """Test the key is not checked before inserting the mapping."""
+        with CaptureQueriesContext(connection) as queries:
+            mapping = Mapping.objects.create(target='https://www.google.com')
+
+        self.assertEqual([q['sql'].split()[0] for q in queries], ['SAVEPOINT', 'INSERT', 'RELEASE'])
+        self.assertEqual(len(mapping.key), settings.DEFAULT_KEY_LEN)
+        self.assertEqual(key_length.stats()['attempts'], 1)
+
+    def test_retry_on_collision(self):
+        """Test a colliding key is replaced by a fresh one."""
+        existing = Mapping.objects.create(target='https://www.google.com')
+
+        with mock.patch('apps.mappings.models.create_random_key', side_effect=[existing.key, 'freshkey']):
+            mapping = Mapping.objects.create(target='https://www.example.com')
+
+        self.assertEqual(mapping.key, 'freshkey')
+        self.assertEqual(Mapping.objects.count(), 2)
+        self.assertEqual(key_length.stats()['collisions'], 1)
+
+    @override_settings(MAPPING_GUEST_STORE='partitioned')
+    def test_retry_on_guest_key_collision(self):
+        """Test a key taken by a guest mapping, out of reach of the unique constraint, is replaced."""
+        guest = GuestMapping.objects.create(target='https://www.google.com', expiry_date=timezone.now())
+
+        with mock.patch('apps.mappings.models.create_random_key', side_effect=[guest.key, 'freshkey']):
+            mapping = Mapping.objects.create(target='https://www.example.com')
+
+        self.assertEqual(mapping.key, 'freshkey')
+        self.assertEqual(key_length.stats()['collisions'], 1)
+
+    def test_other_integrity_errors_not_retried(self):
+        """Test integrity errors not related to the key are raised."""
+        with self.assertRaises(IntegrityError):
+            Mapping.objects.create(target=None)
+        self.assertEqual(key_length.stats().get('collisions', 0), 0)
+
+    def test_key_length_grows(self):
+        """Test the key length grows when the collision rate exceeds the threshold."""
+        existing = Mapping.objects.create(target='https://www.google.com')
+        key_length.reset()
+
+        keys = [existing.key, 'freshkey1', existing.key, 'freshkey2']
+        with mock.patch('apps.mappings.models.create_random_key', side_effect=keys):
+            Mapping.objects.create(target='https://www.google.com')
+            Mapping.objects.create(target='https://www.google.com')
+
+        self.assertEqual(key_length.current, settings.DEFAULT_KEY_LEN + 1)
+        mapping = Mapping.objects.create(target='https://www.google.com')
+        self.assertEqual(len(mapping.key), settings.DEFAULT_KEY_LEN + 1)
+
+
+class CreateKeysTests(TestCase):
+    """Test the generation of keys in bulk."""
+
+    def test_bulk_create_generates_keys(self):
+        """Test mappings created in bulk get unique keys, checked with one query."""
+        mappings = [Mapping(target='https://www.google.com') for _ in range(50)]
+        with self.assertNumQueries(2):
+            Mapping.objects.bulk_create(mappings)
+
+        keys = {mapping.key for mapping in mappings}
+        self.assertEqual(len(keys), 50)
+        self.assertEqual(Mapping.objects.filter(key__in=keys).count(), 50)
+
+    def test_create_keys_skips_existing(self):
+        """Test existing keys are replaced by fresh ones."""
+        existing = Mapping.objects.create(target='https://www.google.com')
+
+        with mock.patch('apps.mappings.models.create_random_key', side_effect=[existing.key, 'freshkey']):
+            self.assertEqual(create_keys(1), ['freshkey'])
@@ -5,7 +5,14 @@ from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
-from apps.mappings.models import Mapping
+from apps.mappings.models import (
+    KEY_MAX_LEN,
+    Mapping,
+    create_random_key,
+    hash_target,
+    is_valid_key,
+    normalize_target,
+)
 
 
 def create_user(**params):
@@ -63,3 +70,32 @@ class MappingTests(TestCase):
 
         self.assertIsNotNone(mapping.key)
         self.assertEqual(len(mapping.key), settings.DEFAULT_KEY_LEN)
+
+    def test_normalize_target(self):
+        """Test the normalization of target URLs."""
+        self.assertEqual(normalize_target('HTTPS://User@WWW.Example.com:443'), 'https://User@www.example.com/')
+        self.assertEqual(normalize_target('http://example.com:8080/A?b=C#d'), 'http://example.com:8080/A?b=C#d')
+        self.assertEqual(hash_target('https://example.com'), hash_target('https://EXAMPLE.com/'))
+        self.assertNotEqual(hash_target('https://example.com/a'), hash_target('https://example.com/A'))
+
+    def test_find_duplicate(self):
+        """Test finding an active mapping of the user with the same target and expiry date."""
+        expiry_date = timezone.now() + timedelta(days=1)
+        mapping = create_mapping(user=self.user, target='https://example.com/a', expiry_date=expiry_date)
+        create_mapping(user=self.user, target='https://example.com/b')
+        create_mapping(user=self.user, target='https://example.com/c', expiry_date=timezone.now())
+
+        self.assertEqual(mapping.target_hash, hash_target(mapping.target))
+        self.assertEqual(Mapping.objects.find_duplicate(self.user, 'https://EXAMPLE.com/a', expiry_date), mapping)
+        self.assertIsNone(Mapping.objects.find_duplicate(self.user, 'https://example.com/a'))
+        self.assertIsNone(Mapping.objects.find_duplicate(self.user, 'https://example.com/c', None))
+        other_user = create_user(email='other@example.com', password='testpass123')
+        self.assertIsNone(Mapping.objects.find_duplicate(other_user, 'https://example.com/a', expiry_date))
+
+    def test_is_valid_key(self):
+        """Test the check of strings that can be keys."""
+        self.assertTrue(is_valid_key(create_random_key()))
+        self.assertTrue(is_valid_key('a' * KEY_MAX_LEN))
+        self.assertFalse(is_valid_key('a' * (settings.DEFAULT_KEY_LEN - 1)))
+        self.assertFalse(is_valid_key('a' * (KEY_MAX_LEN + 1)))
+        self.assertFalse(is_valid_key('abc_defg'))
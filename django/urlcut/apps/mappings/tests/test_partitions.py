@@ -0,0 +1,127 @@
+"""
+Test the partitioned storage of guest mappings.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from apps.mappings.cache import mapping_cache
+from apps.mappings.models import (
+    GuestMapping,
+    Mapping,
+    key_exists,
+    resolve_target,
+)
+from apps.mappings.partitions import (
+    create_partitions,
+    list_partitions,
+    partition_name,
+)
+from apps.mappings.tasks import maintain_partitions
+
+TABLE = GuestMapping._meta.db_table
+CREATE_GUEST_MAPPING_URL = reverse('api:mappings:guest-shorten')
+
+
+def partition_of(mapping):
+    """Return the name of the partition holding a guest mapping."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT tableoid::regclass::text FROM {TABLE} WHERE id = %s', [mapping.id])
+        return cursor.fetchone()[0]
+
+
+@override_settings(MAPPING_GUEST_STORE='partitioned')
+class GuestMappingTests(TestCase):
+    """Test guest mappings stored in their own partitioned table."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+
+    def test_create_guest_mapping(self):
+        """Test a guest mapping is created in the partition of its expiry date and resolves."""
+        res = APIClient().post(CREATE_GUEST_MAPPING_URL, {'target': 'https://www.google.com'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Mapping.objects.exists())
+        mapping = GuestMapping.objects.get(key=res.data['key'])
+        self.assertEqual(partition_of(mapping), partition_name(TABLE, mapping.expiry_date.date()))
+        self.assertEqual(resolve_target(mapping.key), (mapping.target, mapping.expiry_date, True))
+        self.assertTrue(key_exists(mapping.key))
+
+    def test_forward_to_guest_mapping(self):
+        """Test the redirect from the key of a guest mapping."""
+        mapping = GuestMapping.objects.create(target='https://www.google.com',
+                                              expiry_date=timezone.now() + timedelta(days=1))
+
+        res = self.client.get(reverse('mappings:forward', kwargs={'key': mapping.key}))
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(res['Location'], mapping.target)
+
+    def test_expired_guest_mapping_not_resolved(self):
+        """Test an expired guest mapping does not resolve."""
+        mapping = GuestMapping.objects.create(target='https://www.google.com', expiry_date=timezone.now())
+
+        self.assertIsNone(resolve_target(mapping.key))
+
+    def test_maintain_partitions(self):
+        """Test the maintenance creates the upcoming partitions and drops the expired ones."""
+        today = timezone.now().date()
+        create_partitions(TABLE, today - timedelta(days=3), 1)
+        expired = GuestMapping.objects.create(target='https://www.google.com',
+                                              expiry_date=timezone.now() - timedelta(days=3))
+        active = GuestMapping.objects.create(target='https://www.google.com',
+                                             expiry_date=timezone.now() + timedelta(days=1))
+
+        with self.settings(MAPPING_PARTITION_PREMAKE_DAYS=5):
+            result = maintain_partitions()
+
+        self.assertEqual(result['dropped'], [partition_name(TABLE, today - timedelta(days=3))])
+        self.assertEqual(sorted(list_partitions(TABLE)), [today + timedelta(days=i) for i in range(6)])
+        self.assertFalse(GuestMapping.objects.filter(id=expired.id).exists())
+        self.assertTrue(GuestMapping.objects.filter(id=active.id).exists())
+
+    def test_maintain_partitions_unlogged(self):
+        """Test the maintenance creates unlogged partitions, when configured."""
+        with self.settings(MAPPING_GUEST_UNLOGGED=True, MAPPING_PARTITION_PREMAKE_DAYS=5):
+            result = maintain_partitions()
+
+        name = partition_name(TABLE, timezone.now().date() + timedelta(days=5))
+        self.assertIn(name, result['created'])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT relpersistence FROM pg_class WHERE relname = %s', [name])
+            self.assertEqual(cursor.fetchone()[0], 'u')
+
+    def test_maintain_partitions_moves_default_rows(self):
+        """Test the maintenance creates a partition whose day has rows in the default partition."""
+        day = timezone.now().date() + timedelta(days=30)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {partition_name(TABLE, day)}')
+        mapping = GuestMapping.objects.create(target='https://www.google.com',
+                                              expiry_date=timezone.now() + timedelta(days=30))
+        self.assertEqual(partition_of(mapping), f'{TABLE}_default')
+
+        with self.settings(MAPPING_PARTITION_PREMAKE_DAYS=30):
+            result = maintain_partitions()
+
+        self.assertIn(partition_name(TABLE, day), result['created'])
+        self.assertEqual(partition_of(mapping), partition_name(TABLE, day))
+        self.assertEqual(GuestMapping.objects.get(id=mapping.id).key, mapping.key)
+
+    def test_maintain_partitions_purges_default_partition(self):
+        """Test the maintenance deletes the expired mappings outside of the daily partitions."""
+        GuestMapping.objects.create(target='https://www.google.com', expiry_date=timezone.now() - timedelta(days=30))
+
+        result = maintain_partitions()
+
+        self.assertEqual(result['purged'], 1)
+        self.assertFalse(GuestMapping.objects.exists())
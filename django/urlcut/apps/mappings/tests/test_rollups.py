@@ -0,0 +1,111 @@
+"""
+Test the click rollups.
+"""
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+
+from django.test import TestCase
+
+from apps.mappings.models import (
+    ClickEvent,
+    ClickRollup,
+    LifetimeVisitorSketch,
+    Mapping,
+    VisitorSketch,
+    Watermark,
+)
+from apps.mappings.rollups import (
+    WATERMARK_NAME,
+    rollup_clicks,
+)
+from apps.mappings.tasks import rollup_click_events
+
+
+def create_click(key, *args, ip_hash=''):
+    """Create and return a click event at the given UTC date and time."""
+    return ClickEvent.objects.create(key=key, timestamp=datetime(*args, tzinfo=timezone.utc), ip_hash=ip_hash)
+
+
+def rollup_counts(granularity):
+    return {
+        (r.key, r.bucket.isoformat()): r.count
+        for r in ClickRollup.objects.filter(granularity=granularity)
+    }
+
+
+class RollupClicksTests(TestCase):
+    """Test the incremental rollup of click events."""
+
+    def test_rollup_clicks(self):
+        """Test click events are counted per hour and per day."""
+        create_click('abcdefg', 2024, 1, 1, 10, 5)
+        create_click('abcdefg', 2024, 1, 1, 10, 55)
+        create_click('abcdefg', 2024, 1, 1, 11, 0)
+        create_click('bcdefgh', 2024, 1, 2, 0, 0)
+
+        self.assertEqual(rollup_click_events(), 4)
+
+        self.assertEqual(rollup_counts('hour'), {
+            ('abcdefg', '2024-01-01T10:00:00+00:00'): 2,
+            ('abcdefg', '2024-01-01T11:00:00+00:00'): 1,
+            ('bcdefgh', '2024-01-02T00:00:00+00:00'): 1,
+        })
+        self.assertEqual(rollup_counts('day'), {
+            ('abcdefg', '2024-01-01T00:00:00+00:00'): 3,
+            ('bcdefgh', '2024-01-02T00:00:00+00:00'): 1,
+        })
+
+    def test_rollup_clicks_incremental(self):
+        """Test only the events logged since the watermark are added, in batches."""
+        create_click('abcdefg', 2024, 1, 1, 10, 5)
+        rollup_clicks(batch_size=10)
+        for minute in range(3):
+            create_click('abcdefg', 2024, 1, 1, 10, minute)
+
+        self.assertEqual(rollup_clicks(batch_size=1), 3)
+        self.assertEqual(rollup_clicks(batch_size=1), 0)
+
+        self.assertEqual(rollup_counts('day'), {('abcdefg', '2024-01-01T00:00:00+00:00'): 4})
+        self.assertEqual(Watermark.objects.get(name=WATERMARK_NAME).value, ClickEvent.objects.latest('id').id)
+
+    def test_rollup_visitor_sketches(self):
+        """Test the visitors of the click events are added to daily sketches, across batches."""
+        for visitor in ('a', 'b', 'a'):
+            create_click('abcdefg', 2024, 1, 1, 10, 5, ip_hash=visitor)
+        create_click('abcdefg', 2024, 1, 2, 10, 5, ip_hash='c')
+        create_click('abcdefg', 2024, 1, 2, 10, 5)
+
+        rollup_clicks(batch_size=2)
+
+        sketches = VisitorSketch.objects.filter(key='abcdefg').order_by('bucket')
+        self.assertEqual([s.bucket.isoformat() for s in sketches],
+                         ['2024-01-01T00:00:00+00:00', '2024-01-02T00:00:00+00:00'])
+        self.assertEqual(VisitorSketch.objects.filter(bucket__day=1).merged().count(), 2)
+        self.assertEqual(sketches.merged().count(), 3)
+
+    def test_rollup_lifetime_sketches(self):
+        """Test the visitors of a mapping since its creation are added to its lifetime sketch."""
+        created_at = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+        mapping = Mapping.objects.create(key='abcdefg', target='https://www.google.com', created_at=created_at)
+        # a visitor of a former mapping with the same key
+        create_click('abcdefg', 2024, 1, 1, 10, 5, ip_hash='a')
+        for visitor in ('b', 'c', 'b'):
+            create_click('abcdefg', 2024, 1, 1, 13, 5, ip_hash=visitor)
+        create_click('abcdefg', 2024, 1, 3, 10, 5, ip_hash='d')
+
+        rollup_clicks(batch_size=2)
+
+        sketch = LifetimeVisitorSketch.objects.get(key='abcdefg')
+        self.assertEqual(sketch.started_at, created_at)
+        self.assertEqual(LifetimeVisitorSketch.objects.unique_visitors([mapping]), {'abcdefg': 3})
+
+        # the key is given to a new mapping
+        Mapping.objects.filter(id=mapping.id).update(created_at=created_at + timedelta(days=3))
+        mapping.refresh_from_db()
+        self.assertEqual(LifetimeVisitorSketch.objects.unique_visitors([mapping]), {'abcdefg': 0})
+        create_click('abcdefg', 2024, 1, 4, 13, 5, ip_hash='e')
+        rollup_clicks(batch_size=2)
+        self.assertEqual(LifetimeVisitorSketch.objects.unique_visitors([mapping]), {'abcdefg': 1})
@@ -0,0 +1,24 @@
+"""
+Test the classification of redirect requests.
+"""
+from django.test import SimpleTestCase
+
+from apps.mappings.traffic import classify_request
+
+FIREFOX = 'Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0'
+
+
+class ClassifyRequestTests(SimpleTestCase):
+    """Test requests are classified from their method, user agent and purpose headers."""
+
+    def test_classify_request(self):
+        """Test HEAD requests, prefetches, previews and bots are told apart from visits."""
+        self.assertEqual(classify_request('GET', FIREFOX, [None, None, None, None]), 'human')
+        self.assertEqual(classify_request('GET', '', []), 'human')
+        self.assertEqual(classify_request('HEAD', FIREFOX, []), 'head')
+        self.assertEqual(classify_request('GET', FIREFOX, ['prefetch;prerender', None]), 'prefetch')
+        self.assertEqual(classify_request('GET', FIREFOX, [None, None, None, 'preview']), 'prefetch')
+        self.assertEqual(classify_request('GET', 'Mozilla/5.0 (compatible; Googlebot/2.1)', []), 'bot')
+        self.assertEqual(classify_request('GET', 'WhatsApp/2.23.20.0', []), 'bot')
+        self.assertEqual(classify_request('GET', 'Discordbot/2.0', []), 'bot')
+        self.assertEqual(classify_request('GET', 'curl/8.4.0', []), 'bot')
@@ -0,0 +1,118 @@
+"""
+Test the trending keys.
+"""
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.test.client import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.mappings.cache import mapping_cache
+from apps.mappings.models import (
+    Mapping,
+    TrendingSketch,
+)
+from apps.mappings.tasks import refresh_trending
+from apps.mappings.trending import (
+    SpaceSaving,
+    TrendingTracker,
+    merge_counters,
+    saved_trending,
+    trending_tracker,
+)
+
+
+class SpaceSavingTests(SimpleTestCase):
+    """Test the space-saving sketch."""
+
+    def test_heavy_hitters(self):
+        """Test the most frequent keys are found with few counters, within their error bounds."""
+        rng = random.Random(0)
+        stream = [f'hot{i}' for i in range(5) for _ in range(200)] + [f'cold{rng.randrange(5000)}' for _ in range(3000)]
+        rng.shuffle(stream)
+        actual = Counter(stream)
+
+        sketch = SpaceSaving(capacity=50)
+        for key in stream:
+            sketch.add(key)
+
+        self.assertEqual(len(sketch), 50)
+        counters = sketch.counters()
+        for i in range(5):
+            count, error = counters[f'hot{i}']
+            self.assertLessEqual(count - error, actual[f'hot{i}'])
+            self.assertGreaterEqual(count, actual[f'hot{i}'])
+        top = merge_counters([counters], 5)
+        self.assertEqual({key for key, _, _ in top}, {f'hot{i}' for i in range(5)})
+
+    def test_merge_counters(self):
+        """Test the counters of several sketches are summed into the top keys."""
+        top = merge_counters([{'a': [5, 0], 'b': [3, 1]}, {'b': [4, 0], 'c': [1, 0]}], 2)
+
+        self.assertEqual(top, [('b', 7, 1), ('a', 5, 0)])
+
+
+@override_settings(MAPPING_TRENDING_ENABLED=True, MAPPING_TRENDING_FLUSH_INTERVAL=0)
+class TrendingTests(TestCase):
+    """Test the trending keys, from the redirects to the merged top keys."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+        trending_tracker.drain()
+
+    def test_forward_records_trending(self):
+        """Test redirects are counted in the sketch of the process, which is saved on flush."""
+        mapping = Mapping.objects.create(target='https://www.google.com')
+
+        for _ in range(3):
+            Client().get(reverse('mappings:forward', kwargs={'key': mapping.key}))
+        trending_tracker.flush()
+
+        self.assertEqual(TrendingSketch.objects.get().counters, {mapping.key: [3, 0]})
+
+    def test_forward_without_trending(self):
+        """Test redirects are not counted when the trending keys are disabled."""
+        mapping = Mapping.objects.create(target='https://www.google.com')
+
+        with self.settings(MAPPING_TRENDING_ENABLED=False):
+            Client().get(reverse('mappings:forward', kwargs={'key': mapping.key}))
+        self.assertEqual(trending_tracker.drain(), {})
+
+    def test_refresh_trending(self):
+        """Test the sketches of the window are merged, saved and pre-warmed, and older ones deleted."""
+        m1 = Mapping.objects.create(target='https://www.google.com')
+        m2 = Mapping.objects.create(target='https://www.example.com')
+        TrendingSketch.objects.create(counters={m1.key: [2, 0], m2.key: [3, 0]})
+        TrendingSketch.objects.create(counters={m1.key: [4, 1]})
+        old = TrendingSketch.objects.create(created_at=timezone.now() - timedelta(hours=1), counters={m2.key: [99, 0]})
+
+        with self.settings(MAPPING_TRENDING_WINDOW=600, MAPPING_TRENDING_TOP_K=1):
+            top = refresh_trending()
+
+        self.assertEqual(top, [(m1.key, 6, 1)])
+        self.assertEqual(saved_trending(), top)
+        self.assertEqual(mapping_cache.local.get(m1.key), (m1.target, None, False))
+        self.assertIsNone(mapping_cache.local.get(m2.key))
+        self.assertFalse(TrendingSketch.objects.filter(id=old.id).exists())
+
+    def test_flush_warms_local_cache(self):
+        """Test a process warms its local cache tier with the saved top keys on flush."""
+        mapping = Mapping.objects.create(target='https://www.google.com')
+        TrendingSketch.objects.create(counters={mapping.key: [1, 0]})
+        refresh_trending()
+        mapping_cache.local.clear()
+
+        tracker = TrendingTracker()
+        tracker.flush()
+
+        self.assertEqual(mapping_cache.local.get(mapping.key), (mapping.target, None, False))
+        self.assertEqual(tracker.stats()['warmed_keys'], 1)
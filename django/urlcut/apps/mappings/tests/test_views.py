@@ -1,17 +1,36 @@
 """
 Test mappings.
 """
+import asyncio
 from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+from unittest import mock
 
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import (
+    AsyncClient,
+    Client,
+)
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.core import mail
+from django.core.cache import cache
+from django.db import connections
 
-from apps.mappings.models import Mapping
-from apps.mappings.tasks import cleanup_mappings
+from apps.mappings.cache import mapping_cache
+from apps.mappings.locks import lock_id
+from apps.mappings.models import (
+    ExpiredMapping,
+    Mapping,
+)
+from apps.mappings.tasks import (
+    cleanup_mappings,
+    notify_expired_mappings,
+    send_expired_notifications,
+)
+from apps.mappings.traffic import traffic_counters
+from apps.mappings.visits import background_visits
 
 
 def forward_target_url(key):
@@ -40,8 +59,15 @@ class MappingViewTests(TestCase):
     """Test mapping views."""
 
     def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
         self.client = Client()
         self.user = create_user(email='test@example.com', password='testpass123')
+        # run the notification tasks in process
+        patcher = mock.patch.object(send_expired_notifications, 'delay',
+                                    side_effect=lambda *args: send_expired_notifications.apply(args))
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_forward_to_target(self):
         """Test the redirect from key to target URL."""
@@ -58,11 +84,71 @@ class MappingViewTests(TestCase):
         mapping.refresh_from_db(fields=['visits'])
         self.assertEqual(mapping.visits, 1)
 
+    async def test_forward_to_target_async(self):
+        """Test the redirect served under ASGI increments the visits count in the background."""
+        mapping = await Mapping.objects.acreate(target='https://www.google.com')
+
+        res = await AsyncClient().get(forward_target_url(mapping.key))
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(res['Location'], mapping.target)
+        await asyncio.gather(*background_visits)
+        visits = await Mapping.objects.values_list('visits', flat=True).aget(id=mapping.id)
+        self.assertEqual(visits, 1)
+
+    def test_forward_to_target_head(self):
+        """Test the redirect from key to target URL with a HEAD request."""
+        mapping = create_mapping(self.user)
+
+        res = self.client.head(forward_target_url(mapping.key))
+        self.assertRedirects(res, mapping.target, fetch_redirect_response=False)
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 0)
+
+    def test_forward_bots_and_prefetches_not_counted(self):
+        """Test bots and prefetches are redirected without counting visits, and counted in their class."""
+        mapping = create_mapping(self.user)
+        traffic_counters.reset()
+
+        for headers in [
+            {'HTTP_USER_AGENT': 'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)'},
+            {'HTTP_USER_AGENT': 'facebookexternalhit/1.1'},
+            {'HTTP_SEC_PURPOSE': 'prefetch;prerender'},
+            {'HTTP_PURPOSE': 'prefetch'},
+        ]:
+            res = self.client.get(forward_target_url(mapping.key), **headers)
+            self.assertRedirects(res, mapping.target, fetch_redirect_response=False)
+        self.client.get(forward_target_url(mapping.key), HTTP_USER_AGENT='Mozilla/5.0 (X11; Linux x86_64)')
+
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 1)
+        self.assertEqual(traffic_counters.snapshot(), {'bot': 2, 'prefetch': 2, 'human': 1})
+
+    def test_forward_skipped_classes_setting(self):
+        """Test the request classes not counted as visits are configurable."""
+        mapping = create_mapping(self.user)
+
+        with self.settings(MAPPING_VISITS_SKIPPED_CLASSES=()):
+            self.client.head(forward_target_url(mapping.key))
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 1)
+
+    def test_forward_post_not_allowed(self):
+        """Test POST is not allowed for the redirect."""
+        mapping = create_mapping(self.user)
+
+        res = self.client.post(forward_target_url(mapping.key))
+        self.assertEqual(res.status_code, 405)
+
     def test_forward_to_non_existing_target(self):
         """Test that visiting an non-existing mapping does not work."""
         res = self.client.get(forward_target_url('asdfasdf'))
         self.assertEqual(res.status_code, 404)
 
+    def test_forward_to_invalid_key(self):
+        """Test that visiting a string that cannot be a key does not work."""
+        res = self.client.get(forward_target_url('a-b'))
+        self.assertEqual(res.status_code, 404)
+
     def test_forward_to_expired_target(self):
         """Test that visiting an expired mapping does not work."""
         mapping = create_mapping(self.user, expiry_date=timezone.now())
@@ -89,16 +175,119 @@ class MappingViewTests(TestCase):
         self.assertEqual(Mapping.objects.count(), 2)
         self.assertFalse(Mapping.objects.filter(id=expired.id).exists())
 
+    def test_cleanup_mappings_records_deleted_mappings(self):
+        """Test the cleanup records the deleted mappings of users for the digest, without sending e-mails."""
+        mapping = create_mapping(user=self.user, expiry_date=timezone.now())
+
+        deleted = cleanup_mappings()
+        self.assertEqual(deleted, 1)
+        self.assertEqual(len(mail.outbox), 0)
+        expired = ExpiredMapping.objects.get()
+        self.assertEqual((expired.user, expired.key, expired.target), (self.user, mapping.key, mapping.target))
+
     def test_cleanup_mappings_email_to_users(self):
         """Test the notification is sent to users whose expired mappings are deleted."""
         create_mapping(user=self.user, expiry_date=timezone.now())
 
         deleted = cleanup_mappings()
         self.assertEqual(deleted, 1)
+        self.assertEqual(notify_expired_mappings(), 1)
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].to, [self.user.email])
         self.assertIn('Expired URLs', mail.outbox[0].subject)
 
+    def test_cleanup_mappings_email_lists_deleted_mappings(self):
+        """Test the notification lists the deleted mappings."""
+        m1 = create_mapping(user=self.user, expiry_date=timezone.now(), target='https://example.com/1')
+        m2 = create_mapping(user=self.user, expiry_date=timezone.now(), target='https://example.com/2')
+
+        with self.settings(MAPPING_CLEANUP_BATCH_SIZE=1):
+            deleted = cleanup_mappings()
+        self.assertEqual(deleted, 2)
+        notify_expired_mappings()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('following 2 expired URLs', mail.outbox[0].body)
+        for mapping in (m1, m2):
+            self.assertIn(f"Key '{mapping.key}' for URL {mapping.target}", mail.outbox[0].body)
+
+    def test_cleanup_mappings_notifications_in_chunks(self):
+        """Test the notifications are sent from one task per chunk of users."""
+        for i in range(3):
+            create_mapping(user=create_user(email=f'test{i}@example.com', password='testpass123'),
+                           expiry_date=timezone.now())
+
+        cleanup_mappings()
+        with self.settings(MAPPING_NOTIFY_CHUNK_SIZE=2):
+            notify_expired_mappings()
+        self.assertEqual(self.notify.call_count, 2)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_notify_expired_mappings_once(self):
+        """Test the deleted mappings are notified in one digest only."""
+        create_mapping(user=self.user, expiry_date=timezone.now())
+        cleanup_mappings()
+
+        self.assertEqual(notify_expired_mappings(), 1)
+        self.assertEqual(notify_expired_mappings(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(ExpiredMapping.objects.exists())
+
+    def test_send_expired_notifications_reuses_connection(self):
+        """Test the e-mails of a chunk are sent through a single connection."""
+        user2 = create_user(email='test2@example.com', password='testpass123')
+        mappings = [{'key': 'abcdefg', 'target': 'https://www.google.com', 'visits': 1}]
+
+        with mock.patch('apps.mappings.tasks.get_connection', wraps=mail.get_connection) as get_connection:
+            sent = send_expired_notifications([(self.user.id, mappings), (user2.id, mappings)])
+        self.assertEqual(sent, 2)
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_send_expired_notifications_retried(self):
+        """Test a chunk failing to be sent is retried."""
+        mappings = [{'key': 'abcdefg', 'target': 'https://www.google.com', 'visits': 1}]
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=SMTPServerDisconnected('down')), \
+                mock.patch.object(send_expired_notifications, 'retry', side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                send_expired_notifications([(self.user.id, mappings)])
+        retry.assert_called_once()
+
+    def test_cleanup_mappings_max_rows(self):
+        """Test a sweep deletes at most MAPPING_SWEEP_MAX_ROWS mappings, leaving the rest for the next one."""
+        for _ in range(3):
+            create_mapping(user=None, expiry_date=timezone.now() - timedelta(minutes=5))
+
+        with self.settings(MAPPING_SWEEP_MAX_ROWS=2, MAPPING_CLEANUP_BATCH_SIZE=1):
+            self.assertEqual(cleanup_mappings(), 2)
+        self.assertEqual(Mapping.objects.count(), 1)
+        self.assertGreaterEqual(Mapping.objects.expiry_lag(), 5 * 60)
+        self.assertEqual(cleanup_mappings(), 1)
+        self.assertEqual(Mapping.objects.expiry_lag(), 0)
+
+    def test_cleanup_mappings_time_budget(self):
+        """Test the cleanup stops once its time budget is exhausted."""
+        create_mapping(user=self.user, expiry_date=timezone.now())
+
+        with self.settings(MAPPING_CLEANUP_TIME_BUDGET=0):
+            deleted = cleanup_mappings()
+        self.assertEqual(deleted, 0)
+        self.assertEqual(Mapping.objects.count(), 1)
+
+    def test_cleanup_mappings_skipped_when_locked(self):
+        """Test the cleanup does nothing while another cleanup holds the lock."""
+        create_mapping(user=self.user, expiry_date=timezone.now())
+        other = connections.create_connection('default')
+        try:
+            with other.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_lock(%s)', [lock_id('cleanup_mappings')])
+            deleted = cleanup_mappings()
+        finally:
+            other.close()
+        self.assertEqual(deleted, 0)
+        self.assertEqual(Mapping.objects.count(), 1)
+
     def test_cleanup_mappings_email_to_users_grouped_by_user(self):
         """Test the expired notification is sent only once per user."""
         user2 = create_user(email='test2@example.com', password='testpass123')
@@ -108,6 +297,7 @@ class MappingViewTests(TestCase):
 
         deleted = cleanup_mappings()
         self.assertEqual(deleted, 3)
+        notify_expired_mappings()
         self.assertEqual(len(mail.outbox), 2)
 
     def test_cleanup_guest_mappings(self):
@@ -124,4 +314,5 @@ class MappingViewTests(TestCase):
 
         deleted = cleanup_mappings()
         self.assertEqual(deleted, 1)
+        notify_expired_mappings()
         self.assertEqual(len(mail.outbox), 0)
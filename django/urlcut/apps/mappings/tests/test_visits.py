@@ -0,0 +1,198 @@
+"""
+Test visit counting.
+"""
+import asyncio
+from unittest import mock
+
+from django.core.cache import cache
+from kombu.exceptions import OperationalError
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.test.client import Client
+from django.urls import reverse
+
+from apps.mappings.cache import mapping_cache
+from apps.mappings.models import Mapping
+from apps.mappings.visits import (
+    VisitBuffer,
+    apply_visits,
+    background_visits,
+    record_visit_in_background,
+    visit_buffer,
+)
+
+
+def create_mapping(**params):
+    """Create and return a test mapping."""
+    defaults = {
+        'target': 'https://www.google.com',
+        'expiry_date': None,
+    }
+    defaults.update(params)
+
+    return Mapping.objects.create(**defaults)
+
+
+class ApplyVisitsTests(TestCase):
+    """Test the batched update of visits."""
+
+    def test_apply_visits(self):
+        """Test deltas are added to the visits of the related mappings only."""
+        m1 = create_mapping(visits=2)
+        m2 = create_mapping()
+        m3 = create_mapping()
+
+        with self.assertNumQueries(1):
+            apply_visits({m1.key: 3, m2.key: 1, 'unknown1': 5})
+
+        visits = dict(Mapping.objects.values_list('id', 'visits'))
+        self.assertEqual(visits, {m1.id: 5, m2.id: 1, m3.id: 0})
+
+
+@override_settings(MAPPING_VISITS_FLUSH_INTERVAL=None, MAPPING_VISITS_MAX_PENDING=100)
+class VisitBufferTests(TestCase):
+    """Test the in-memory visit buffer."""
+
+    def test_flush(self):
+        """Test buffered visits are applied on flush."""
+        mapping = create_mapping()
+        buffer = VisitBuffer()
+        buffer.add(mapping.key)
+        buffer.add(mapping.key)
+
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 0)
+        self.assertEqual(buffer.pending, 2)
+
+        self.assertEqual(buffer.flush(), 2)
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 2)
+        self.assertEqual(buffer.pending, 0)
+
+    @override_settings(MAPPING_VISITS_MAX_PENDING=3)
+    def test_flush_when_full(self):
+        """Test the buffer flushes itself when the max pending visits is reached."""
+        mapping = create_mapping()
+        buffer = VisitBuffer()
+        for _ in range(3):
+            buffer.add(mapping.key)
+
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 3)
+
+    def test_failed_flush_keeps_visits(self):
+        """Test visits are kept in the buffer when the flush fails."""
+        buffer = VisitBuffer()
+        buffer.add('abcdefg', 2)
+
+        with mock.patch('apps.mappings.visits.apply_visits', side_effect=OSError('down')):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending, 2)
+        self.assertEqual(buffer.stats()['flush_errors'], 1)
+
+    @override_settings(MAPPING_VISITS_FLUSH_VIA_CELERY=True)
+    def test_flush_via_celery(self):
+        """Test buffered visits are handed to a Celery task."""
+        buffer = VisitBuffer()
+        buffer.add('abcdefg', 2)
+
+        with mock.patch('apps.mappings.tasks.apply_visit_deltas.delay') as delay:
+            buffer.flush()
+        delay.assert_called_once_with({'abcdefg': 2})
+
+    @override_settings(MAPPING_VISITS_FLUSH_VIA_CELERY=True)
+    def test_failed_publish_keeps_visits(self):
+        """Test visits are kept in the buffer when the broker is down."""
+        buffer = VisitBuffer()
+        buffer.add('abcdefg', 2)
+
+        with mock.patch('apps.mappings.tasks.apply_visit_deltas.delay', side_effect=OperationalError('down')):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending, 2)
+        self.assertEqual(buffer.stats()['flush_errors'], 1)
+
+    def test_timer_survives_errors(self):
+        """Test the flush timer goes on after an unexpected error."""
+        class Stop(BaseException):
+            pass
+
+        buffer = VisitBuffer()
+        with mock.patch.object(buffer, '_wake') as wake, \
+                mock.patch.object(buffer, 'flush', side_effect=[RuntimeError('boom'), 0]) as flush, \
+                mock.patch('apps.mappings.visits.app_log') as log:
+            wake.wait.side_effect = [False, False, Stop]
+            with self.assertRaises(Stop):
+                buffer._run_timer(1)
+        self.assertEqual(flush.call_count, 2)
+        log.exception.assert_called_once()
+
+    @override_settings(MAPPING_VISITS_MAX_PENDING=3)
+    def test_add_nowait_wakes_timer(self):
+        """Test a full buffer wakes the flush timer instead of flushing in the caller."""
+        mapping = create_mapping()
+        buffer = VisitBuffer()
+        with mock.patch.object(buffer, '_ensure_timer'):
+            for _ in range(2):
+                buffer.add_nowait(mapping.key)
+            self.assertFalse(buffer._wake.is_set())
+            buffer.add_nowait(mapping.key)
+
+        self.assertTrue(buffer._wake.is_set())
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 0)
+        self.assertEqual(buffer.pending, 3)
+
+
+@override_settings(MAPPING_VISITS_MODE='buffered', MAPPING_VISITS_FLUSH_INTERVAL=None, MAPPING_VISITS_MAX_PENDING=100)
+class BufferedForwardTests(TestCase):
+    """Test the redirect with buffered visit counting."""
+
+    def setUp(self):
+        mapping_cache.clear()
+        cache.clear()
+        visit_buffer.drain()
+
+    def test_forward_does_not_update_visits(self):
+        """Test a redirect only buffers the visit, which is applied on flush."""
+        mapping = create_mapping()
+        url = reverse('mappings:forward', kwargs={'key': mapping.key})
+        Client().get(url)
+
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 0)
+
+        visit_buffer.flush()
+        mapping.refresh_from_db(fields=['visits'])
+        self.assertEqual(mapping.visits, 1)
+
+
+@override_settings(MAPPING_VISITS_FLUSH_INTERVAL=None, MAPPING_VISITS_MAX_PENDING=100)
+class BackgroundVisitTests(TestCase):
+    """Test the visits counted after ASGI responses."""
+
+    def setUp(self):
+        visit_buffer.drain()
+        self.addCleanup(visit_buffer.drain)
+
+    @override_settings(MAPPING_VISITS_MODE='buffered')
+    async def test_buffered_visit_only_buffered(self):
+        """Test a buffered visit is added to the buffer, without any task."""
+        record_visit_in_background('abcdefg')
+
+        self.assertEqual(background_visits, set())
+        self.assertEqual(visit_buffer.pending, 1)
+
+    @override_settings(MAPPING_VISITS_MAX_BACKGROUND=2)
+    async def test_exact_visits_bounded(self):
+        """Test exact updates past the max pending updates are buffered instead."""
+        mapping = await Mapping.objects.acreate(target='https://www.google.com')
+        for _ in range(3):
+            record_visit_in_background(mapping.key)
+
+        self.assertEqual(len(background_visits), 2)
+        self.assertEqual(visit_buffer.pending, 1)
+        await asyncio.gather(*background_visits)
+        visits = await Mapping.objects.values_list('visits', flat=True).aget(id=mapping.id)
+        self.assertEqual(visits, 2)
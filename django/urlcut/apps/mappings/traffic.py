@@ -0,0 +1,52 @@
+"""
+Classification of the requests on the redirect path.
+
+Link preview crawlers, chat apps unfurling links, HEAD requests and browser prefetches get the redirect like
+anyone, but are not visits: requests are classified from their method, user agent and purpose headers, with
+precompiled patterns, and only the classes missing from settings.MAPPING_VISITS_SKIPPED_CLASSES are counted
+as visits. The requests of each class are counted in memory, for reporting.
+"""
+import re
+
+from django.conf import settings
+
+from apps.mappings.metrics import Counters
+
+HUMAN = 'human'
+HEAD = 'head'
+PREFETCH = 'prefetch'
+BOT = 'bot'
+
+BOT_PATTERN = re.compile(
+    r'bot\b|crawl|spider|slurp|preview|facebookexternalhit|embedly|whatsapp|skypeuripreview|bitlybot|'
+    r'curl/|wget/|python-requests|python-urllib|go-http-client|okhttp|java/|headless',
+    re.IGNORECASE,
+)
+
+# headers announcing speculative requests: Sec-Purpose and Purpose (prefetch, prerender), X-Moz (prefetch)
+# and X-Purpose (preview)
+PURPOSE_HEADERS = ['sec-purpose', 'purpose', 'x-moz', 'x-purpose']
+PURPOSE_PATTERN = re.compile(r'prefetch|prerender|preview', re.IGNORECASE)
+
+traffic_counters = Counters()
+
+
+def classify_request(method, user_agent, purposes):
+    """
+    Return the class of a redirect request (human, head, prefetch or bot) from its method, user agent and
+    the values of its PURPOSE_HEADERS.
+    """
+    if method == 'HEAD':
+        return HEAD
+    if any(purpose and PURPOSE_PATTERN.search(purpose) for purpose in purposes):
+        return PREFETCH
+    if user_agent and BOT_PATTERN.search(user_agent):
+        return BOT
+    return HUMAN
+
+
+def is_visit(method, user_agent, purposes):
+    """Classify a redirect request and count it in its class, return whether it counts as a visit."""
+    traffic_class = classify_request(method, user_agent, purposes)
+    traffic_counters.incr(traffic_class)
+    return traffic_class not in settings.MAPPING_VISITS_SKIPPED_CLASSES
@@ -0,0 +1,201 @@
+"""
+Trending keys, from heavy-hitters sketches of the redirect path.
+
+With settings.MAPPING_TRENDING_ENABLED, every process counts the keys it redirects in a space-saving sketch of
+settings.MAPPING_TRENDING_CAPACITY counters, in bounded memory and without any I/O. Every
+settings.MAPPING_TRENDING_FLUSH_INTERVAL seconds a background thread saves the sketch as a TrendingSketch row
+and starts a new one. The refresh_trending task merges the sketches of the last settings.MAPPING_TRENDING_WINDOW
+seconds into the top settings.MAPPING_TRENDING_TOP_K keys, saves them in the database (TrendingTop), and
+pre-warms the mapping cache with their targets; each process then warms its local cache tier with them on its
+next flush.
+"""
+import atexit
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    close_old_connections,
+)
+from django.utils import timezone
+
+from apps.mappings.metrics import Counters
+from apps.mappings.models import (
+    TrendingSketch,
+    TrendingTop,
+    resolve_target,
+)
+
+app_log = logging.getLogger('urlcut.apps.mappings')
+
+
+class SpaceSaving:
+    """
+    Space-saving sketch of the most frequent keys of a stream, with a fixed number of counters.
+    When all counters are taken, a new key replaces the least counted one and inherits its count as error:
+    the count of a key is an upper bound of its actual count, and the count minus the error a lower bound.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._counters = {}
+        # one (count, key) entry per counter, whose count may lag behind the counter's
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key, count=1):
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += count
+        elif len(self._counters) < self.capacity:
+            self._counters[key] = [count, 0]
+            heapq.heappush(self._heap, (count, key))
+        else:
+            min_count, min_key = self._pop_min()
+            del self._counters[min_key]
+            self._counters[key] = [min_count + count, min_count]
+            heapq.heappush(self._heap, (min_count + count, key))
+
+    def _pop_min(self):
+        while True:
+            count, key = self._heap[0]
+            current = self._counters[key][0]
+            if current == count:
+                return heapq.heappop(self._heap)
+            heapq.heapreplace(self._heap, (current, key))
+
+    def counters(self):
+        """Return the ``{key: [count, error]}`` counters."""
+        return {key: list(counter) for key, counter in self._counters.items()}
+
+
+def merge_counters(sketches, top_k):
+    """
+    Merge ``{key: [count, error]}`` counters of several sketches by summing them, and return the top_k
+    most counted keys as ``(key, count, error)`` tuples.
+    """
+    merged = {}
+    for counters in sketches:
+        for key, (count, error) in counters.items():
+            total = merged.setdefault(key, [0, 0])
+            total[0] += count
+            total[1] += error
+    top = heapq.nlargest(top_k, merged.items(), key=lambda item: item[1][0])
+    return [(key, count, error) for key, (count, error) in top]
+
+
+def top_trending():
+    """Merge the sketches saved within the last settings.MAPPING_TRENDING_WINDOW seconds into the top keys."""
+    since = timezone.now() - timedelta(seconds=settings.MAPPING_TRENDING_WINDOW)
+    sketches = TrendingSketch.objects.filter(created_at__gte=since).values_list('counters', flat=True)
+    return merge_counters(sketches.iterator(), settings.MAPPING_TRENDING_TOP_K)
+
+
+def saved_trending():
+    """Return the top keys saved by the last refresh_trending task within the window, or None."""
+    since = timezone.now() - timedelta(seconds=settings.MAPPING_TRENDING_WINDOW)
+    top = TrendingTop.objects.filter(created_at__gte=since).order_by('-created_at').values_list('keys', flat=True)
+    keys = top.first()
+    return None if keys is None else [tuple(item) for item in keys]
+
+
+def save_trending(top):
+    """Save the top keys for all processes, in the database, replacing the previous ones."""
+    saved = TrendingTop.objects.create(keys=top)
+    TrendingTop.objects.filter(created_at__lt=saved.created_at).delete()
+
+
+def warm_mapping_cache(keys):
+    """Resolve the given keys, so that their targets are cached; return the number of active ones."""
+    return sum(resolve_target(key) is not None for key in keys)
+
+
+class TrendingTracker:
+    """Per-process space-saving sketch of the redirected keys, saved periodically by a background thread."""
+
+    def __init__(self):
+        self.counters = Counters()
+        self._sketch = None
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def add(self, key):
+        with self._lock:
+            if self._sketch is None:
+                self._sketch = SpaceSaving(settings.MAPPING_TRENDING_CAPACITY)
+            self._sketch.add(key)
+        self._ensure_thread()
+
+    def drain(self):
+        """Return the counters of the current sketch, starting a new one."""
+        with self._lock:
+            sketch, self._sketch = self._sketch, None
+        return sketch.counters() if sketch else {}
+
+    def flush(self):
+        """Save the current sketch, then warm the local mapping cache with the saved top keys."""
+        self.save()
+        try:
+            top = saved_trending()
+        except DatabaseError as e:
+            app_log.error(f'TrendingTracker - Error reading the trending keys: {e}')
+            return
+        if top:
+            self.counters.incr('warmed_keys', warm_mapping_cache(key for key, _, _ in top))
+
+    def save(self):
+        """Save the current sketch as a TrendingSketch row, and start a new one."""
+        counters = self.drain()
+        if counters:
+            try:
+                TrendingSketch.objects.create(counters=counters)
+            except DatabaseError as e:
+                # the sketch is lost: trending keys are approximate anyway
+                self.counters.incr('flush_errors')
+                app_log.error(f'TrendingTracker - Error saving a sketch of {len(counters)} keys: {e}')
+            else:
+                self.counters.incr('flushes')
+
+    def stats(self):
+        return {
+            'tracked_keys': len(self._sketch or ()),
+            **self.counters.snapshot(),
+        }
+
+    def _ensure_thread(self):
+        # the flush thread does not survive a fork, so it is started once per process
+        interval = settings.MAPPING_TRENDING_FLUSH_INTERVAL
+        if not interval or self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, args=(interval,), name='trending-flush', daemon=True).start()
+
+    def _run(self, interval):
+        # the thread is never restarted in this process, so it must survive any error
+        while True:
+            time.sleep(interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                app_log.exception('TrendingTracker - Error in the flush thread')
+
+
+trending_tracker = TrendingTracker()
+atexit.register(trending_tracker.save)
+
+
+def record_trending(key):
+    """Count a redirect of the given key towards the trending keys, if settings.MAPPING_TRENDING_ENABLED."""
+    if settings.MAPPING_TRENDING_ENABLED:
+        trending_tracker.add(key)
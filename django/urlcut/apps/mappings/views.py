@@ -1,18 +1,52 @@
 import logging
 
-from django.shortcuts import get_object_or_404
-from django.views.generic.base import RedirectView
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    Http404,
+    HttpResponseRedirect,
+)
+from django.views import View
 
-from apps.mappings.models import Mapping
+from apps.mappings.clicks import record_click
+from apps.mappings.models import aresolve_target
+from apps.mappings.traffic import (
+    PURPOSE_HEADERS,
+    is_visit,
+)
+from apps.mappings.trending import record_trending
+from apps.mappings.visits import (
+    arecord_visit,
+    record_visit_in_background,
+)
 
 app_log = logging.getLogger('urlcut.apps.mappings')
 
 
-class ForwardToTargetView(RedirectView):
+class ForwardToTargetView(View):
     """Redirect the user from short URL to the related target URL."""
+    http_method_names = ['get', 'head', 'options']
 
-    def get_redirect_url(self, *args, **kwargs):
-        key = kwargs.get('key')
-        mapping = get_object_or_404(Mapping.objects.active(), key=key)
-        mapping.increment_visits()
-        return mapping.target
+    async def get(self, request, key):
+        entry = await aresolve_target(key)
+        if entry is None:
+            raise Http404('No active mapping matches the given key.')
+
+        user_agent = request.headers.get('User-Agent', '')
+        record_click(key, request.headers.get('Referer', ''), user_agent, request.META.get('REMOTE_ADDR', ''))
+        record_trending(key)
+        target, _, guest = entry
+        # guest mappings do not count visits
+        if is_visit(request.method, user_agent, [request.headers.get(name) for name in PURPOSE_HEADERS]) and not guest:
+            await self.record_visit(request, key)
+        return HttpResponseRedirect(target)
+
+    @staticmethod
+    async def record_visit(request, key):
+        if isinstance(request, ASGIRequest):
+            record_visit_in_background(key)
+        else:
+            # under WSGI the event loop is closed with the response, pending tasks would be cancelled
+            await arecord_visit(key)
+
+    async def head(self, request, key):
+        return await self.get(request, key)
@@ -0,0 +1,221 @@
+"""
+Visit counting for the redirect path.
+
+With settings.MAPPING_VISITS_MODE = 'exact' every visit is an UPDATE of the mapping's row.
+With 'buffered' each process aggregates visits per key in memory and applies them in one batched
+UPDATE, either from a background timer every settings.MAPPING_VISITS_FLUSH_INTERVAL seconds or as soon
+as settings.MAPPING_VISITS_MAX_PENDING visits are pending. If a process crashes, at most the visits
+pending in its buffer are lost, which is bounded by both settings.
+
+Under ASGI, visits are counted after the response, see record_visit_in_background().
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from asgiref.sync import (
+    SyncToAsync,
+    ThreadSensitiveContext,
+    sync_to_async,
+)
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    close_old_connections,
+    connection,
+)
+
+from apps.mappings.metrics import Counters
+from apps.mappings.models import Mapping
+
+app_log = logging.getLogger('urlcut.apps.mappings')
+
+# max number of keys updated by a single statement
+UPDATE_BATCH_SIZE = 1000
+
+
+def apply_visits(deltas):
+    """
+    Add the given ``{key: count}`` deltas to the mappings' visits, using one
+    ``UPDATE ... FROM (VALUES ...)`` per batch of UPDATE_BATCH_SIZE keys.
+    """
+    table = connection.ops.quote_name(Mapping._meta.db_table)
+    # sorting keys makes concurrent flushes lock rows in the same order
+    items = sorted(deltas.items())
+    for i in range(0, len(items), UPDATE_BATCH_SIZE):
+        batch = items[i:i + UPDATE_BATCH_SIZE]
+        values = ', '.join(['(%s, %s)'] * len(batch))
+        params = [param for item in batch for param in item]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET visits = {table}.visits + v.delta '
+                f'FROM (VALUES {values}) AS v(key, delta) '
+                f'WHERE {table}.key = v.key',
+                params
+            )
+
+
+class VisitBuffer:
+    """In-memory, per-process buffer of visit counts, periodically flushed to the database."""
+
+    def __init__(self):
+        self.counters = Counters()
+        self._deltas = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._timer_pid = None
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def add(self, key, count=1):
+        if self._add(key, count):
+            self.flush()
+
+    async def aadd(self, key, count=1):
+        if self._add(key, count):
+            await sync_to_async(self.flush)()
+
+    def add_nowait(self, key, count=1):
+        """Buffer the visits without ever flushing in the caller: a full buffer wakes the flush timer instead."""
+        if self._add(key, count):
+            self._wake.set()
+
+    def _add(self, key, count):
+        """Buffer the visits, returning whether settings.MAPPING_VISITS_MAX_PENDING has been reached."""
+        with self._lock:
+            self._deltas[key] += count
+            self._pending += count
+            full = self._pending >= settings.MAPPING_VISITS_MAX_PENDING
+        self._ensure_timer()
+        return full
+
+    def drain(self):
+        """Return the pending deltas, emptying the buffer."""
+        with self._lock:
+            deltas, self._deltas = self._deltas, Counter()
+            self._pending = 0
+        return deltas
+
+    def flush(self):
+        """Apply the pending deltas, or hand them to a Celery task with settings.MAPPING_VISITS_FLUSH_VIA_CELERY."""
+        deltas = self.drain()
+        if not deltas:
+            return 0
+        count = sum(deltas.values())
+        try:
+            if settings.MAPPING_VISITS_FLUSH_VIA_CELERY:
+                from apps.mappings.tasks import apply_visit_deltas
+                apply_visit_deltas.delay(dict(deltas))
+            else:
+                apply_visits(deltas)
+        except Exception as e:
+            # the database or the broker (kombu.exceptions.OperationalError) failed: put the deltas back,
+            # they will be retried by the next flush
+            with self._lock:
+                self._deltas.update(deltas)
+                self._pending += count
+            self.counters.incr('flush_errors')
+            app_log.error(f'VisitBuffer - Error flushing {count} visits: {e}')
+            return 0
+        self.counters.incr('flushes')
+        self.counters.incr('flushed_visits', count)
+        return count
+
+    def stats(self):
+        return {
+            'pending': self._pending,
+            **self.counters.snapshot(),
+        }
+
+    def _ensure_timer(self):
+        # the timer thread does not survive a fork, so it is started once per process; without a flush
+        # interval, it only flushes when woken by add_nowait()
+        if self._timer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._timer_pid == os.getpid():
+                return
+            self._timer_pid = os.getpid()
+        interval = settings.MAPPING_VISITS_FLUSH_INTERVAL or None
+        threading.Thread(target=self._run_timer, args=(interval,), name='visits-flush', daemon=True).start()
+
+    def _run_timer(self, interval):
+        # the thread is never restarted in this process, so it must survive any error
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                app_log.exception('VisitBuffer - Error in the flush timer')
+
+
+visit_buffer = VisitBuffer()
+atexit.register(visit_buffer.flush)
+
+
+def record_visit(key):
+    """Count a visit to the mapping with the given key, according to settings.MAPPING_VISITS_MODE."""
+    if settings.MAPPING_VISITS_MODE == 'buffered':
+        visit_buffer.add(key)
+    else:
+        Mapping.objects.filter(key=key).increment_visits()
+
+
+async def arecord_visit(key):
+    """Asynchronous version of record_visit()."""
+    if settings.MAPPING_VISITS_MODE == 'buffered':
+        await visit_buffer.aadd(key)
+    else:
+        await Mapping.objects.filter(key=key).aincrement_visits()
+
+
+# strong references to the visit updates running in the background, until they are done
+background_visits = set()
+
+# context of the thread running the visit updates in the background, shared by all of them
+background_context = ThreadSensitiveContext()
+
+
+def record_visit_in_background(key):
+    """
+    Count a visit without making the response wait for it, from the running event loop, as under ASGI.
+    Buffered visits are only added to the buffer. Exact updates run from tasks of the event loop, on one thread
+    and connection shared by all of them; past settings.MAPPING_VISITS_MAX_BACKGROUND pending updates, the visit
+    is buffered instead, so that a burst of redirects cannot pile up tasks.
+    """
+    busy = len(background_visits) >= settings.MAPPING_VISITS_MAX_BACKGROUND
+    if settings.MAPPING_VISITS_MODE == 'buffered' or busy:
+        visit_buffer.add_nowait(key)
+        return
+    task = asyncio.create_task(_arecord_visit_in_background(key))
+    background_visits.add(task)
+    task.add_done_callback(background_visits.discard)
+
+
+async def _arecord_visit_in_background(key):
+    # tasks copy the context they are created in, so this only applies to the update
+    SyncToAsync.thread_sensitive_context.set(background_context)
+    await sync_to_async(_record_exact_visit)(key)
+
+
+def _record_exact_visit(key):
+    try:
+        Mapping.objects.filter(key=key).increment_visits()
+    except DatabaseError:
+        # the connection of the thread is kept across visits: drop it if it broke, the next visit reconnects
+        _close_connection()
+        raise
+
+
+def _close_connection():
+    """Close the database connection of the current thread, unless a transaction is using it."""
+    if not connection.in_atomic_block:
+        connection.close()
@@ -9,8 +9,19 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+
+from urlcut.handlers import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'urlcut.settings')
 
-application = get_asgi_application()
+# like get_asgi_application(), with Django's handler streaming responses off the event loop
+django.setup(set_prefix=False)
+application = ASGIHandler()
+
+if settings.MAPPING_ASGI_FAST_REDIRECT:
+    # imported after Django is set up, as it loads models
+    from apps.mappings.asgi import ForwardToTargetApplication
+
+    application = ForwardToTargetApplication(application)
@@ -0,0 +1,38 @@
+"""
+Request handlers for the urlcut project.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Django's ASGI handler, producing the parts of streaming responses in the thread of the request.
+
+    Django 4.1 iterates streaming responses within the event loop, where the queries of a streamed export fail
+    (SynchronousOnlyOperation) and any blocking I/O stalls the other requests. Here each part is produced
+    through sync_to_async instead, on the same thread as the view, so that server-side cursors keep their
+    connection.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header,
+             value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        next_part = sync_to_async(next, thread_sensitive=True)
+        # access __iter__ and not streaming_content, in case it has been overridden in a subclass
+        parts = iter(response)
+        while (part := await next_part(parts, None)) is not None:
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()